@@ -1,5 +1,10 @@
+import hashlib
+import json
+import os
+
 from buildbot.config import BuilderConfig
 from buildbot.plugins import util, steps
+from buildbot.process.results import SKIPPED
 from maxscale import workers
 from maxscale.builders.support import common
 from maxscale.config import constants
@@ -24,6 +29,67 @@ ENVIRONMENT = {
 }
 
 
+# Properties that define the packages produced by the build, builds with the same values share the artifacts
+ARTIFACT_KEY_PROPERTIES = ["got_revision", "box", "cmake_flags", "build_experimental"]
+
+# File in the directory of the target with the key of the packages uploaded to it. It is removed before
+# the packages are uploaded again, so the target is reused only while it holds the packages of its key
+ARTIFACT_KEY_FILE = ".artifact_key"
+# Location of the artifact directories relative to the targets, the links of the targets point there
+ARTIFACTS_LINK_PREFIX = os.path.relpath(constants.ARTIFACTS_PATH, constants.UPLOAD_PATH)
+
+# Prints where the target should point to get the packages of the same key: the name of the target itself
+# if it already holds them, otherwise the artifact directory of the key. The target of the build may be
+# replaced only if it does not exist or is a link.
+FIND_CACHED_TARGET_COMMAND = (
+    'target=' + constants.UPLOAD_PATH + '/%(prop:target)s; '
+    'if [ ! -L "$target" ] && [ "$(cat "$target/' + ARTIFACT_KEY_FILE + '" 2>/dev/null)" = "%(prop:artifactKey)s" ]; '
+    'then echo "%(prop:target)s"; '
+    'elif [ -d ' + constants.ARTIFACTS_PATH + '/%(prop:artifactKey)s ] && { [ ! -e "$target" ] || [ -L "$target" ]; }; '
+    'then echo "' + ARTIFACTS_LINK_PREFIX + '/%(prop:artifactKey)s"; fi'
+)
+
+# Keeps a copy of the uploaded packages in the artifact directory of the key. Files are hard links, so the copy
+# takes no space, and rsync replaces files of the target instead of changing them, so the copy never changes.
+# The directory of the key is created once, links of other targets to it stay valid.
+RECORD_ARTIFACTS_COMMAND = (
+    'target=' + constants.UPLOAD_PATH + '/%(prop:target)s; '
+    'artifacts=' + constants.ARTIFACTS_PATH + '/%(prop:artifactKey)s; '
+    'echo "%(prop:artifactKey)s" > "$target/' + ARTIFACT_KEY_FILE + '" && '
+    '{ [ -d "$artifacts" ] || { mkdir -p ' + constants.ARTIFACTS_PATH + ' && rm -rf "$artifacts.$$" && '
+    'cp -al "$target" "$artifacts.$$" && mv -T "$artifacts.$$" "$artifacts"; }; }'
+)
+
+
+@util.renderer
+def artifactCacheKey(properties):
+    """Hash of the sources and the options of the build"""
+    values = [properties.getProperty(name) for name in ARTIFACT_KEY_PROPERTIES]
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+def extractCachedTarget(rc, stdout, stderr):
+    """Take the name of the target the packages of the same key have been uploaded to, None if there is none"""
+    lines = stdout.strip().splitlines()
+    return {"cachedTarget": lines[-1].strip() if rc == 0 and lines else None}
+
+
+def isBuildCached(step):
+    return bool(step.getProperty("cachedTarget"))
+
+
+def isBuildNotCached(step):
+    return not isBuildCached(step)
+
+
+def shouldLinkTarget(step):
+    return isBuildCached(step) and step.getProperty("cachedTarget") != step.getProperty("target")
+
+
+def shouldDestroyBuildVirtualMachine(step):
+    return isBuildNotCached(step) and common.shouldDestroyVirtualMachines(step)
+
+
 @util.renderer
 def configureBuildProperties(properties):
     return {
@@ -38,22 +104,63 @@ def createBuildSteps():
     buildSteps.extend(common.configureMdbciVmPathProperty())
     buildSteps.append(steps.SetProperties(properties=configureBuildProperties))
     buildSteps.extend(common.cloneRepository())
+    buildSteps.extend(common.configureTimeouts())
+    buildSteps.append(steps.SetProperty(
+        name="Compute the artifact key of the build",
+        property="artifactKey",
+        value=artifactCacheKey,
+        hideStepIf=True,
+    ))
+    buildSteps.append(common.runSshCommand(
+        name="Find the packages of the same sources and options on the repo server",
+        host=util.Property("upload_server"),
+        command=[util.Interpolate(FIND_CACHED_TARGET_COMMAND)],
+        stepClass=steps.SetPropertyFromCommand,
+        extract_fn=extractCachedTarget,
+        doStepIf=lambda step: step.getProperty("use_build_cache") != "no",
+        haltOnFailure=False,
+        flunkOnFailure=False,
+    ))
+    buildSteps.append(common.runSshCommand(
+        name=util.Interpolate("Point the target at the packages of %(prop:cachedTarget)s"),
+        host=util.Property("upload_server"),
+        command=["ln", "-sfn", util.Property("cachedTarget"),
+                 util.Interpolate(constants.UPLOAD_PATH + '/%(prop:target)s')],
+        doStepIf=shouldLinkTarget,
+        hideStepIf=lambda results, s: results == SKIPPED,
+    ))
     buildSteps.append(steps.ShellCommand(
         name="Build MaxScale using MDBCI",
         command=['/bin/bash', '-c', 'BUILD/mdbci/build.sh || BUILD/mdbci/build.sh'],
         timeout=3600,
-        workdir=util.Interpolate("%(prop:builddir)s/build")
+        maxTime=common.stepMaxTime("Build MaxScale using MDBCI"),
+        workdir=util.Interpolate("%(prop:builddir)s/build"),
+        doStepIf=isBuildNotCached,
     ))
-    buildSteps.extend(common.destroyVirtualMachine())
+    buildSteps.extend(common.destroyVirtualMachine(doStepIf=shouldDestroyBuildVirtualMachine))
     buildSteps.append(common.runSshCommand(
         name="Make dir for build results on the repo server",
         host=util.Property("upload_server"),
-        command=["mkdir", "-p", util.Interpolate(constants.UPLOAD_PATH + '/%(prop:target)s')],
+        # The target may be a link to the packages of another build
+        command=["test", "-L", util.Interpolate(constants.UPLOAD_PATH + '/%(prop:target)s'),
+                 "&&", "rm", util.Interpolate(constants.UPLOAD_PATH + '/%(prop:target)s'), ";",
+                 "mkdir", "-p", util.Interpolate(constants.UPLOAD_PATH + '/%(prop:target)s'), "&&",
+                 "rm", "-f", util.Interpolate(constants.UPLOAD_PATH + '/%(prop:target)s/' + ARTIFACT_KEY_FILE)],
+        doStepIf=isBuildNotCached,
     ))
     buildSteps.append(common.rsyncViaSsh(
         name="Rsync builds results to the repo server",
         local=util.Interpolate("%(prop:builddir)s/repository/%(prop:target)s/mariadb-maxscale/"),
-        remote=util.Interpolate("%(prop:upload_server)s:" + constants.UPLOAD_PATH + "/%(prop:target)s/")
+        remote=util.Interpolate("%(prop:upload_server)s:" + constants.UPLOAD_PATH + "/%(prop:target)s/"),
+        doStepIf=isBuildNotCached,
+    ))
+    buildSteps.append(common.runSshCommand(
+        name="Record the packages in the artifact cache",
+        host=util.Property("upload_server"),
+        command=[util.Interpolate(RECORD_ARTIFACTS_COMMAND)],
+        doStepIf=isBuildNotCached,
+        haltOnFailure=False,
+        flunkOnFailure=False,
     ))
     buildSteps.append(common.generateMdbciRepositoryForTarget())
     buildSteps.extend(common.syncRepod())
@@ -61,6 +168,7 @@ def createBuildSteps():
         name="Upgrade test",
         command=['BUILD/mdbci/upgrade_test.sh'],
         timeout=1800,
+        maxTime=common.stepMaxTime("Upgrade test"),
         doStepIf=(util.Property('run_upgrade_test') == 'yes'),
         workdir=util.Interpolate("%(prop:builddir)s/build")
     ))
@@ -1,9 +1,18 @@
+import collections
+import heapq
 import os
+import re
+import statistics
+import time
 
 from buildbot.plugins import util, steps
 from buildbot.config import BuilderConfig
 from buildbot.process.factory import BuildFactory
+from twisted.internet import defer
+from twisted.python import log
 from maxscale import workers
+from maxscale.change_source.maxscale import get_test_set_by_branch
+from maxscale.config import constants
 from .support import common
 
 COMMON_PROPERTIES = {
@@ -47,17 +56,292 @@ MAXSCALE_TEST_SETS = [
 ]
 
 
+# Backend labels the tests are grouped by when the test sets are created from the test durations
+TEST_GROUPS = [
+    {
+        "name": "master-slave",
+        "labels": "-L REPL_BACKEND -LE 'GALERA_BACKEND|BREAKS_REPL|UNSTABLE|BIG_REPL_BACKEND|CLUSTRIX_BACKEND'"
+    },
+    {
+        "name": "galera",
+        "labels": "-L GALERA_BACKEND -LE 'REPL_BACKEND|BREAKS_REPL|UNSTABLE|BIG_REPL_BACKEND|CLUSTRIX_BACKEND'"
+    },
+    {
+        "name": "breaks_backend",
+        "labels": "-L 'BREAKS_REPL|BIG_REPL_BACKEND'"
+    },
+    {
+        "name": "clustrix_backend",
+        "labels": "-L 'CLUSTRIX_BACKEND'"
+    },
+]
+
+STATIC_SHARDING = "static"
+DURATION_SHARDING = "duration"
+
+# Number of the latest run_test runs the test durations are taken from
+DURATION_HISTORY_RUNS = 100
+DURATION_HISTORY_QUERY = """
+    SELECT recent_runs.jenkins_id, results.test, results.test_time
+    FROM results
+    JOIN (SELECT id, jenkins_id FROM test_run WHERE job_name = %s ORDER BY id DESC LIMIT %s) AS recent_runs
+        ON results.id = recent_runs.id
+    WHERE results.test_time > 0
+    """
+
+# Test sets of the finished run_test builds mapped by the build number
+RUN_TEST_SETS = {}
+
+# Number of the latest builds searched for the previous full run of the branch
+SELECTION_HISTORY_BUILDS = 100
+# Build property with the test selection the build has used, the schedule of the full runs is derived from it
+TEST_SELECTION_RUN_PROPERTY = "test_selection_run"
+
+TEST_SELECTION_ARGUMENTS = re.compile(r"\s*(?<!\S)-[IRE]\s+('[^']*'|\S+)")
+
+FULL_SELECTION = "full"
+IMPACT_SELECTION = "impact"
+
+TestImpact = collections.namedtuple("TestImpact", ["full", "labels", "tests"])
+
+
+def testGroupOf(testSet):
+    """Name of the group from TEST_GROUPS the test set belongs to, None if it does not match any"""
+    labels = TEST_SELECTION_ARGUMENTS.sub("", testSet or "").strip()
+    for group in TEST_GROUPS:
+        if group["labels"] == labels:
+            return group["name"]
+    return None
+
+
+def testNamesRegex(names):
+    """Regular expression for ctest -R and -E options that matches exactly the given tests"""
+    return "^({})$".format("|".join(re.sub(r"([][.*+?^$|()\\])", r"\\\1", name) for name in sorted(names)))
+
+
+def packTests(durations, shardCount):
+    """
+    Split the tests into shards with the longest-processing-time-first rule:
+    the longest of the remaining tests goes to the shard with the least work
+    :param durations: dictionary with the test names mapped to the expected duration
+    :param shardCount: maximum number of shards to create
+    :return: list of the shards that have tests as (duration, list of tests) tuples
+    """
+    shards = [(0, index, []) for index in range(shardCount)]
+    for name, duration in sorted(durations.items(), key=lambda item: (-item[1], item[0])):
+        total, index, tests = heapq.heappop(shards)
+        tests.append(name)
+        heapq.heappush(shards, (total + duration, index, tests))
+    return [(total, tests) for total, _, tests in sorted(shards, key=lambda shard: shard[1]) if tests]
+
+
+def createDurationTestSets(groupDurations, shardCount):
+    """
+    Create test sets that take about the same time to run from the durations of the tests.
+    Each group gets at least one test set, the rest go to the groups that take the longest time per test set.
+    Tests that are not in the history run in the shortest test set of their group.
+    :param groupDurations: dictionary with group names mapped to the dictionaries of test durations
+    :param shardCount: number of test sets to create
+    :return: list of test sets in the format of MAXSCALE_TEST_SETS
+    """
+    totals = {group["name"]: sum(groupDurations.get(group["name"], {}).values()) for group in TEST_GROUPS}
+    counts = {name: 1 for name in totals}
+    for _ in range(shardCount - len(TEST_GROUPS)):
+        name = max(counts, key=lambda groupName: totals[groupName] / counts[groupName])
+        counts[name] += 1
+
+    testSets = []
+    for group in TEST_GROUPS:
+        shards = packTests(groupDurations.get(group["name"], {}), counts[group["name"]])
+        if len(shards) < 2:
+            testSets.append({"name": group["name"], "test_set": group["labels"]})
+            continue
+        catchAll = min(range(len(shards)), key=lambda index: shards[index][0])
+        for index, (_, tests) in enumerate(shards):
+            if index == catchAll:
+                excluded = [test for otherIndex, (_, otherTests) in enumerate(shards)
+                            if otherIndex != catchAll for test in otherTests]
+                testSet = "{} -E '{}'".format(group["labels"], testNamesRegex(excluded))
+            else:
+                testSet = "{} -R '{}'".format(group["labels"], testNamesRegex(tests))
+            testSets.append({"name": "{}{}".format(group["name"], index + 1), "test_set": testSet})
+    return testSets
+
+
+def changeImpact(files, rules=constants.TEST_IMPACT_RULES):
+    """
+    Find the ctest labels and tests affected by the changed files
+    :param files: paths of the changed files relative to the root of the repository
+    :param rules: list of rules in the format of constants.TEST_IMPACT_RULES
+    :return: TestImpact, full is True if all tests should run
+    """
+    if not files:
+        return TestImpact(True, set(), set())
+    labels = set()
+    tests = set()
+    for path in files:
+        for rule in rules:
+            match = re.search(rule["path"], path)
+            if match:
+                break
+        else:
+            return TestImpact(True, set(), set())
+        if rule.get("full"):
+            return TestImpact(True, set(), set())
+        labels.update(match.expand(label) for label in rule.get("labels", []))
+        tests.update(match.expand(test) for test in rule.get("tests", []))
+    return TestImpact(False, labels, tests)
+
+
+def createImpactTestSets(impact, branchTestSet=None):
+    """
+    Create test sets that run only the affected tests. Ctest runs the tests that match both the labels and the names,
+    so the tests selected by labels and by names go to separate test sets.
+    :param impact: TestImpact of the changes
+    :param branchTestSet: test set of the branch, its label exclusions apply to the selected tests
+    :return: list of test sets in the format of MAXSCALE_TEST_SETS
+    """
+    exclusions = TEST_SELECTION_ARGUMENTS.sub("", branchTestSet or "").strip()
+    testSets = []
+    if impact.labels:
+        labels = "|".join(sorted(impact.labels))
+        testSets.append({"name": "impact-labels", "test_set": "-L '{}' {}".format(labels, exclusions).strip()})
+    if impact.tests:
+        testSet = "-R '{}' {}".format(testNamesRegex(impact.tests), exclusions).strip()
+        testSets.append({"name": "impact-tests", "test_set": testSet})
+    return testSets
+
+
+def isFullRunDue(history, now, interval=constants.IMPACT_FULL_RUN_INTERVAL,
+                 maxAge=constants.IMPACT_FULL_RUN_MAX_AGE):
+    """
+    Check whether the branch should run all tests instead of the affected ones
+    :param history: (test selection, start time) of the previous builds of the branch, the latest first
+    :param now: current time in seconds since the epoch
+    :return: True if there have been interval builds with the selected tests since the last full run, the full run
+             is older than maxAge or it is not in the history
+    """
+    for selectiveRuns, (selection, startTime) in enumerate(history):
+        if selectiveRuns >= interval:
+            return True
+        if selection == FULL_SELECTION:
+            return now - startTime > maxAge
+    return True
+
+
 class ParallelRunTestTrigger(steps.Trigger):
     """
     Special trigger that allows to spawn a run_test task with "test_set" and "name"
     arguments specified for each of the triggered task.
+    With the duration sharding the test sets are created from the durations of the tests in the previous runs.
+    With the impact selection only the tests affected by the changes of the build are run.
     """
-    def __init__(self, **kwargs):
+    renderables = ["sharding", "shardCount", "testSelection"]
+
+    def __init__(self, sharding=STATIC_SHARDING, shardCount=len(MAXSCALE_TEST_SETS), testSelection=FULL_SELECTION,
+                 **kwargs):
         super().__init__(**kwargs)
+        self.sharding = sharding
+        self.shardCount = shardCount
+        self.testSelection = testSelection
+
+    @defer.inlineCallbacks
+    def getTestDurations(self):
+        """
+        Read the durations of the tests run by build_and_test_parall from the results database
+        :return: dictionary with test group names mapped to the dictionaries of median test durations
+        """
+        ingestionService = self.master.service_manager.namedServices.get(constants.RESULTS_INGESTION_SERVICE)
+        if ingestionService is None:
+            return {}
+        rows = yield ingestionService.runQuery(DURATION_HISTORY_QUERY, ("run_test", DURATION_HISTORY_RUNS))
+        if not rows:
+            return {}
+        builderId = yield self.master.data.updates.findBuilderId("run_test")
+        durations = {}
+        for row in rows:
+            number = int(row["jenkins_id"])
+            if number not in RUN_TEST_SETS:
+                buildProperties = yield self.master.data.get(("builders", builderId, "builds", number, "properties"))
+                testSet = (buildProperties or {}).get("test_set")
+                RUN_TEST_SETS[number] = testGroupOf(testSet[0]) if testSet else None
+            group = RUN_TEST_SETS[number]
+            if group is not None:
+                durations.setdefault(group, {}).setdefault(row["test"], []).append(row["test_time"])
+        return {group: {test: statistics.median(times) for test, times in tests.items()}
+                for group, tests in durations.items()}
+
+    @defer.inlineCallbacks
+    def getSelectionHistory(self, branch):
+        """
+        Read the test selections of the previous builds of the branch from their properties, so the schedule
+        of the full runs survives the reconfiguration and the restart of the master
+        :return: list of (test selection, start time) tuples, the latest build first
+        """
+        builderId = yield self.build.builder.getBuilderId()
+        builds = yield self.master.data.get(("builders", builderId, "builds"), order=["-number"],
+                                            limit=SELECTION_HISTORY_BUILDS)
+        history = []
+        for build in builds:
+            if build["buildid"] == self.build.buildid:
+                continue
+            buildProperties = yield self.master.data.get(("builds", build["buildid"], "properties"))
+            buildProperties = buildProperties or {}
+            selection = buildProperties.get(TEST_SELECTION_RUN_PROPERTY)
+            if selection and buildProperties.get("branch", (None,))[0] == branch:
+                history.append((selection[0], build["started_at"].timestamp()))
+        return history
+
+    @defer.inlineCallbacks
+    def recordTestSelection(self, selection):
+        """Store the test selection in the database at once, the builds started meanwhile take it into account"""
+        self.setProperty(TEST_SELECTION_RUN_PROPERTY, selection, self.name)
+        yield self.master.data.updates.setBuildProperty(self.build.buildid, TEST_SELECTION_RUN_PROPERTY,
+                                                        selection, self.name)
+
+    @defer.inlineCallbacks
+    def getImpactTestSets(self):
+        """Test sets with the tests affected by the changes of the build, None if all tests should run"""
+        branch = self.getProperty("branch")
+        files = self.build.allFiles()
+        impact = changeImpact(files)
+        fullRunDue = False
+        if not impact.full:
+            history = yield self.getSelectionHistory(branch)
+            fullRunDue = isFullRunDue(history, time.time())
+        if impact.full or fullRunDue:
+            yield self.recordTestSelection(FULL_SELECTION)
+            yield self.addCompleteLog("test selection", "All tests run, {}\n".format(
+                "the changes affect all of them" if impact.full else "the periodic full run is due"))
+            return None
+        yield self.recordTestSelection(IMPACT_SELECTION)
+        testSets = createImpactTestSets(impact, get_test_set_by_branch(branch))
+        yield self.addCompleteLog("test selection", "Changed files:\n{}\n\nTest sets:\n{}\n".format(
+            "\n".join(sorted(files)), "\n".join(testSet["test_set"] for testSet in testSets) or "none"))
+        return testSets
+
+    @defer.inlineCallbacks
+    def getTestSets(self):
+        if self.testSelection == IMPACT_SELECTION:
+            testSets = yield self.getImpactTestSets()
+            if testSets is not None:
+                return testSets
+        if self.sharding != DURATION_SHARDING:
+            return MAXSCALE_TEST_SETS
+        try:
+            durations = yield self.getTestDurations()
+        except Exception:
+            log.err(None, "Unable to read test durations, using the static test sets")
+            return MAXSCALE_TEST_SETS
+        if not durations:
+            return MAXSCALE_TEST_SETS
+        return createDurationTestSets(durations, max(int(self.shardCount), len(TEST_GROUPS)))
 
+    @defer.inlineCallbacks
     def getSchedulersAndProperties(self):
         schedulers = []
-        for testSet in MAXSCALE_TEST_SETS:
+        testSets = yield self.getTestSets()
+        for testSet in testSets:
             propertiesToSet = self.set_properties.copy()
             propertiesToSet.update({
                 "test_set": testSet["test_set"],
@@ -99,6 +383,9 @@ def create_factory():
     })
     factory.addStep(ParallelRunTestTrigger(
         name="Call the 'run_test' for each test set",
+        sharding=util.Property("test_sharding", default=STATIC_SHARDING),
+        shardCount=util.Property("test_shards", default=len(MAXSCALE_TEST_SETS)),
+        testSelection=util.Property("test_selection", default=FULL_SELECTION),
         schedulerNames=['run_test'],
         waitForFinish=True,
         set_properties=runTestProperties,
@@ -62,6 +62,7 @@ def createRunTestSteps():
     testSteps.extend(common.downloadAndRunScript(
         name="Run performance tests",
         scriptName="run_performance_test.py",
+        extraFiles=["log_tee.py"],
         args=[
             "--build_dir", util.Property("builddir"),
             "--build_number", util.Property("buildnumber"),
@@ -39,12 +39,19 @@ def configureCommonProperties(properties):
     return {
         "buildLogFile": util.Interpolate("%(prop:builddir)s/build_log_%(prop:buildnumber)s"),
         "resultFile": util.Interpolate("result_%(prop:buildnumber)s"),
-        "jsonResultsFile": util.Interpolate("%(prop:builddir)s/json_%(prop:buildnumber)s"),
+        "jsonResultsFile": util.Interpolate("%(prop:builddir)s/json_%(prop:buildnumber)s.gz"),
         "mdbciConfig": util.Interpolate("%(prop:MDBCI_VM_PATH)s/%(prop:name)s"),
         "upload_server": constants.UPLOAD_SERVERS[properties.getProperty("host")],
         "testId": testId,
         "logDirectory": logDirectory,
         "coreDumpsLog": coreDumpsLog,
+        "coreDumpsIndex": util.Interpolate("%(prop:builddir)s/coredumps_index_%(prop:buildnumber)s.json"),
+        "ctestSublogsPath": util.Interpolate(
+            "%(prop:builddir)s/%(prop:buildername)s-%(prop:buildnumber)s/ctest_sublogs"),
+        "liveResultsFile": util.Interpolate("%(prop:builddir)s/live_results_%(prop:buildnumber)s.json"),
+        "parsedLogState": util.Interpolate("%(prop:builddir)s/parsed_log_%(prop:buildnumber)s.json"),
+        "testTimeoutsFile": util.Interpolate("%(prop:builddir)s/test_timeouts_%(prop:buildnumber)s.json"),
+        "rerunLogFile": util.Interpolate("%(prop:builddir)s/rerun_log_%(prop:buildnumber)s"),
         "mdbciVMPath": util.Interpolate("%(prop:name)s_vms"),
     }
 
@@ -59,12 +66,20 @@ def createTestFactory():
         properties=configureCommonProperties,
     ))
     factory.addSteps(common.cloneRepository())
+    factory.addSteps(common.configureTimeouts(util.Property("testTimeoutsFile")))
     factory.addStep(common.generateMdbciRepositoryForTarget())
     factory.addSteps(common.remoteRunScriptAndLog(
         name="Run MaxScale tests",
         scriptName="run_test_vm.sh",
         logFile=util.Property("buildLogFile"),
         resultFile=util.Property("resultFile"),
+        extraArguments=[
+            "--ctest_sublogs_path", util.Property("ctestSublogsPath"),
+            "--ctest_results_file", util.Property("liveResultsFile"),
+            "--parsed_log_state", util.Property("parsedLogState"),
+            "--test_timeouts", util.Property("testTimeoutsFile"),
+            "--rerun_log", util.Property("rerunLogFile"),
+        ],
     ))
     factory.addSteps(common.downloadAndRunScript(
         name="Parse ctest results log and save it to logs directory",
@@ -73,8 +88,10 @@ def createTestFactory():
             util.Property("buildLogFile"),
             "--output-log-file", util.Interpolate("%(prop:builddir)s/results_%(prop:buildnumber)s"),
             "--human-readable", "--only-failed",
-            "--output-log-json-file", util.Property("jsonResultsFile"),
-            "--ctest-sublogs-path", util.Interpolate("%(prop:builddir)s/%(prop:buildername)s-%(prop:buildnumber)s/ctest_sublogs"),
+            "--output-log-json-file", util.Property("jsonResultsFile"), "--compact-json",
+            "--ctest-sublogs-path", util.Property("ctestSublogsPath"),
+            "--parsed-log-state", util.Property("parsedLogState"),
+            "--rerun-log", util.Property("rerunLogFile"),
             "--store-directory", util.Interpolate("%(prop:HOME)s/LOGS/results_%(prop:buildnumber)s/LOGS")
         ],
         alwaysRun=True
@@ -87,12 +104,13 @@ def createTestFactory():
             "--remote-prefix", util.Interpolate("%(kw:server)s%(prop:testId)s/",
                                                 server=constants.CI_SERVER_LOGS_URL),
             "--output-file", util.Property("coreDumpsLog"),
+            "--index-file", util.Property("coreDumpsIndex"),
         ],
         haltOnFailure=False,
         flunkOnFailure=False,
         alwaysRun=True
     ))
-    factory.addSteps(common.writeBuildsResults())
+    factory.addSteps(common.queueBuildResults(coreDumpIndexFile=util.Property("coreDumpsIndex")))
     factory.addStep(
         common.StdoutShellCommand(
             name="test_result",
@@ -121,6 +139,7 @@ def createTestFactory():
         alwaysRun=True,
     ))
     factory.addSteps(common.destroyAllConfigurations(util.Interpolate("%(prop:HOME)s/%(prop:name)s_vms")))
+    factory.addSteps(common.checkBuildResults())
     factory.addSteps(common.cleanBuildDir())
     return factory
 
@@ -1,27 +1,57 @@
 import datetime
+import gzip
+import json
+import os
 import uuid
+from buildbot.data import resultspec
 from buildbot.plugins import util, steps
 from buildbot.process.buildstep import ShellMixin
-from buildbot.process.results import SKIPPED
+from buildbot.process.results import SKIPPED, SUCCESS, WARNINGS, FAILURE
 from buildbot.steps.shell import ShellCommand
 from buildbot.steps.shellsequence import ShellSequence
 from buildbot.steps.trigger import Trigger
-from twisted.internet import defer
+from twisted.internet import defer, threads
 from maxscale.builders.support import support
+from maxscale.builders.support.scripts import test_durations
 from maxscale.change_source.maxscale import get_test_set_by_branch
 from maxscale import workers
 from enum import IntEnum
 from maxscale.config import constants
 
 
-def cloneRepository():
-    """Clone MaxScale repository using default configuration options"""
-    return [steps.Git(
+def cloneRepository(depth=constants.GIT_CLONE_DEPTH):
+    """
+    Clone MaxScale repository using default configuration options. The shared mirror of the worker host
+    is updated first and the clone takes the objects from it, so only the new commits come over the network.
+    :param depth: number of commits to clone, the whole history is cloned if it is not set
+    """
+    buildSteps = downloadAndRunScript(
+        name="Update the repository mirror on the worker host",
+        scriptName="update_git_mirror.py",
+        args=["--repository", util.Property("repository")],
+        stepClass=steps.SetPropertyFromCommand,
+        extract_fn=extractGitReference,
+        haltOnFailure=False,
+        flunkOnFailure=False,
+        warnOnFailure=True,
+    )
+    buildSteps.append(steps.Git(
         name=util.Interpolate("Clone repository '%(prop:repository)s', branch '%(prop:branch)s'"),
         repourl=util.Property('repository'),
         branch=util.Property('branch'),
         mode='incremental',
-        haltOnFailure=True)]
+        reference=util.Property("gitReference"),
+        shallow=depth or False,
+        haltOnFailure=True))
+    return buildSteps
+
+
+def extractGitReference(rc, stdout, stderr):
+    """Take the path of the mirror printed by update_git_mirror.py, the clone goes without it if the update failed"""
+    lines = stdout.strip().splitlines()
+    if rc != 0 or not lines:
+        return {"gitReference": None}
+    return {"gitReference": lines[-1].strip()}
 
 
 def cleanBuildDir():
@@ -46,12 +76,103 @@ def configureMdbciVmPathProperty():
     return buildSteps
 
 
+# Number of the previous builds the time limits of the steps are computed from
+STEP_HISTORY_BUILDS = 20
+STEP_TIMEOUT_FLOOR = 1800
+# Steps that are run less times than this are not limited
+MIN_STEP_SAMPLES = 5
+
+
+def stepMaxTime(stepName):
+    """
+    Renders the time limit of the step set by the ConfigureTimeouts step, the step is not limited without it
+    :param stepName: name of the step, names that are rendered at runtime are not supported
+    """
+    @util.renderer
+    def renderMaxTime(properties):
+        if not isinstance(stepName, str):
+            return None
+        return (properties.getProperty("stepTimeouts") or {}).get(stepName)
+    return renderMaxTime
+
+
+class ConfigureTimeouts(steps.BuildStep):
+    """
+    Set the time limits of the tests and steps from the durations in the previous runs.
+    The testTimeouts property is passed to the run_script_and_log.py which kills tests that run over the limit,
+    the stepTimeouts property sets maxTime of the steps that use stepMaxTime.
+    """
+    name = "Configure timeouts from the previous runs"
+
+    @defer.inlineCallbacks
+    def run(self):
+        if "yes" in (self.getProperty("use_valgrind"), self.getProperty("use_callgrind")):
+            # Durations of the normal runs are not relevant
+            self.setProperty("testTimeouts", {"default": None, "tests": {}}, self.name)
+            self.setProperty("stepTimeouts", {}, self.name)
+            self.descriptionDone = "Timeouts are not limited for valgrind runs"
+            return SKIPPED
+        testTimeouts = yield self.getTestTimeouts()
+        self.setProperty("testTimeouts", testTimeouts, self.name)
+        stepTimeouts = yield self.getStepTimeouts()
+        self.setProperty("stepTimeouts", stepTimeouts, self.name)
+        self.descriptionDone = "Limited {} tests and {} steps".format(len(testTimeouts["tests"]), len(stepTimeouts))
+        return SUCCESS
+
+    @defer.inlineCallbacks
+    def getTestTimeouts(self):
+        ingestionService = self.master.service_manager.namedServices.get(constants.RESULTS_INGESTION_SERVICE)
+        store = None
+        if ingestionService is not None:
+            store = ingestionService.testDurations or (yield ingestionService.refreshTestDurations())
+        if store is None:
+            return {"default": test_durations.DEFAULT_TEST_TIMEOUT, "tests": {}}
+        return test_durations.testTimeouts(store, self.getProperty("branch"), self.getProperty("box"),
+                                           self.getProperty("product"))
+
+    @defer.inlineCallbacks
+    def getStepTimeouts(self):
+        builderId = yield self.build.builder.getBuilderId()
+        builds = yield self.master.data.get(
+            ("builders", builderId, "builds"),
+            filters=[resultspec.Filter("complete", "eq", [True]),
+                     resultspec.Filter("results", "eq", [SUCCESS, WARNINGS, FAILURE])],
+            order=["-number"], limit=STEP_HISTORY_BUILDS)
+        durations = {}
+        for build in builds:
+            buildSteps = yield self.master.data.get(("builds", build["buildid"], "steps"))
+            for step in buildSteps:
+                if step["started_at"] and step["complete_at"] and step["results"] in (SUCCESS, WARNINGS, FAILURE):
+                    duration = (step["complete_at"] - step["started_at"]).total_seconds()
+                    durations.setdefault(step["name"], []).append(duration)
+        return {name: test_durations.timeLimit(test_durations.percentile(sorted(stepDurations), 0.95),
+                                               floor=STEP_TIMEOUT_FLOOR)
+                for name, stepDurations in durations.items() if len(stepDurations) >= MIN_STEP_SAMPLES}
+
+
+def configureTimeouts(testTimeoutsFile=None):
+    """
+    Set the time limits of the tests and the steps
+    :param testTimeoutsFile: file on the worker to put the time limits of the tests into
+    """
+    buildSteps = [ConfigureTimeouts(hideStepIf=lambda results, s: results == SKIPPED)]
+    if testTimeoutsFile is not None:
+        buildSteps.append(steps.StringDownload(
+            name="Transferring test timeouts to worker",
+            s=util.Transform(json.dumps, util.Property("testTimeouts")),
+            workerdest=testTimeoutsFile,
+            hideStepIf=True,
+        ))
+    return buildSteps
+
+
 def runMdbciCommand(name, *command):
     """Run the MDBCI with the specified command"""
     return steps.ShellCommand(
         name=name,
         command=[util.Interpolate("%(prop:HOME)s/mdbci/mdbci"), *command],
-        timeout=1800
+        timeout=1800,
+        maxTime=stepMaxTime(name),
     )
 
 
@@ -78,7 +199,7 @@ def shouldDestroyVirtualMachines(step):
     return True
 
 
-def destroyVirtualMachine(configurationName=util.Property("mdbciConfig")):
+def destroyVirtualMachine(configurationName=util.Property("mdbciConfig"), doStepIf=shouldDestroyVirtualMachines):
     """Destroy virtual machine if it was not destroyed after the build"""
     return downloadAndRunScript(
         scriptName="destroy_vm.py",
@@ -86,7 +207,7 @@ def destroyVirtualMachine(configurationName=util.Property("mdbciConfig")):
         args=["--configuration-name", configurationName],
         name="Destroy leftover VMs using MDBCI",
         alwaysRun=True,
-        doStepIf=shouldDestroyVirtualMachines,
+        doStepIf=doStepIf,
     )
 
 
@@ -226,23 +347,60 @@ def initNameProperty():
     ]
 
 
-def assignWorker(_builder, workerForBuilderList, buildRequest):
+def assignWorker(builder, workerForBuilderList, buildRequest, hostPool=None):
     """
     Returns available worker for a builder
-    filtered by the scheduler which triggered build and by the giver task-host mapping
+    filtered by the scheduler which triggered build and by the giver task-host mapping.
+    The host that has the most capacity left for the build is chosen first, only its workers are looked at.
+    The request stays in the queue when no host has capacity for it.
     See 'nextWorker' at http://docs.buildbot.net/current/manual/configuration/builders.html
-    """
-    workerNames = workers.workersOnHosts(buildRequest.properties.getProperty("host", default=""),
-                                         *buildRequest.properties.getProperty("buildHosts", default=[]))
-    for workerForBuilder in workerForBuilderList:
-        workerName = workerForBuilder.worker.workername
-        if workerForBuilder.isAvailable() and workerName in workerNames:
-            buildRequest.properties.setProperty("host", workers.workerToHostMap()[workerName],
-                                                "Assign worker")
+    :param hostPool: hosts to choose from when the build request does not specify the host
+    """
+    host = buildRequest.properties.getProperty("host", default="")
+    hosts = [name for name in (host, *buildRequest.properties.getProperty("buildHosts", default=[])) if name]
+    hosts = hosts or list(workers.REGISTRY.hostToWorkers)
+    if hostPool and not host:
+        hosts = [name for name in hosts if name in hostPool]
+    tracker = getHostLoadTracker(builder.master)
+    if tracker is not None:
+        hostScores = [(tracker.placementScore(name, builder.name), name) for name in hosts]
+        hosts = [name for _, name in sorted(hostScore for hostScore in hostScores if hostScore[0] is not None)]
+    for name in hosts:
+        workerForBuilder = availableWorkerOnHost(builder, name, workerForBuilderList)
+        if workerForBuilder is not None:
+            if tracker is not None:
+                tracker.reserve(workerForBuilder.worker.workername, builder.name)
+            return selectWorker(workerForBuilder, buildRequest)
+    return None
+
+
+def availableWorkerOnHost(builder, host, workerForBuilderList):
+    """Returns available worker of the builder on the host or None, other hosts are not looked at"""
+    for workerName in workers.REGISTRY.hostToWorkers.get(host, ()):
+        worker = builder.master.workers.namedServices.get(workerName)
+        workerForBuilder = worker.workerforbuilders.get(builder.name) if worker is not None else None
+        # Buildbot accepts only the workers from the list it has passed, the ones it has tried are removed from it
+        if workerForBuilder is not None and workerForBuilder.isAvailable() and \
+                workerForBuilder in workerForBuilderList:
             return workerForBuilder
+    return None
+
+
+def selectWorker(workerForBuilder, buildRequest):
+    """Sets the host property of the build request to the host of the selected worker"""
+    buildRequest.properties.setProperty("host", workers.REGISTRY.hostOf(workerForBuilder.worker.workername),
+                                        "Assign worker")
+    return workerForBuilder
+
+
+def getHostLoadTracker(master):
+    """Returns the tracker of builds running on each host or None if the service is not running"""
+    hostLoadService = master.service_manager.namedServices.get(constants.HOST_LOAD_SERVICE)
+    return hostLoadService.tracker if hostLoadService is not None else None
 
 
 def assignBestHost(hostPool):
+    hostPool = frozenset(hostPool)
 
     def selectWorkersFromHostPool(builder, workersForBuilders, buildRequest):
         """
@@ -252,55 +410,12 @@ def assignBestHost(hostPool):
         :param buildRequest: build request
         :return: List of workersForBuilders for a specific host
         """
-        # Proceed directly to worker assignment if host is specified
-        if buildRequest.properties.getProperty("host"):
-            return assignWorker(buildRequest, workersForBuilders, buildRequest)
-
-        workerToHostMap = workers.workerToHostMap()
-        hostToWorkersMap = {}
-        for name, host in workerToHostMap.items():
-            if host in hostPool or not hostPool:
-                hostToWorkersMap[host] = hostToWorkersMap.get(host, []) + [name]
-        workersForBuilders = list(filter(lambda wfb: workerToHostMap[wfb.worker.workername] in hostToWorkersMap,
-                                         workersForBuilders))
-        availableWFB = collectAvailableWorkers(workersForBuilders, workerToHostMap, hostToWorkersMap)
-        return assignWorker(builder, availableWFB, buildRequest)
+        # The host property of the request takes precedence over the pool
+        return assignWorker(builder, workersForBuilders, buildRequest, hostPool)
 
     return selectWorkersFromHostPool
 
 
-def findBestHost(workersForBuilders, workerToHostMap, hostToWorkersMap):
-    """
-    Finds host with least amount of tasks running on a builder
-    :param workersForBuilders: List of workerForBuilders
-    :param workerToHostMap: Map where each worker contains its host
-    :param hostToWorkersMap: Map where each host contains its workers
-    :return: Name of hosts
-    """
-    occupiedWorkers = dict(map(lambda item: (item[0], len(item[1])), hostToWorkersMap.items()))
-    for wfb in workersForBuilders:
-        if wfb.isAvailable():
-            occupiedWorkers[workerToHostMap[wfb.worker.workername]] -= 1
-    bestHost = sorted(occupiedWorkers.items(), key=lambda item: item[1])[0]
-    return bestHost[0]
-
-
-def collectAvailableWorkers(workersForBuilders, workerToHostMap, hostToWorkersMap):
-    """
-    Collects available workers from the least loaded host
-    :param workersForBuilders: List of workerForBuilders
-    :param workerToHostMap: Map where each worker contains its host
-    :param hostToWorkersMap: Map where each host contains its workers
-    :return: List of available workers on the best host
-    """
-    availableWFB = []
-    bestHost = findBestHost(workersForBuilders, workerToHostMap, hostToWorkersMap)
-    for wfb in workersForBuilders:
-        if wfb.worker.workername in hostToWorkersMap[bestHost]:
-            availableWFB.append(wfb)
-    return availableWFB
-
-
 def generateRepositories():
     """
     Runs 'mdbcu generate-product-repositories' command on a worker
@@ -374,56 +489,135 @@ def downloadScript(scriptName, hideStepIf=True, **kwargs):
     )]
 
 
-def writeBuildResultsToDatabase(**kwargs):
-    """Call the script to save results to the database"""
-    return [steps.SetPropertyFromCommand(
-        name="Save test results to the database",
-        command=[util.Interpolate("%(prop:builddir)s/scripts/write_build_results.py"),
-                 "--run-id", util.Property("buildId"),
-                 util.Property("jsonResultsFile"),
-                 "--database-info", util.Secret("dataBaseInfo.json")],
-        extract_fn=extractDatabaseBuildid,
-        **kwargs)]
-
-
-def extractDatabaseBuildid(rc, stdout, stderr):
-    keyPhrase = "LAST_WRITE_BUILD_RESULTS_ID"
-    for line in stdout.split("\n"):
-        if line.startswith(keyPhrase):
-            return {keyPhrase: line[len(keyPhrase) + 2:]}
-    return {}
-
-
-def remoteRunScriptAndLog(scriptName, logFile, resultFile, **kwargs):
+def remoteRunScriptAndLog(scriptName, logFile, resultFile, extraArguments=(), **kwargs):
     """
     Runs shell script which name is given in a property script_name
-    and save results to the log file
+    and save results to the log file. The step is not limited by its history: its duration depends on the test set,
+    the tests are limited one by one with the --test_timeouts argument.
+    :param extraArguments: arguments of the run_script_and_log.py to parse the ctest log while the script runs
     """
     service_script = "run_script_and_log.py"
-    actions = downloadScript(service_script)
+    actions = downloadScript("log_tee.py") + downloadScript("parse_ctest_log.py") + downloadScript(service_script)
     actions.append(
         steps.ShellCommand(command=[
             util.Interpolate("%(prop:builddir)s/scripts/{script}".format(script=service_script)),
             "--script_name", scriptName,
             "--log_file", logFile,
-            "--result_file", resultFile],
+            "--result_file", resultFile,
+            *extraArguments],
             timeout=1800,
             **kwargs)
     )
     return actions
 
 
-def writeBuildsResults():
-    """Downloads and runs script for saving build results to database"""
-    return downloadScript("write_build_results.py", alwaysRun=True) + writeBuildResultsToDatabase(alwaysRun=True)
+def readUploadedFile(fileName):
+    """
+    Read JSON file uploaded to the master and remove it, None is returned if the file does not exist.
+    The file may be gzip-compressed like the compact results of the parse_ctest_log.py
+    """
+    if not os.path.exists(fileName):
+        return None
+    try:
+        with open(fileName, "rb") as file:
+            compressed = file.read(2) == b"\x1f\x8b"
+        with (gzip.open if compressed else open)(fileName, "rt") as file:
+            return json.load(file)
+    finally:
+        os.remove(fileName)
+
+
+class QueueBuildResults(steps.BuildStep):
+    """Pass test results uploaded to the master to the results ingestion service and finish without waiting for it"""
+    name = "Queue test results for writing to the database"
+    renderables = ["resultsFile", "coreDumpIndexFile"]
+
+    def __init__(self, resultsFile, coreDumpIndexFile=None, **kwargs):
+        self.resultsFile = resultsFile
+        self.coreDumpIndexFile = coreDumpIndexFile
+        steps.BuildStep.__init__(self, **kwargs)
+
+    @defer.inlineCallbacks
+    def run(self):
+        ingestionService = self.master.service_manager.namedServices.get(constants.RESULTS_INGESTION_SERVICE)
+        results = yield threads.deferToThread(readUploadedFile, os.path.join(self.master.basedir, self.resultsFile))
+        coreDumpIndex = None
+        if self.coreDumpIndexFile:
+            coreDumpIndex = yield threads.deferToThread(
+                readUploadedFile, os.path.join(self.master.basedir, self.coreDumpIndexFile))
+        if ingestionService is None or results is None:
+            self.descriptionDone = "Test results were not queued"
+            return FAILURE
+        if not ingestionService.isConfigured():
+            self.descriptionDone = "Results database is not configured, test results were not written"
+            return FAILURE
+        ingestionService.enqueue(self.getProperty("buildId"), results, (coreDumpIndex or {}).get("core_dumps"),
+                                 trackingKey=self.build.buildid)
+        return SUCCESS
+
+
+class CheckBuildResults(steps.BuildStep):
+    """Wait until the results queued by the build are written to the database, warn if they have been dropped"""
+    name = "Check that test results are written to the database"
+
+    @defer.inlineCallbacks
+    def run(self):
+        ingestionService = self.master.service_manager.namedServices.get(constants.RESULTS_INGESTION_SERVICE)
+        written = None
+        if ingestionService is not None:
+            written = yield ingestionService.writeOutcome(self.build.buildid)
+        if written is None:
+            return SKIPPED
+        self.setProperty("testResultsWritten", written, self.name)
+        if not written:
+            self.descriptionDone = "Test results were not written to the database, see the master log"
+            return WARNINGS
+        return SUCCESS
+
+
+def queueBuildResults(coreDumpIndexFile=None):
+    """
+    Uploads test results to the master and queues them for writing to the database.
+    The build should end with checkBuildResults(), the write is not awaited by these steps.
+    :param coreDumpIndexFile: core dump index created by the coredump_finder.py
+    """
+    masterResultsFile = util.Interpolate("results/%(prop:buildername)s_%(prop:buildnumber)s.json")
+    taskSteps = [steps.FileUpload(
+        name="Upload test results to the master",
+        workersrc=util.Property("jsonResultsFile"),
+        masterdest=masterResultsFile,
+        hideStepIf=True,
+        alwaysRun=True)]
+    masterCoreDumpIndexFile = None
+    if coreDumpIndexFile is not None:
+        masterCoreDumpIndexFile = util.Interpolate("results/%(prop:buildername)s_%(prop:buildnumber)s_coredumps.json")
+        taskSteps.append(steps.FileUpload(
+            name="Upload core dump index to the master",
+            workersrc=coreDumpIndexFile,
+            masterdest=masterCoreDumpIndexFile,
+            hideStepIf=True,
+            haltOnFailure=False,
+            flunkOnFailure=False,
+            alwaysRun=True))
+    taskSteps.append(QueueBuildResults(
+        resultsFile=masterResultsFile,
+        coreDumpIndexFile=masterCoreDumpIndexFile,
+        alwaysRun=True))
+    return taskSteps
+
 
+def checkBuildResults():
+    """Wait for the results queued by queueBuildResults() to be written and mark the build if they have not been"""
+    return [CheckBuildResults(alwaysRun=True, hideStepIf=lambda results, s: results in (SUCCESS, SKIPPED))]
 
-def downloadAndRunScript(scriptName, extraFiles=(), args=(), **kwargs):
+
+def downloadAndRunScript(scriptName, extraFiles=(), args=(), stepClass=steps.ShellCommand, **kwargs):
     """
     Downloads the script to remote location and executes it
     :param: scriptName name of the local script to execute
     :param: extraFiles name of extra files that should be transferred to the remote host
     :param: args list of arguments to pass to the remote script
+    :param: stepClass class of the step that executes the script
     :param: kwargs parameters of the executeStep
     """
     taskSteps = []
@@ -438,8 +632,9 @@ def downloadAndRunScript(scriptName, extraFiles=(), args=(), **kwargs):
             alwaysRun=True,
             mode=0o755,
         ))
+    kwargs.setdefault("maxTime", stepMaxTime(kwargs.get("name")))
     remoteScriptName = util.Interpolate("%(prop:builddir)s/scripts/{}".format(scriptName))
-    taskSteps.append(steps.ShellCommand(
+    taskSteps.append(stepClass(
         command=[remoteScriptName, *args],
         timeout=1800,
         **kwargs
@@ -486,19 +681,20 @@ class BuildAllTrigger(Trigger):
         return schedulers
 
 
-def runSshCommand(name='', host="", command=(), timeout=1800, **kwargs):
+def runSshCommand(name='', host="", command=(), timeout=1800, stepClass=steps.ShellCommand, **kwargs):
     """
     Run command on the remote server
     :param name: name of the command to show to end user
     :param host: the host definition
     :param command: a set of separate command parts
     :param timeout:
+    :param stepClass: class of the step that runs the command
     :param kwargs: different arguments to pass to ShellCommand
     :return: ShellCommand configured to run remote ssh command
     """
     sshCommand = ["ssh", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", host]
     sshCommand.extend(command)
-    return steps.ShellCommand(
+    return stepClass(
         name=name,
         command=sshCommand,
         timeout=timeout,
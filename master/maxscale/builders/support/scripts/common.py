@@ -1,10 +1,19 @@
+import asyncio
+import codecs
+import json
 import os
 import subprocess
 import sys
+import urllib.parse
 import paramiko
-import select
 
 MDBCI_VM_PATH = os.path.expanduser("~/vms/")
+# MDBCI writes addresses, keys and users of the nodes into this file next to the configuration directory
+MDBCI_NETWORK_CONFIG_SUFFIX = "_network_config"
+MDBCI_METADATA_CACHE_DIRECTORY = os.path.expanduser("~/.cache/maxscale-buildbot/mdbci")
+# Size of a single read from the channel and number of reads each output stream buffers for its consumer
+STREAM_CHUNK_SIZE = 32 * 1024
+STREAM_QUEUE_SIZE = 16
 
 
 def setupMdbciEnvironment():
@@ -41,6 +50,101 @@ def getMdbciInfo(*cmd):
     return output.decode("utf-8").splitlines()[0]
 
 
+def getMdbciInfoConcurrently(*commands):
+    """
+    Run several MDBCI queries at once, so the startup of MDBCI is paid only once in the wall time
+    :param commands: list of argument lists for the 'mdbci --silent'
+    :return: list with the first line of the output of each query
+    """
+    processes = [subprocess.Popen(['mdbci', '--silent', *command], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                 for command in commands]
+    return [process.communicate()[0].decode("utf-8").splitlines()[0] for process in processes]
+
+
+def findMdbciConfiguration(configName):
+    """Get the absolute path to the MDBCI configuration or None if it does not exist"""
+    for path in (configName, os.path.join(MDBCI_VM_PATH, configName)):
+        if os.path.isdir(path):
+            return os.path.abspath(path)
+    return None
+
+
+def readMdbciNetworkConfig(configPath):
+    """Read the 'key=value' lines of the network configuration file created by MDBCI"""
+    values = {}
+    try:
+        with open(configPath + MDBCI_NETWORK_CONFIG_SUFFIX) as file:
+            for line in file:
+                key, separator, value = line.strip().partition("=")
+                if separator:
+                    values[key] = value
+    except OSError:
+        pass
+    return values
+
+
+def getMdbciConfigurationVersion(configPath):
+    """Modification times of the configuration that change when MDBCI recreates it"""
+    version = [os.stat(configPath).st_mtime_ns]
+    try:
+        version.append(os.stat(configPath + MDBCI_NETWORK_CONFIG_SUFFIX).st_mtime_ns)
+    except OSError:
+        version.append(None)
+    return version
+
+
+def getMachineMetadata(configName, nodeName, cacheDirectory=MDBCI_METADATA_CACHE_DIRECTORY):
+    """
+    Collect the information about the node of the MDBCI configuration. Address, key and user are read from
+    the network configuration file, the rest is queried from MDBCI concurrently. The result is cached on disk
+    until the configuration is recreated.
+    :return: dictionary with the ip_address, ssh_key, ssh_user, box, platform and platform_version
+    """
+    fullName = configName + '/' + nodeName
+    configPath = findMdbciConfiguration(configName)
+    cacheFile = None
+    if configPath is not None:
+        version = getMdbciConfigurationVersion(configPath)
+        cacheFile = os.path.join(cacheDirectory, urllib.parse.quote("{}/{}".format(configPath, nodeName), safe=""))
+        try:
+            with open(cacheFile) as file:
+                cached = json.load(file)
+            if cached["version"] == version:
+                return cached["metadata"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    network = readMdbciNetworkConfig(configPath) if configPath is not None else {}
+    metadata = {
+        "ip_address": network.get("{}_network".format(nodeName)),
+        "ssh_key": network.get("{}_keyfile".format(nodeName)),
+        "ssh_user": network.get("{}_whoami".format(nodeName)),
+    }
+    queries = {
+        "ip_address": ['show', 'network', fullName],
+        "ssh_key": ['show', 'keyfile', fullName],
+        "ssh_user": ['ssh', '--command', 'whoami', fullName],
+    }
+    queries = {key: command for key, command in queries.items() if not metadata[key]}
+    queries["box"] = ['show', 'box', fullName]
+    metadata.update(zip(queries, getMdbciInfoConcurrently(*queries.values())))
+    boxName = '--box-name={}'.format(metadata["box"])
+    metadata["platform"], metadata["platform_version"] = getMdbciInfoConcurrently(
+        ['show', 'boxinfo', boxName, '--field', 'platform', fullName],
+        ['show', 'boxinfo', boxName, '--field', 'platform_version', fullName])
+
+    if cacheFile is not None:
+        try:
+            os.makedirs(cacheDirectory, exist_ok=True)
+            temporaryFile = "{}.{}".format(cacheFile, os.getpid())
+            with open(temporaryFile, "w") as file:
+                json.dump({"version": version, "metadata": metadata}, file)
+            os.replace(temporaryFile, cacheFile)
+        except OSError as error:
+            print("Unable to cache MDBCI metadata: {}".format(error))
+    return metadata
+
+
 def createRunner(connection):
     """Creates a function that is able to run commands on specific runner"""
 
@@ -51,34 +155,92 @@ def createRunner(connection):
     return runRemoteCommand
 
 
-def interactiveExec(connection, cmd, consumer, outfile, get_pty=False, timeout=1):
+class OutputStream:
+    """Output stream of the remote command passed to the consumer in the order it was received"""
+
+    def __init__(self, receive, isReady, consumer):
+        self.receive = receive
+        self.isReady = isReady
+        self.consumer = consumer
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+
+    async def consume(self):
+        while True:
+            data = await self.queue.get()
+            final = data is None
+            text = self.decoder.decode(b"" if final else data, final=final)
+            if text:
+                self.consumer(text)
+            if final:
+                return
+
+
+async def streamExec(connection, cmd, stdoutConsumer, stderrConsumer=None, get_pty=False, timeout=None):
+    """
+    Run the command and pass its output to the consumers as soon as it arrives. Reads are driven by the
+    channel notifications of the event loop, the output is decoded incrementally, so multi-byte characters
+    split between packets stay intact. Reading stops while the consumer of the stream is behind.
+    :param connection: SSH connection to the machine
+    :param cmd: command to run
+    :param stdoutConsumer: function that receives the pieces of the standard output
+    :param stderrConsumer: function that receives the pieces of the standard error, stdoutConsumer by default
+    :param get_pty: request the pseudo-terminal for the command
+    :param timeout: seconds to wait for the notification before the channel is checked anyway, None to wait
+                    for the notification only
+    :return: exit code of the command
+    """
+    loop = asyncio.get_running_loop()
     con_stdin, con_stdout, con_stderr = connection.exec_command(cmd, get_pty=get_pty)
     channel = con_stdout.channel
-
     con_stdin.close()
     channel.shutdown_write()
 
-    def send_converted_text():
-        data = channel.recv(len(channel.in_buffer))
-        text = data.decode("utf-8", "replace")
-        if text != '':
-            consumer(text, outfile)
-
-    send_converted_text()  # Pass all text from read buffer
-    while not channel.closed:
-        read_ready_queue, _, _ = select.select([channel], [], [], timeout)
-        for ready_channel in read_ready_queue:
-            if ready_channel.recv_ready():  # Pass stdout to the consumer
-                send_converted_text()
-            if ready_channel.recv_stderr_ready():  # Pass stderr to the consumer
-                send_converted_text()
-        if channel.exit_status_ready() and not channel.recv_stderr_ready() and not channel.recv_ready():
-            channel.shutdown_read()
-            channel.close()
-            break
+    streams = [OutputStream(channel.recv, channel.recv_ready, stdoutConsumer),
+               OutputStream(channel.recv_stderr, channel.recv_stderr_ready, stderrConsumer or stdoutConsumer)]
+    consumers = [asyncio.ensure_future(stream.consume()) for stream in streams]
+    readable = asyncio.Event()
+    channelDescriptor = channel.fileno()  # Becomes readable on new data in any stream and on the end of output
+    loop.add_reader(channelDescriptor, readable.set)
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(readable.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            readable.clear()
+            # Both streams share the notification pipe of the channel, draining one of them clears it even if
+            # the other has received data meanwhile, so they are checked again until neither has data
+            while any(stream.isReady() for stream in streams):
+                for stream in streams:
+                    while stream.isReady():
+                        if stream.queue.full():
+                            loop.remove_reader(channelDescriptor)
+                            await stream.queue.put(stream.receive(STREAM_CHUNK_SIZE))
+                            loop.add_reader(channelDescriptor, readable.set)
+                        else:
+                            stream.queue.put_nowait(stream.receive(STREAM_CHUNK_SIZE))
+            if (channel.eof_received or channel.closed) and not any(stream.isReady() for stream in streams):
+                break
+    finally:
+        loop.remove_reader(channelDescriptor)
+        for stream in streams:
+            await stream.queue.put(None)
+        await asyncio.gather(*consumers)
+    exitCode = await loop.run_in_executor(None, channel.recv_exit_status)
     con_stdout.close()
     con_stderr.close()
-    return channel.recv_exit_status()
+    return exitCode
+
+
+def interactiveExec(connection, cmd, consumer, outfile, get_pty=False, timeout=None):
+    """
+    Run the command and pass its standard output and error to the consumer along with the outfile.
+    The timeout is the longest wait for new output before the channel is checked, like the poll interval
+    of the previous implementation.
+    """
+    return asyncio.run(streamExec(connection, cmd, lambda text: consumer(text, outfile), get_pty=get_pty,
+                                  timeout=timeout))
 
 
 def printAndSaveText(text, outfile):
@@ -102,12 +264,10 @@ def createSSH(machine):
 
 class Machine:
     def __init__(self, configName, nodeName):
-        fullName = configName + '/' + nodeName
-        self.ip_address = getMdbciInfo('show', 'network', fullName)
-        self.ssh_key = getMdbciInfo('show', 'keyfile', fullName)
-        self.ssh_user = getMdbciInfo('ssh', '--command', 'whoami', fullName)
-        self.box = getMdbciInfo('show', 'box', fullName)
-        self.platform = getMdbciInfo('show', 'boxinfo', '--box-name={}'.format(self.box), '--field', 'platform',
-                                     fullName)
-        self.platform_version = getMdbciInfo('show', 'boxinfo', '--box-name={}'.format(self.box),
-                                             '--field', 'platform_version', fullName)
+        metadata = getMachineMetadata(configName, nodeName)
+        self.ip_address = metadata["ip_address"]
+        self.ssh_key = metadata["ssh_key"]
+        self.ssh_user = metadata["ssh_user"]
+        self.box = metadata["box"]
+        self.platform = metadata["platform"]
+        self.platform_version = metadata["platform_version"]
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import os
+import re
 import sys
 
+# Core dump patterns are recorded only for the logs of the run_test builds
+CORE_DUMP_PATH_REGEX = re.compile(r".*\/run_test[^\/.+]+(\/.+)")
+
 
 def main():
     args = parseArguments()
-    coreDumps = findCoreDumps(args.directory, args.remote_prefix)
+    entries = scanDirectory(args.directory)
+    coreDumps = findCoreDumps(args.directory, args.remote_prefix, entries)
     storeCoreDumps(coreDumps, args.output_file)
+    if args.index_file:
+        testsLogsDirectory = os.path.join(args.directory, "LOGS")
+        storeCoreDumpIndex(testsLogsDirectory, buildCoreDumpIndex(testsLogsDirectory, entries), args.index_file)
 
 
 def parseArguments():
@@ -17,6 +26,7 @@ def parseArguments():
     parser.add_argument("--remote-prefix", help="prefix of the remote server for the core dumps",
                         required=True)
     parser.add_argument("--output-file", help="location of the output file to put data", required=True)
+    parser.add_argument("--index-file", help="location of the file to put core dump location of each test into")
     args = parser.parse_args()
 
     if not os.path.isdir(args.directory):
@@ -26,19 +36,83 @@ def parseArguments():
     return args
 
 
-def findCoreDumps(directory, prefix):
+def scanDirectory(directory):
+    """
+    Collect all entries of the directory tree in the order `find` lists them, starting with the directory itself
+    :param directory: root of the tree
+    :return: list of (path, isDirectory) pairs
+    """
+    entries = [(directory, True)]
+    try:
+        with os.scandir(directory) as directoryEntries:
+            children = list(directoryEntries)
+    except OSError:
+        return entries
+    for child in children:
+        if child.is_dir(follow_symlinks=False):
+            entries.extend(scanDirectory(child.path))
+        else:
+            entries.append((child.path, False))
+    return entries
+
+
+def findCoreDumps(directory, prefix, entries=None):
     paths = []
     if prefix.endswith("/"):
         fixedPrefix = prefix
     else:
         fixedPrefix = "{}/".format(prefix)
-    for dirPath, dirNames, fileNames in os.walk(directory):
-        for fileName in fileNames:
-            if "core" in fileName:
-                paths.append(os.path.join(dirPath.replace(directory, fixedPrefix), fileName))
+    if entries is None:
+        entries = scanDirectory(directory)
+    for path, isDirectory in entries:
+        if not isDirectory and "core" in os.path.basename(path):
+            paths.append(os.path.join(fixedPrefix, os.path.relpath(path, directory)))
     return paths
 
 
+def buildCoreDumpIndex(testsLogsDirectory, entries=None):
+    """
+    Find the core dump location of each test in <testsLogsDirectory>/<test name>/. The first path in
+    the test directory that mentions 'core' is taken and its last component is replaced with '*'.
+    :param testsLogsDirectory: directory with the logs of every test
+    :param entries: result of scanDirectory for the testsLogsDirectory or any of its parents
+    :return: dictionary with test name mapped to the core dump location
+    """
+    if entries is None:
+        entries = scanDirectory(testsLogsDirectory)
+    testsPrefix = os.path.join(testsLogsDirectory, "")
+    index = {}
+    checkedTests = set()
+    for path, isDirectory in entries:
+        if not path.startswith(testsPrefix):
+            continue
+        testName = path[len(testsPrefix):].split("/", 1)[0]
+        if testName in checkedTests or "core" not in path:
+            continue
+        checkedTests.add(testName)
+        coreDumpMatch = CORE_DUMP_PATH_REGEX.match("{}/*".format(os.path.dirname(path)))
+        if coreDumpMatch and os.path.isdir(os.path.join(testsPrefix, testName)):
+            index[testName] = coreDumpMatch.group(0)
+    return index
+
+
+def storeCoreDumpIndex(testsLogsDirectory, index, fileName):
+    with open(fileName, "w") as file:
+        json.dump({"tests_logs_directory": os.path.normpath(testsLogsDirectory), "core_dumps": index}, file)
+
+
+def readCoreDumpIndex(testsLogsDirectory, fileName):
+    """Read the index stored by storeCoreDumpIndex, None is returned if it was built for another directory"""
+    try:
+        with open(fileName, "r") as file:
+            content = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if content.get("tests_logs_directory") != os.path.normpath(testsLogsDirectory):
+        return None
+    return content.get("core_dumps")
+
+
 def storeCoreDumps(coreDumps, fileName):
     with open(fileName, "w") as file:
         file.write("COREDUMPS\n")
@@ -50,6 +124,5 @@ def storeCoreDumps(coreDumps, fileName):
                 file.write("{}\n".format(dump))
 
 
-if os.path.samefile(__file__, sys.argv[0]):
+if __name__ == "__main__":
     main()
-
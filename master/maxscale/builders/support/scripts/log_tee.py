@@ -0,0 +1,104 @@
+import os
+import select
+import subprocess
+import sys
+import time
+
+# Maximum number of bytes moved from the pipe to the log file at once
+TEE_CHUNK_SIZE = 1024 * 1024
+# Output is forwarded to the standard output at most once per interval in seconds
+STDOUT_FLUSH_INTERVAL = 0.5
+
+
+def writeAll(descriptor, data):
+    while data:
+        data = data[os.write(descriptor, data):]
+
+
+class LogTee:
+    """
+    Copies the output of the child process to the log file and to the standard output. Data goes from the pipe
+    straight into the log file with splice(2) and is forwarded from the log file to the standard output with
+    sendfile(2) once per flush interval, so the log file is the only buffer. When the kernel refuses either call,
+    the data is copied through the memory in large chunks. The consumer, if any, gets the new parts of the log
+    on every flush.
+    """
+
+    def __init__(self, source, logFile, output=None, flushInterval=STDOUT_FLUSH_INTERVAL, consumer=None):
+        self.source = source
+        self.consumer = consumer
+        self.log = logFile
+        self.output = output if output is not None else sys.stdout.fileno()
+        self.flushInterval = flushInterval
+        self.useSplice = hasattr(os, "splice")
+        self.useSendfile = hasattr(os, "sendfile")
+        self.written = os.lseek(self.log, 0, os.SEEK_CUR)
+        self.forwarded = self.written
+        self.consumed = self.written
+        self.lastFlush = time.monotonic()
+
+    def copyChunk(self):
+        """Move the available data from the pipe to the log file, 0 is returned at the end of the output"""
+        if self.useSplice:
+            try:
+                count = os.splice(self.source, self.log, TEE_CHUNK_SIZE)
+                self.written += count
+                return count
+            except OSError:
+                self.useSplice = False
+        data = os.read(self.source, TEE_CHUNK_SIZE)
+        writeAll(self.log, data)
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        """Forward the part of the log file the standard output has not seen yet"""
+        while self.forwarded < self.written:
+            count = self.written - self.forwarded
+            if self.useSendfile:
+                try:
+                    self.forwarded += os.sendfile(self.output, self.log, self.forwarded, count)
+                    continue
+                except OSError:
+                    self.useSendfile = False
+            data = os.pread(self.log, min(count, TEE_CHUNK_SIZE), self.forwarded)
+            writeAll(self.output, data)
+            self.forwarded += len(data)
+        while self.consumer is not None and self.consumed < self.written:
+            data = os.pread(self.log, min(self.written - self.consumed, TEE_CHUNK_SIZE), self.consumed)
+            self.consumer(data)
+            self.consumed += len(data)
+        self.lastFlush = time.monotonic()
+
+    def run(self):
+        """Copy the output until the child process closes the pipe"""
+        while True:
+            timeout = None
+            if self.forwarded < self.written:
+                timeout = max(0, self.lastFlush + self.flushInterval - time.monotonic())
+            ready, _, _ = select.select([self.source], [], [], timeout)
+            if ready and self.copyChunk() == 0:
+                break
+            if time.monotonic() - self.lastFlush >= self.flushInterval:
+                self.flush()
+        self.flush()
+
+
+def runAndTee(command, logFileName, consumer=None, **kwargs):
+    """
+    Run the command, save its standard output and error to the log file and pass them to the standard output
+    :param command: command to run
+    :param logFileName: file to put the output into
+    :param consumer: function that receives the output as it is written to the log
+    :param kwargs: parameters of the subprocess.Popen
+    :return: exit code of the command
+    """
+    sys.stdout.flush()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+    logFile = os.open(logFileName, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        LogTee(process.stdout.fileno(), logFile, consumer=consumer).run()
+    finally:
+        os.close(logFile)
+        process.stdout.close()
+    return process.wait()
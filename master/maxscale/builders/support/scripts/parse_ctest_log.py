@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
+import codecs
+import concurrent.futures
+import fnmatch
+import gzip
+import io
 import json
+import multiprocessing
 import os
 import re
-import sys
 import subprocess
 import argparse
 import shutil
@@ -16,6 +21,9 @@ HUMAN_READABLE_OPTION = '--human-readable'
 CTEST_SUBLOGS_PATH = '--ctest-sublogs-path'
 HELP_OPTION = '--help'
 STORE_DIRECTORY = '--store-directory'
+COMPACT_JSON_OPTION = '--compact-json'
+PARSED_LOG_STATE_OPTION = '--parsed-log-state'
+RERUN_LOG_OPTION = '--rerun-log'
 
 TEST_INDEX_NUMBER = 'test_index_number'
 TEST_NUMBER = 'test_number'
@@ -26,6 +34,13 @@ TESTS = 'tests'
 TESTS_COUNT = 'tests_count'
 FAILED_TESTS_COUNT = 'failed_tests_count'
 
+# Compact results format: tests are stored as columns, statuses are indexes in the list of distinct statuses
+RESULTS_FORMAT = 'format'
+COMPACT_RESULTS_FORMAT = 'compact-1'
+TEST_STATUSES = 'test_statuses'
+TEST_COLUMNS = [TEST_INDEX_NUMBER, TEST_NUMBER, TEST_NAME, TEST_SUCCESS, TEST_TIME]
+GZIP_EXTENSION = '.gz'
+
 RUN_TEST_BUILD_ENV_VARS_TO_HR = {
     'BUILD_NUMBER': 'Job build number',
     'JOB_NAME': 'Job name',
@@ -55,8 +70,52 @@ FIRST_LINES_CTEST_TO_SKIP = [
     'Checking test dependency graph end'
 ]
 
+# Each pattern below can only match a line that contains the corresponding keyword.
+# The log parser looks for all keywords at once and evaluates the patterns only on hits.
+CTEST_FIRST_LINE_KEYWORD = "Constructing a list of tests"
+CTEST_LAST_LINE_KEYWORD = "tests passed,"
+MAXSCALE_COMMIT_KEYWORD = "MaxScale"
+CMAKE_FLAGS_KEYWORD = "CMake flags:"
+MAXSCALE_SOURCE_KEYWORD = "Source:"
+LOGS_DIR_KEYWORD = "Logs go to "
+MAXSCALE_VERSION_START_KEYWORD = "Maxscale_full_version_start:"
+MAXSCALE_VERSION_END_KEYWORD = "Maxscale_full_version_end"
+FULL_TESTS_LIST_KEYWORD = "===Full test list "
+
+CTEST_LAST_LINE_REGEX = re.compile("tests passed,.+tests failed out of (.+)")
+MAXSCALE_COMMIT_REGEX = re.compile(r"MaxScale\s+.*\d+\.*\d*\.*\d*\s+-\s+(.+)")
+CMAKE_FLAGS_REGEX = re.compile(r"CMake flags:\s+(.+)")
+MAXSCALE_SOURCE_REGEX = re.compile(r"Source:\s+(.+)")
+LOGS_DIR_REGEX = re.compile(r"^Logs go to \/home\/vagrant\/LOGS\/(.+)$")
+FULL_TESTS_LIST_START_REGEX = re.compile("^===Full test list begin===$")
+FULL_TESTS_LIST_END_REGEX = re.compile("^===Full test list end===$")
+TEST_FROM_LIST_REGEX = re.compile(r"Test\s+#(\d+):\s+(.+)")
+TEST_END_REGEX = re.compile(r"(\d+)\/(\d+)\s+Test\s+#(\d+):[\s]+([^\s]+)\s+[\.\*]+([^\d]+)([\d\.]+)")
+
+# Header values that are captured only once: keyword, pattern, parser attribute and whether to strip the value
+LOG_HEADERS = [
+    (MAXSCALE_COMMIT_KEYWORD, MAXSCALE_COMMIT_REGEX, "maxscaleCommit", False),
+    (CMAKE_FLAGS_KEYWORD, CMAKE_FLAGS_REGEX, "cmakeFlags", True),
+    (MAXSCALE_SOURCE_KEYWORD, MAXSCALE_SOURCE_REGEX, "maxscaleSource", True),
+    (LOGS_DIR_KEYWORD, LOGS_DIR_REGEX, "logsDir", True),
+]
+
+LEAK_SUMMARY_FIRST_LINE_REGEX = re.compile(r"^==\d+==\s+LEAK SUMMARY:$")
+LEAK_SUMMARY_END_LINE_REGEX = re.compile(r"^==\d+==\s$")
+# Example of line: `==12030==      possibly lost: 15 bytes in 26 blocks`
+# where '==12030==      ' is first group, '15' is second group, '26' is third group
+LEAK_SUMMARY_FIELD_REGEX = re.compile(r"^(==\d+==\s+)[\w\s]*\w:\s+([0-9]*\,?[0-9]+) bytes in ([0-9]*\,?[0-9]+) blocks")
+# Valgrind prints the leak summary right before the error summary at the end of the log
+LEAK_SUMMARY_TAIL_SIZE = 64 * 1024
+VALGRIND_LOG_PATTERN = "valgrind*.log"
+FIRST_TEST_RUN_DIRECTORY = "000"
+
 WORKSPACE = 'WORKSPACE'
 
+# Attributes of the CTestParser that hold the result of parsing the log
+PARSED_LOG_STATE_ATTRIBUTES = ["ctestExecuted", "ctestSummary", "testQuantity", "maxscaleCommit", "cmakeFlags",
+                               "maxscaleSource", "logsDir", "maxscaleEntity", "flakyCtests"]
+
 FAILED = 'Failed'
 PASSED = 'Passed'
 
@@ -67,6 +126,8 @@ BUILD_LOG_PARSING_RESULT = 'BUILD_LOG_PARSING_RESULT'
 ERROR = 'Error'
 CTEST_NOT_EXECUTED_ERROR = 'CTest has never executed'
 CTEST_SUMMARY_NOTE_FOUND = 'CTest summary has not found'
+CTEST_SUMMARY = "{}% tests passed, {} tests failed out of {}"
+CTEST_TIMED_OUT_SUMMARY = "timed out, {} tests failed out of {} executed"
 
 CTEST_ARGUMENTS_HR = 'CTest arguments'
 CTEST_ARGUMENTS_MR = 'ctest_arguments'
@@ -89,10 +150,21 @@ MAXSCALE_SYSTEM_TEST_COMMIT_MR = "maxscale_system_test_commit"
 LEAK_SUMMARY_HR = 'Leak Summary'
 LEAK_SUMMARY_MR = 'leak_summary'
 
+FLAKY_TESTS_HR = 'Flaky tests'
+FLAKY_TESTS_MR = 'flaky_tests'
+FAILURE_CLASSES_MR = 'failure_classes'
+# Classes of the failed tests, a flaky test has passed when it was run again
+FLAKY = 'flaky'
+REAL = 'real'
+
 MAXSCALE_FULL = "Maxscale full version"
 
 NEW_LINE_JENKINS_FORMAT = " \\n\\\n"
 
+CTEST_SUBLOG_FILE = "ctest_sublog"
+# Suffix of the pending sublog that is kept next to the sublogs directory, the directory holds only the tests
+PENDING_CTEST_SUBLOG_SUFFIX = ".pending"
+
 
 options = argparse.ArgumentParser(description="CTest parser usage:")
 options.add_argument(LOG_FILE_OPTION, help="CTEST LOG FILE PATH")
@@ -106,6 +178,177 @@ options.add_argument("-j", OUTPUT_LOG_JSON_FILE_OPTION, metavar="json_file_path"
                           "saved all test results - passed and failed)")
 options.add_argument("-s", CTEST_SUBLOGS_PATH, help="Path to ctest sublogs")
 options.add_argument("-st", STORE_DIRECTORY, help="Path to the store directory")
+options.add_argument("-c", COMPACT_JSON_OPTION, action="store_true",
+                     help="SAVE JSON FILE IN THE COMPACT COLUMNAR FORMAT, "
+                          "IT IS GZIP-COMPRESSED IF THE FILE NAME ENDS WITH .gz")
+options.add_argument("-ps", PARSED_LOG_STATE_OPTION, metavar="state_file",
+                     help="TAKE THE PARSED LOG FROM THE STATE FILE SAVED BY run_script_and_log.py, "
+                          "THE LOG IS PARSED IF THE FILE DOES NOT EXIST")
+options.add_argument("-rl", RERUN_LOG_OPTION, metavar="rerun_log_file",
+                     help="LOG OF THE FAILED TESTS RUN AGAIN BY run_script_and_log.py, "
+                          "THE TESTS THAT PASS THERE ARE REPORTED AS FLAKY")
+
+
+def ctestIndexArgument(testNumbers):
+    """
+    Value of the ctest -I option that selects exactly the given tests
+    :param testNumbers: numbers of the tests as strings
+    :return: the first test as a range followed by the numbers of the rest
+    """
+    ctestArguments = []
+    sortedTestIndexesArray = sorted(testNumbers, key=lambda item: int(item))
+    for testIndex in sortedTestIndexesArray:
+        if testIndex == sortedTestIndexesArray[0]:
+            ctestArguments.extend([testIndex, testIndex])
+            if len(sortedTestIndexesArray) > 1:
+                ctestArguments.append("1")
+        else:
+            ctestArguments.append(testIndex)
+    return ",".join(ctestArguments)
+
+
+def compactTests(tests):
+    """
+    Convert the list of test dictionaries into columns
+    :param tests: list of dictionaries created by CtestResult.toDict
+    :return: dictionary with the test columns and the list of distinct statuses
+    """
+    statuses = {}
+    columns = {column: [] for column in TEST_COLUMNS}
+    for test in tests:
+        for column in TEST_COLUMNS:
+            if column == TEST_SUCCESS:
+                columns[column].append(statuses.setdefault(test[column], len(statuses)))
+            else:
+                columns[column].append(test[column])
+    columns[TEST_STATUSES] = list(statuses)
+    return columns
+
+
+def parseLeakSummaryLines(lines):
+    """
+    Extract non-zero fields of the first leak summary block
+    :param lines: lines of the valgrind log
+    :return: list of fields or None if the block was not found
+    """
+    fields = None
+    for line in lines:
+        if fields is None:
+            if LEAK_SUMMARY_FIRST_LINE_REGEX.search(line):
+                fields = []
+            continue
+        if LEAK_SUMMARY_END_LINE_REGEX.search(line):
+            break
+        fieldMatch = LEAK_SUMMARY_FIELD_REGEX.search(line)
+        if fieldMatch and fieldMatch.group(2) != '0':
+            fields.append(line.replace(fieldMatch.group(1), '').strip('\n'))
+    return fields
+
+
+def readLeakSummary(fileName):
+    """
+    Read the leak summary from the valgrind log. Only the tail of the file is read unless
+    the summary block does not fit into it.
+    :param fileName: path to the valgrind log
+    :return: list of non-zero leak summary fields
+    """
+    with open(fileName, "rb") as file:
+        size = file.seek(0, os.SEEK_END)
+        if size > LEAK_SUMMARY_TAIL_SIZE:
+            file.seek(size - LEAK_SUMMARY_TAIL_SIZE)
+            file.readline()  # Skip the partially read line
+            tail = file.read().decode("utf-8", "replace").splitlines(keepends=True)
+            fields = parseLeakSummaryLines(tail)
+            if fields is not None:
+                return fields
+        file.seek(0)
+        return parseLeakSummaryLines(line.decode("utf-8", "replace") for line in file) or []
+
+
+def findValgrindLogs(directory):
+    """Recursively collect valgrind logs in the directory in the order they are listed"""
+    logs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                logs.extend(findValgrindLogs(entry.path))
+            elif entry.is_file(follow_symlinks=False) and fnmatch.fnmatch(entry.name.lower(), VALGRIND_LOG_PATTERN):
+                logs.append(entry.path)
+    return logs
+
+
+def findFirstRunValgrindLogs(testsLogsDir):
+    """
+    Find valgrind logs of the first run of each test, i.e. <testsLogsDir>/<test name>/000/**/valgrind*.log
+    :return: list of (test name, valgrind log path) pairs
+    """
+    logs = []
+    with os.scandir(testsLogsDir) as testDirectories:
+        for testDirectory in testDirectories:
+            firstRunDirectory = os.path.join(testDirectory.path, FIRST_TEST_RUN_DIRECTORY)
+            if testDirectory.is_dir(follow_symlinks=False) and os.path.isdir(firstRunDirectory):
+                logs.extend((testDirectory.name, log) for log in findValgrindLogs(firstRunDirectory))
+    return logs
+
+
+class CtestResult:
+    """Result of a single test as reported by ctest"""
+    __slots__ = ("indexNumber", "number", "name", "success", "time")
+
+    def __init__(self, indexNumber, number, name, success, time):
+        self.indexNumber = indexNumber
+        self.number = number
+        self.name = name
+        self.success = success
+        self.time = time
+
+    def toDict(self):
+        return {
+            TEST_INDEX_NUMBER: self.indexNumber,
+            TEST_NUMBER: self.number,
+            TEST_NAME: self.name,
+            TEST_SUCCESS: self.success,
+            TEST_TIME: self.time
+        }
+
+
+class CtestSublogWriter:
+    """
+    Streams the ctest output into per-test sublog files. The output of the running test is written
+    into the pending file which is moved into the test directory once the test result line is seen.
+    The pending file is kept outside the sublogs directory, so an aborted run leaves only test directories in it.
+    """
+
+    def __init__(self, sublogsPath):
+        self.sublogsPath = sublogsPath
+        self.pendingPath = os.path.normpath(sublogsPath) + PENDING_CTEST_SUBLOG_SUFFIX
+        self.pendingFile = None
+        self.testDirectories = set()
+        os.makedirs(sublogsPath, exist_ok=True)
+
+    def write(self, line):
+        if self.pendingFile is None:
+            self.pendingFile = open(self.pendingPath, "w")
+        self.pendingFile.write(line)
+
+    def completeTest(self, testName):
+        """Store the output collected since the previous test as the sublog of the given test"""
+        if self.pendingFile is None:
+            return
+        self.pendingFile.close()
+        self.pendingFile = None
+        testDirectory = os.path.join(self.sublogsPath, testName)
+        if testName not in self.testDirectories:
+            os.makedirs(testDirectory, exist_ok=True)
+            self.testDirectories.add(testName)
+        os.replace(self.pendingPath, os.path.join(testDirectory, CTEST_SUBLOG_FILE))
+
+    def close(self):
+        """Drop the output that does not belong to any finished test"""
+        if self.pendingFile is not None:
+            self.pendingFile.close()
+            self.pendingFile = None
+            os.remove(self.pendingPath)
 
 
 class CTestParser:
@@ -114,214 +357,314 @@ class CTestParser:
         self.args = args
         self.ctestExecuted = False
         self.ctestSummary = None
+        self.testQuantity = 0
         self.maxscaleCommit = None
         self.cmakeFlags = None
         self.maxscaleSource = None
         self.logsDir = None
-        self.allCtestIndexes = []
-        self.failedCtestIndexes = []
+        self.allCtests = {}
+        self.failedCtests = {}
+        self.reportedFailures = set()
+        self.flakyCtests = {}
         self.allCtestArguments = None
         self.failedCtestArguments = None
-        self.allCtestInfo = []
-        self.failedCtestInfo = []
-        self.failCtestCounter = 0
+        self.allCtestInfo = None
+        self.failedCtestInfo = None
         self.maxscaleEntity = []
         self.leakSummary = {}
+        self.ctestSublogWriter = None
+        self.ctestSectionBaseline = ({}, {})
+        self.maxscaleVersionIsCurrent = False
+        self.fullTestsListIsCurrent = False
+        self.logKeywords = set()
+        self.logKeywordsRegex = None
 
     def parseTestFromTestsList(self, line, testIndex):
-        testRegex = re.compile("Test\s+#(\d+):\s+(.+)")
-        if testRegex.search(line):
-            return {
-                TEST_INDEX_NUMBER: testIndex,
-                TEST_NUMBER: testRegex.search(line).group(1).strip(),
-                TEST_NAME: testRegex.search(line).group(2).strip(),
-                TEST_SUCCESS: FAILED,
-                TEST_TIME: 0
-            }
+        testMatch = TEST_FROM_LIST_REGEX.search(line)
+        if testMatch:
+            return CtestResult(testIndex, testMatch.group(1).strip(), testMatch.group(2).strip(), FAILED, 0)
         else:
             return None
 
     def addTestToFailedCtest(self, testInfo):
-        try:
-            index = self.failedCtestIndexes.index(testInfo[TEST_NUMBER])
-        except ValueError:
-            self.failedCtestIndexes.append(testInfo[TEST_NUMBER])
-            self.failedCtestInfo.append(testInfo)
-            self.failCtestCounter += 1
-        else:
-            self.failedCtestInfo[index] = testInfo
+        """Record the failed test, a retried test keeps the position of its first result"""
+        self.failedCtests[testInfo.number] = testInfo
 
     def addTestToAllCtest(self, testInfo):
-        try:
-            index = self.allCtestIndexes.index(testInfo[TEST_NUMBER])
-        except ValueError:
-            self.allCtestIndexes.append(testInfo[TEST_NUMBER])
-            self.allCtestInfo.append(testInfo)
+        """Record the test result, a retried test keeps the position of its first result"""
+        self.allCtests[testInfo.number] = testInfo
+
+    def setLogKeywords(self, keywords):
+        """Combine keywords that are still looked for into a single alternation"""
+        self.logKeywords = set(keywords)
+        self.logKeywordsRegex = re.compile("|".join(re.escape(keyword) for keyword in sorted(self.logKeywords)))
+
+    def retireLogKeyword(self, keyword):
+        """Stop looking for the keyword once the value it marks has been captured"""
+        if keyword in self.logKeywords:
+            self.setLogKeywords(self.logKeywords - {keyword})
+
+    def parseLogLine(self, line):
+        """
+        Process a single line of the build log
+        :param line: line of the build log
+        :return: True if the CTest summary has been found and the rest of the log should be skipped
+        """
+        if self.logKeywordsRegex.search(line) is None:
+            if self.maxscaleVersionIsCurrent and line.strip():
+                self.maxscaleEntity.append(line.strip())
+            if self.fullTestsListIsCurrent:
+                self.parseTestFromList(line)
+            if self.ctestExecuted:
+                self.parseCtestLine(line)
+            return False
+        return self.parseLogLineWithKeyword(line)
+
+    def parseLogLineWithKeyword(self, line):
+        """Process the line of the build log that contains at least one of the keywords"""
+        if MAXSCALE_VERSION_END_KEYWORD in self.logKeywords and MAXSCALE_VERSION_END_KEYWORD in line:
+            self.maxscaleVersionIsCurrent = False
+            self.retireLogKeyword(MAXSCALE_VERSION_START_KEYWORD)
+            self.retireLogKeyword(MAXSCALE_VERSION_END_KEYWORD)
+        if self.maxscaleVersionIsCurrent and line.strip():
+            self.maxscaleEntity.append(line.strip())
+        if MAXSCALE_VERSION_START_KEYWORD in self.logKeywords and MAXSCALE_VERSION_START_KEYWORD in line:
+            self.maxscaleVersionIsCurrent = True
+            self.retireLogKeyword(MAXSCALE_VERSION_START_KEYWORD)
+        if FULL_TESTS_LIST_KEYWORD in line:
+            if FULL_TESTS_LIST_START_REGEX.search(line):
+                self.fullTestsListIsCurrent = True
+            if FULL_TESTS_LIST_END_REGEX.search(line):
+                self.fullTestsListIsCurrent = False
+        if self.fullTestsListIsCurrent:
+            self.parseTestFromList(line)
+        for keyword, regex, attribute, strip in LOG_HEADERS:
+            if keyword in self.logKeywords and keyword in line:
+                headerMatch = regex.search(line)
+                if headerMatch:
+                    value = headerMatch.group(1)
+                    setattr(self, attribute, value.strip() if strip else value)
+                    if getattr(self, attribute):
+                        self.retireLogKeyword(keyword)
+        if CTEST_FIRST_LINE_KEYWORD in line:
+            self.startCtestSection()
+        if self.ctestExecuted:
+            if CTEST_LAST_LINE_KEYWORD in line:
+                summaryMatch = CTEST_LAST_LINE_REGEX.search(line)
+                if summaryMatch:
+                    self.ctestSummary = line.strip()
+                    self.testQuantity = summaryMatch.group(1)
+                    return True
+            self.parseCtestLine(line)
+        return False
+
+    def parseTestFromList(self, line):
+        testInfo = self.parseTestFromTestsList(line, len(self.allCtests) + 1)
+        if testInfo is not None:
+            self.addTestToAllCtest(testInfo)
+            self.addTestToFailedCtest(testInfo)
+
+    def startCtestSection(self):
+        """Start recording the ctest output, results of the previous ctest run in the log are dropped"""
+        if self.ctestExecuted:
+            self.allCtests, self.failedCtests = (dict(tests) for tests in self.ctestSectionBaseline)
+        else:
+            self.ctestExecuted = True
+            self.ctestSectionBaseline = (dict(self.allCtests), dict(self.failedCtests))
+        self.reportedFailures = set()
+        self.flakyCtests = {}
+        self.testQuantity = 0
+        if self.ctestSublogWriter is not None:
+            self.ctestSublogWriter.close()
+        if self.args.ctest_sublogs_path:
+            self.ctestSublogWriter = CtestSublogWriter(self.args.ctest_sublogs_path)
+
+    def parseCtestLine(self, line):
+        """Pass the line of the ctest output to the sublog and record the test result it may hold"""
+        if self.ctestSublogWriter is not None and line.strip() not in FIRST_LINES_CTEST_TO_SKIP:
+            self.ctestSublogWriter.write(line)
+        testEndMatch = TEST_END_REGEX.search(line)
+        if testEndMatch is None:
+            return
+        testName = testEndMatch.group(4)
+        testNumber = testEndMatch.group(3)
+        testSuccess = testEndMatch.group(5).strip()
+        if self.ctestSublogWriter is not None:
+            self.ctestSublogWriter.completeTest(testName)
+        testInfo = CtestResult(testEndMatch.group(1), testNumber, testName, testSuccess, testEndMatch.group(6))
+        self.addTestToAllCtest(testInfo)
+        if testSuccess == PASSED:
+            self.failedCtests.pop(testNumber, None)
+            # Ctest runs the failed test again when it is asked to repeat the tests until they pass
+            if testNumber in self.reportedFailures:
+                self.flakyCtests[testNumber] = testName
+        else:
+            self.reportedFailures.add(testNumber)
+            self.addTestToFailedCtest(testInfo)
+
+    def startLogParsing(self):
+        self.setLogKeywords([keyword for keyword, _, _, _ in LOG_HEADERS] + [
+            CTEST_FIRST_LINE_KEYWORD, CTEST_LAST_LINE_KEYWORD, FULL_TESTS_LIST_KEYWORD,
+            MAXSCALE_VERSION_START_KEYWORD, MAXSCALE_VERSION_END_KEYWORD
+        ])
+        # Lines are split the same way reading the log in the text mode splits them
+        self.logDecoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("UTF-8")("replace"), True)
+        self.pendingLogLine = ""
+        self.logParsingDone = False
+
+    def feedLog(self, data, final=False):
+        """
+        Parse the next part of the build log as it is being written
+        :param data: bytes of the log that follow the previous part
+        :param final: True if it is the last part of the log
+        """
+        if self.logParsingDone:
+            return
+        lines = (self.pendingLogLine + self.logDecoder.decode(data, final)).split("\n")
+        self.pendingLogLine = lines.pop()
+        for line in lines:
+            if self.parseLogLine(line + "\n"):
+                self.logParsingDone = True
+                return
+        if final and self.pendingLogLine:
+            self.logParsingDone = self.parseLogLine(self.pendingLogLine)
+
+    def finishLogParsing(self):
+        if self.ctestSublogWriter is not None:
+            self.ctestSublogWriter.close()
+            self.ctestSublogWriter = None
+
+        if self.ctestExecuted:
+            self.findTestsInfo()
+            if not self.ctestSummary:
+                self.ctestSummary = CTEST_TIMED_OUT_SUMMARY\
+                    .format(len(self.failedCtestInfo[TESTS]), len(self.allCtestInfo[TESTS]))
+                self.testQuantity = len(self.allCtestInfo[TESTS])
+
+            self.allCtestInfo.update({TESTS_COUNT: self.testQuantity})
+            self.failedCtestInfo.update({TESTS_COUNT: self.testQuantity})
         else:
-            self.allCtestInfo[index] = testInfo
+            self.ctestSummary = CTEST_SUMMARY_NOTE_FOUND
+            self.allCtestInfo = {TESTS_COUNT: NOT_FOUND, FAILED_TESTS_COUNT: NOT_FOUND, TESTS: []}
+            self.failedCtestInfo = {TESTS_COUNT: NOT_FOUND, FAILED_TESTS_COUNT: NOT_FOUND, TESTS: []}
 
     def parseCtestLog(self):
-        ctestFirstLineRegex = re.compile("Constructing a list of tests")
-        ctestLastLineRegex = re.compile("tests passed,.+tests failed out of (.+)")
-        maxscaleCommitRegex = re.compile(r"MaxScale\s+.*\d+\.*\d*\.*\d*\s+-\s+(.+)")
-        cmakeFlagsRegex = re.compile(r"CMake flags:\s+(.+)")
-        maxscaleSourceRegex = re.compile(r"Source:\s+(.+)")
-        logsDirRegex = re.compile(r"^Logs go to \/home\/vagrant\/LOGS\/(.+)$")
-        maxscaleVersionStartRegex = re.compile(".*Maxscale_full_version_start:.*")
-        maxscaleVersionEndRegex = re.compile(".*Maxscale_full_version_end.*")
-        maxscaleVersionStartFound = False
-        maxscaleVersionEndFound = False
-        fullTestsListStartRegex = re.compile("^===Full test list begin===$")
-        fullTestsListEndRegex = re.compile("^===Full test list end===$")
-        fullTestsListIsCurrent = False
-
-        with open(self.args.log_file, encoding="UTF-8") as file:
-            for line in file:
-                if maxscaleVersionEndRegex.search(line):
-                    maxscaleVersionEndFound = True
-                if maxscaleVersionStartFound and not maxscaleVersionEndFound and line.strip():
-                    self.maxscaleEntity.append(line.strip())
-                if maxscaleVersionStartRegex.search(line):
-                    maxscaleVersionStartFound = True
-                if fullTestsListStartRegex.search(line):
-                    fullTestsListIsCurrent = True
-                if fullTestsListEndRegex.search(line):
-                    fullTestsListIsCurrent = False
-                if fullTestsListIsCurrent:
-                    testInfo = self.parseTestFromTestsList(line, len(self.allCtestInfo) + 1)
-                    if testInfo is not None:
-                        self.addTestToAllCtest(testInfo)
-                        self.addTestToFailedCtest(testInfo)
-                if maxscaleCommitRegex.search(line) and not self.maxscaleCommit:
-                    self.maxscaleCommit = maxscaleCommitRegex.search(line).group(1)
-                if cmakeFlagsRegex.search(line) and not self.cmakeFlags:
-                    self.cmakeFlags = cmakeFlagsRegex.search(line).group(1).strip()
-                if maxscaleSourceRegex.search(line) and not self.maxscaleSource:
-                    self.maxscaleSource = maxscaleSourceRegex.search(line).group(1).strip()
-                if logsDirRegex.search(line) and not self.logsDir:
-                    self.logsDir = logsDirRegex.search(line).group(1).strip()
-                if ctestFirstLineRegex.search(line):
-                    self.ctestExecuted = True
-                    ctestLog = []
-                    testQuantity = 0
-                if self.ctestExecuted:
-                    if ctestLastLineRegex.search(line):
-                        self.ctestSummary = line.strip()
-                        testQuantity = ctestLastLineRegex.search(line).group(1)
+        self.startLogParsing()
+        try:
+            with open(self.args.log_file, encoding="UTF-8", errors="replace") as file:
+                for line in file:
+                    if self.parseLogLine(line):
                         break
-                    ctestLog.append(line)
-
-            if self.ctestExecuted:
-                self.findTestsInfo(ctestLog)
-                if not self.ctestSummary:
-                    self.ctestSummary = "timed out, {} tests failed out of {} executed"\
-                        .format(len(self.failedCtestInfo[TESTS]), len(self.allCtestInfo[TESTS]))
-                    testQuantity = len(self.allCtestInfo[TESTS])
-
-                self.allCtestInfo.update({TESTS_COUNT: testQuantity})
-                self.failedCtestInfo.update({TESTS_COUNT: testQuantity})
-            else:
-                self.ctestSummary = CTEST_SUMMARY_NOTE_FOUND
-                self.allCtestInfo = {TESTS_COUNT: NOT_FOUND, FAILED_TESTS_COUNT: NOT_FOUND, TESTS: []}
-                self.failedCtestInfo = {TESTS_COUNT: NOT_FOUND, FAILED_TESTS_COUNT: NOT_FOUND, TESTS: []}
+        finally:
+            self.finishLogParsing()
+
+    def applyRerunLog(self, fileName):
+        """
+        Take the results of the failed tests that have been run again on the same VMs from their own log.
+        The tests that pass there are flaky, the ones that fail again keep their first result.
+        """
+        if not self.ctestExecuted or not os.path.exists(fileName):
+            return
+        rerunParser = CTestParser(options.parse_args([fileName]))
+        rerunParser.parseCtestLog()
+        for number, test in rerunParser.allCtests.items():
+            failedTest = self.failedCtests.get(number)
+            if failedTest is None or test.success != PASSED:
+                continue
+            self.failedCtests.pop(number)
+            self.addTestToAllCtest(CtestResult(failedTest.indexNumber, number, failedTest.name, PASSED, test.time))
+            self.flakyCtests[number] = failedTest.name
+        self.finishLogParsing()
+        if self.flakyCtests:
+            self.updateCtestSummary()
+
+    def updateCtestSummary(self):
+        """Count the failed tests in the summary again after the failures have been changed by the rerun"""
+        failedCount = len(self.failedCtestInfo[TESTS])
+        if CTEST_LAST_LINE_REGEX.search(self.ctestSummary) and str(self.testQuantity).strip().isdigit():
+            testQuantity = int(self.testQuantity)
+            # Ctest rounds the percentage and shows at most 99% when some tests have failed
+            passedPercent = int((testQuantity - failedCount) * 100 / testQuantity + 0.5) if testQuantity else 0
+            if failedCount:
+                passedPercent = min(passedPercent, 99)
+            self.ctestSummary = CTEST_SUMMARY.format(passedPercent, failedCount, testQuantity)
+        elif self.ctestSummary.startswith(CTEST_TIMED_OUT_SUMMARY.split(",")[0]):
+            self.ctestSummary = CTEST_TIMED_OUT_SUMMARY.format(failedCount, len(self.allCtestInfo[TESTS]))
+
+    def classifyFailures(self):
+        """Names of the tests that have failed in this run mapped to their class, FLAKY or REAL"""
+        classes = {name: FLAKY for name in self.flakyCtests.values()}
+        classes.update({test.name: REAL for test in self.failedCtests.values()})
+        return classes
+
+    def saveLiveResults(self, fileName):
+        """Save results of the tests that have finished so far, the file is replaced at once"""
+        self.findTestsInfo()
+        self.allCtestInfo.update({TESTS_COUNT: self.testQuantity or len(self.allCtests)})
+        temporaryFileName = "{}.{}".format(fileName, os.getpid())
+        with open(temporaryFileName, "w") as file:
+            file.write(self.generateMrResults(self.allCtestInfo))
+            file.write("\n")
+        os.replace(temporaryFileName, fileName)
+
+    def saveParsedLogState(self, fileName):
+        """Save the result of parsing the log, so the final parse does not read the log again"""
+        state = {attribute: getattr(self, attribute) for attribute in PARSED_LOG_STATE_ATTRIBUTES}
+        state.update({
+            "allCtests": [test.toDict() for test in self.allCtests.values()],
+            "failedCtests": [test.number for test in self.failedCtests.values()],
+        })
+        temporaryFileName = "{}.{}".format(fileName, os.getpid())
+        with open(temporaryFileName, "w") as file:
+            json.dump(state, file)
+        os.replace(temporaryFileName, fileName)
+
+    def loadParsedLogState(self, fileName):
+        with open(fileName) as file:
+            state = json.load(file)
+        for attribute in PARSED_LOG_STATE_ATTRIBUTES:
+            setattr(self, attribute, state[attribute])
+        self.allCtests = {}
+        for test in state["allCtests"]:
+            self.addTestToAllCtest(CtestResult(test[TEST_INDEX_NUMBER], test[TEST_NUMBER], test[TEST_NAME],
+                                               test[TEST_SUCCESS], test[TEST_TIME]))
+        self.failedCtests = {number: self.allCtests[number] for number in state["failedCtests"]}
+        self.finishLogParsing()
 
     def parseLeakSummaryFromFile(self, fileName):
-        leakSummaryFirstLineRegex = re.compile(r"^==\d+==\s+LEAK SUMMARY:$")
-        leakSummaryEndLineRegex = re.compile(r"^==\d+==\s$")
-        # Example of line: `==12030==      possibly lost: 15 bytes in 26 blocks`
-        # where '==12030==      ' is first group, '15' is second group, '26' is third group
-        fieldRegex = re.compile(r"^(==\d+==\s+)[\w\s]*\w:\s+([0-9]*\,?[0-9]+) bytes in ([0-9]*\,?[0-9]+) blocks")
-
-        fields = []
-        leakSummaryBlockBegin = False
-        with open(fileName, encoding="UTF-8") as file:
-            for line in file:
-                if leakSummaryFirstLineRegex.search(line):
-                    leakSummaryBlockBegin = True
-                if leakSummaryEndLineRegex.search(line) and leakSummaryBlockBegin:
-                    break
-                if fieldRegex.search(line) and leakSummaryBlockBegin:
-                    matchedGroups = re.match(fieldRegex, line)
-                    bytesCount = matchedGroups.group(2)
-                    if bytesCount != '0':
-                        linePrefix = matchedGroups.group(1)
-                        fields.append(line.replace(linePrefix, '').strip('\n'))
-        return fields
+        return readLeakSummary(fileName)
 
     def parseLeakSummaryFromTestsLogs(self, testsLogsDir):
         if not os.path.exists(testsLogsDir):
             return
-        # Example of line: /home/vagrant/LOGS/run_test-927/LOGS/long_test/000/valgrind00.log
-        # where 'long_test' is first group, '000' is second group
-        testNameRegex = re.compile(r"{}/([^/]+)/([^/]+)".format(testsLogsDir))
-        findOutput = subprocess.check_output(['find {} -iname "valgrind*.log"'.format(testsLogsDir)], shell=True)\
-                               .decode("utf-8")
+        valgrindLogs = findFirstRunValgrindLogs(testsLogsDir)
+        fileNames = [fileName for _, fileName in valgrindLogs]
+        if len(fileNames) > 1 and (os.cpu_count() or 1) > 1:
+            # The script is started directly, so the workers must be forked rather than re-import it
+            with concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("fork")) as executor:
+                leakSummaries = list(executor.map(readLeakSummary, fileNames, chunksize=8))
+        else:
+            leakSummaries = [readLeakSummary(fileName) for fileName in fileNames]
         testsLeakSummary = {}
-        valgrindFiles = list(filter(None, findOutput.split('\n')))
-        for fileName in valgrindFiles:
-            matchedGroups = re.match(testNameRegex, fileName)
-            testChildDir = matchedGroups.group(2)
-            if testChildDir == '000':
-                testName = matchedGroups.group(1)
-                testsLeakSummary[testName] = self.parseLeakSummaryFromFile(fileName)
+        for (testName, _), leakSummary in zip(valgrindLogs, leakSummaries):
+            testsLeakSummary[testName] = leakSummary
         self.leakSummary = testsLeakSummary
 
-    def findTestsInfo(self, ctestLog):
-        if self.args.ctest_sublogs_path:
-            os.makedirs(self.args.ctest_sublogs_path, exist_ok=True)
-        ctestSublog = []
-        for line in ctestLog:
-            testEndRegex = re.compile(r"(\d+)\/(\d+)\s+Test\s+#(\d+):[\s]+([^\s]+)\s+[\.\*]+([^\d]+)([\d\.]+)")
-            if line.strip() not in FIRST_LINES_CTEST_TO_SKIP:
-                ctestSublog.append(line)
-            if testEndRegex.search(line):
-                testIndexNumber = testEndRegex.search(line).group(1)
-                testSuccess = testEndRegex.search(line).group(5).strip()
-                testName = testEndRegex.search(line).group(4)
-                if self.args.ctest_sublogs_path:
-                    os.makedirs("{}/{}".format(self.args.ctest_sublogs_path, testName), exist_ok=True)
-                    with open("{}/{}/ctest_sublog".format(self.args.ctest_sublogs_path, testName), "w") as file:
-                        file.writelines(ctestSublog)
-                ctestSublog = []
-                testNumber = testEndRegex.search(line).group(3)
-                testTime = testEndRegex.search(line).group(6)
-                testInfo = {
-                    TEST_INDEX_NUMBER: testIndexNumber,
-                    TEST_NUMBER: testNumber,
-                    TEST_NAME: testName,
-                    TEST_SUCCESS: testSuccess,
-                    TEST_TIME: testTime
-                }
-                self.addTestToAllCtest(testInfo)
-                if testSuccess == PASSED:
-                    try:
-                        testIndex = self.failedCtestIndexes.index(testNumber)
-                    except ValueError:
-                        pass
-                    else:
-                        self.failCtestCounter -= 1
-                        self.failedCtestInfo[testIndex:testIndex + 1] = []
-                else:
-                    self.addTestToFailedCtest(testInfo)
-        self.allCtestInfo = {FAILED_TESTS_COUNT: self.failCtestCounter, TESTS: self.allCtestInfo}
-        self.failedCtestInfo = {FAILED_TESTS_COUNT: self.failCtestCounter, TESTS: self.failedCtestInfo}
+    def findTestsInfo(self):
+        """Convert the recorded test results into the output structures"""
+        failedCount = len(self.failedCtests)
+        self.allCtestInfo = {FAILED_TESTS_COUNT: failedCount,
+                             TESTS: [test.toDict() for test in self.allCtests.values()]}
+        self.failedCtestInfo = {FAILED_TESTS_COUNT: failedCount,
+                                TESTS: [test.toDict() for test in self.failedCtests.values()]}
 
     def generateCtestArguments(self):
         if not self.ctestExecuted:
             return NOT_FOUND
-        ctestArguments = []
-        testIndexesArray = self.failedCtestIndexes if self.args.only_failed else self.allCtestIndexes
-        sortedTestIndexesArray = sorted(testIndexesArray, key=lambda item: int(item))
-        if not sortedTestIndexesArray:
+        testIndexesArray = self.failedCtests if self.args.only_failed else self.allCtests
+        if not testIndexesArray:
             return NOT_FOUND
-        for testIndex in sortedTestIndexesArray:
-            if testIndex == sortedTestIndexesArray[0]:
-                ctestArguments.extend([testIndex, testIndex])
-                if len(sortedTestIndexesArray) > 1:
-                    ctestArguments.append("1")
-            else:
-                ctestArguments.append(testIndex)
-        return ",".join(ctestArguments)
+        return ctestIndexArgument(testIndexesArray)
 
     def getTestCodeCommit(self):
         if not os.environ.get(WORKSPACE):
@@ -365,6 +708,8 @@ class CTestParser:
         for test in parsedCtestData[TESTS]:
             hrTests.append("{} - {} ({})".format(test[TEST_NUMBER], test[TEST_NAME], test[TEST_SUCCESS]))
         hrTests.extend(["", "{}: {}".format(CTEST_ARGUMENTS_HR, self.generateCtestArguments()), ""])
+        if self.flakyCtests:
+            hrTests.extend(["{}: {}".format(FLAKY_TESTS_HR, ", ".join(sorted(self.flakyCtests.values()))), ""])
         maxscaleCommit = self.maxscaleCommit or NOT_FOUND
         maxscaleSource = self.maxscaleSource or NOT_FOUND
         cmakeFlags = self.cmakeFlags or NOT_FOUND
@@ -382,7 +727,7 @@ class CTestParser:
         hrTests.extend(self.generateHrLeakSummaryResult())
         return hrTests
 
-    def generateMrResults(self, parsedCtestData):
+    def generateMrResults(self, parsedCtestData, compact=False):
         res = parsedCtestData
         res.update(self.generateRunTestBuildParametersMr())
         res.update({
@@ -392,10 +737,16 @@ class CTestParser:
             CMAKE_FLAGS_MR: self.cmakeFlags or NOT_FOUND,
             LOGS_DIR_MR: self.logsDir or NOT_FOUND,
             CTEST_ARGUMENTS_MR: self.generateCtestArguments(),
-            LEAK_SUMMARY_MR: self.leakSummary
+            LEAK_SUMMARY_MR: self.leakSummary,
+            FLAKY_TESTS_MR: sorted(self.flakyCtests.values()),
+            FAILURE_CLASSES_MR: self.classifyFailures(),
         })
         if not self.ctestExecuted:
             res.update({ERROR: CTEST_NOT_EXECUTED_ERROR})
+        if compact:
+            res = dict(res)
+            res.update({RESULTS_FORMAT: COMPACT_RESULTS_FORMAT, TESTS: compactTests(res[TESTS])})
+            return json.dumps(res, separators=(",", ":"))
         return json.dumps(res, sort_keys=True, indent=2)
 
     def showHrResults(self, parsedCtestData):
@@ -412,8 +763,10 @@ class CTestParser:
             file.write("\n")
 
     def saveAllResultsToJsonFile(self):
-        with open(self.args.output_log_json_file, "w") as file:
-            file.write(self.generateMrResults(self.allCtestInfo))
+        fileName = self.args.output_log_json_file
+        openFile = gzip.open if fileName.endswith(GZIP_EXTENSION) else open
+        with openFile(fileName, "wt") as file:
+            file.write(self.generateMrResults(self.allCtestInfo, self.args.compact_json))
             file.write("\n")
 
     def showCtestParsedInfo(self):
@@ -423,7 +776,12 @@ class CTestParser:
             self.showHrResults(self.failedCtestInfo if self.args.only_failed else self.allCtestInfo)
 
     def parse(self):
-        self.parseCtestLog()
+        if self.args.parsed_log_state and os.path.exists(self.args.parsed_log_state):
+            self.loadParsedLogState(self.args.parsed_log_state)
+        else:
+            self.parseCtestLog()
+        if self.args.rerun_log:
+            self.applyRerunLog(self.args.rerun_log)
         self.parseLeakSummaryFromTestsLogs("{}/LOGS/{}/LOGS".format(os.environ["HOME"], self.logsDir))
         self.showCtestParsedInfo()
         if self.args.output_log_file:
@@ -433,10 +791,13 @@ class CTestParser:
 
     def copyLogs(self):
         for logDirectory in os.listdir(self.args.ctest_sublogs_path):
+            sublog = os.path.join(self.args.ctest_sublogs_path, logDirectory, CTEST_SUBLOG_FILE)
+            if logDirectory.startswith(".") or not os.path.isfile(sublog):
+                continue
             targetDirectory = os.path.join(self.args.store_directory, logDirectory)
             os.umask(0o002)
             os.makedirs(targetDirectory, exist_ok=True)
-            shutil.copy(os.path.join(self.args.ctest_sublogs_path, logDirectory, "ctest_sublog"), targetDirectory)
+            shutil.copy(sublog, targetDirectory)
 
 
 def main(args=None):
@@ -446,5 +807,5 @@ def main(args=None):
     parser.copyLogs()
 
 
-if os.path.samefile(__file__, sys.argv[0]):
+if __name__ == "__main__":
     main()
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
 import os
-import subprocess
+import pathlib
 import sys
 import argparse
 
+sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
+import log_tee
+
 
 def parseArguments():
     parser = argparse.ArgumentParser(description="Tool for running the performance test")
@@ -23,26 +26,18 @@ def main():
     if 'COMP_WORDBREAKS' in os.environ:
         del os.environ['COMP_WORDBREAKS']
 
-    logFile = open('{}/results_{}'.format(arguments.build_dir, arguments.build_number), 'w')
-    process = subprocess.Popen(['./bin/performance_test', '-v',
-                                '--server-config', '{}/{}'.format(os.environ['HOME'], arguments.network_config_path),
-                                '--remote-test-app',
-                                '{}/.config/performance_test/run_sysbench.sh'.format(os.environ['HOME']),
-                                '--db-server-2-config', 'slave-config.sql.erb',
-                                '--db-server-3-config', 'slave-config.sql.erb',
-                                '--db-server-4-config', 'slave-config.sql.erb',
-                                '--mariadb-version', arguments.version,
-                                '--maxscale-config', arguments.perf_cnf_template,
-                                '--maxscale-version', arguments.target,
-                                '--keep-servers', 'true'],
-                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    for byteLine in process.stdout:
-        line = byteLine.decode("utf-8", "replace")
-        sys.stdout.write(line)
-        logFile.write(line)
-    process.wait()
-    logFile.close()
-    sys.exit(process.returncode)
+    command = ['./bin/performance_test', '-v',
+               '--server-config', '{}/{}'.format(os.environ['HOME'], arguments.network_config_path),
+               '--remote-test-app', '{}/.config/performance_test/run_sysbench.sh'.format(os.environ['HOME']),
+               '--db-server-2-config', 'slave-config.sql.erb',
+               '--db-server-3-config', 'slave-config.sql.erb',
+               '--db-server-4-config', 'slave-config.sql.erb',
+               '--mariadb-version', arguments.version,
+               '--maxscale-config', arguments.perf_cnf_template,
+               '--maxscale-version', arguments.target,
+               '--keep-servers', 'true']
+    returnCode = log_tee.runAndTee(command, '{}/results_{}'.format(arguments.build_dir, arguments.build_number))
+    sys.exit(returnCode)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,35 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import json
 import os
 import logging
+import pathlib
+import re
+import signal
 import sys
-import subprocess
+import threading
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
+import log_tee
+import parse_ctest_log
+
+# Partial test results are saved at most once per interval in seconds
+LIVE_RESULTS_INTERVAL = 10
+# Running tests are checked against their time limits once per interval in seconds
+WATCHDOG_INTERVAL = 5
+# A test that is still running after it has been killed is killed again after this number of seconds
+WATCHDOG_RETRY_INTERVAL = 60
+# Failures of more tests than this are not rerun, the build is broken rather than the tests are flaky
+RERUN_MAX_TESTS = 10
+
+TEST_START_REGEX = re.compile(r"^\s*Start\s+(\d+):\s+(\S+)")
+TEST_COMMAND_REGEX = re.compile(r"^(\d+): Test command: (\S+)")
+
+# Ctest executable, its working directory and environment, the failed tests are run again with them
+CtestContext = collections.namedtuple("CtestContext", ["executable", "directory", "environment"])
 
 
 def main():
@@ -14,7 +39,18 @@ def main():
     if not os.path.exists(scriptPath):
         logging.error("The script '%s' doest not exist. Unable to execute it", scriptPath)
         sys.exit(1)
-    runScript(scriptPath, arguments.log_file, arguments.result_file)
+    liveParser = None
+    if arguments.ctest_sublogs_path or arguments.ctest_results_file or arguments.parsed_log_state:
+        liveParser = LiveCtestParser(arguments.log_file, arguments.ctest_sublogs_path, arguments.ctest_results_file)
+    watchdog = None
+    if arguments.test_timeouts or arguments.rerun_log:
+        timeouts = {}
+        if arguments.test_timeouts:
+            with open(arguments.test_timeouts) as file:
+                timeouts = json.load(file)
+        watchdog = TestWatchdog(timeouts)
+    runScript(scriptPath, arguments.log_file, arguments.result_file, liveParser, arguments.parsed_log_state,
+              watchdog, arguments.rerun_log, arguments.rerun_max_tests)
 
 
 def parseArguments():
@@ -23,25 +59,294 @@ def parseArguments():
     parser.add_argument("--script_name", help="Name of the script to run", required=True)
     parser.add_argument("--log_file", help="Location of the log file to put data into", required=True)
     parser.add_argument("--result_file", help="Location of the file with test results", required=True)
+    parser.add_argument("--ctest_sublogs_path", help="Parse the log while the script runs and put ctest sublogs here")
+    parser.add_argument("--ctest_results_file", help="Parse the log while the script runs and keep results "
+                                                     "of the finished tests in this JSON file")
+    parser.add_argument("--parsed_log_state", help="Parse the log while the script runs and save the result "
+                                                   "for parse_ctest_log.py into this file")
+    parser.add_argument("--test_timeouts", help="JSON file with time limits of the tests, a test that runs longer "
+                                                "than its limit is killed")
+    parser.add_argument("--rerun_log", help="Run the failed tests again after the script and put their output into "
+                                            "this file. The script keeps the VMs for it, they are left for the "
+                                            "build to destroy")
+    parser.add_argument("--rerun_max_tests", type=int, default=RERUN_MAX_TESTS,
+                        help="Do not run the failed tests again if more tests have failed")
     return parser.parse_args()
 
 
-def runScript(scriptPath, buildLogFile, resultFile):
+class LiveCtestParser:
+    """
+    Feeds the log to the CTestParser while the script is running. Ctest sublogs and results of the finished tests
+    are available before the script ends, parse_ctest_log.py takes the final result instead of reading the log.
+    """
+
+    def __init__(self, buildLogFile, sublogsPath, resultsFile):
+        parserArguments = [buildLogFile]
+        if sublogsPath:
+            parserArguments.extend([parse_ctest_log.CTEST_SUBLOGS_PATH, sublogsPath])
+        self.parser = parse_ctest_log.CTestParser(parse_ctest_log.options.parse_args(parserArguments))
+        self.parser.startLogParsing()
+        self.resultsFile = resultsFile
+        self.savedTestsCount = 0
+        self.lastSave = time.monotonic()
+        self.failed = False
+
+    def __call__(self, data):
+        if self.failed:
+            return
+        try:
+            self.parser.feedLog(data)
+            testsCount = len(self.parser.allCtests)
+            if testsCount != self.savedTestsCount and time.monotonic() - self.lastSave >= LIVE_RESULTS_INTERVAL:
+                self.saveResults()
+        except Exception:
+            logging.exception("Unable to parse the log while the script is running, it will be parsed afterwards")
+            self.failed = True
+
+    def saveResults(self):
+        if self.resultsFile:
+            self.parser.saveLiveResults(self.resultsFile)
+        self.savedTestsCount = len(self.parser.allCtests)
+        self.lastSave = time.monotonic()
+
+    def finish(self, stateFile):
+        if self.failed:
+            return
+        try:
+            self.parser.feedLog(b"", final=True)
+            self.parser.finishLogParsing()
+            self.saveResults()
+            if stateFile:
+                self.parser.saveParsedLogState(stateFile)
+        except Exception:
+            logging.exception("Unable to finish parsing the log, it will be parsed afterwards")
+
+
+def listProcesses():
+    """Get the parent id, name and command line of each process of the system"""
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as file:
+                stat = file.read()
+            with open("/proc/{}/cmdline".format(entry), "rb") as file:
+                commandLine = file.read().split(b"\0")
+        except OSError:
+            continue
+        # The name is in parentheses and may contain spaces, the parent id follows the state after it
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        parentId = int(stat[stat.rindex(")") + 2:].split()[1])
+        processes[int(entry)] = (parentId, name, [argument.decode(errors="replace") for argument in commandLine])
+    return processes
+
+
+def descendantsOf(processes, processId):
+    """Ids of the children of the process, their children and so on"""
+    children = {}
+    for childId, (parentId, _, _) in processes.items():
+        children.setdefault(parentId, []).append(childId)
+    found = []
+    queue = [processId]
+    while queue:
+        processChildren = children.get(queue.pop(), [])
+        found.extend(processChildren)
+        queue.extend(processChildren)
+    return found
+
+
+def readCtestContext(processId):
+    """Get the CtestContext of the running ctest process, None if the process has finished"""
+    try:
+        executable = os.readlink("/proc/{}/exe".format(processId))
+        directory = os.readlink("/proc/{}/cwd".format(processId))
+        with open("/proc/{}/environ".format(processId), "rb") as file:
+            environment = file.read().decode(errors="replace")
+    except OSError:
+        return None
+    return CtestContext(executable, directory,
+                        dict(entry.split("=", 1) for entry in environment.split("\0") if "=" in entry))
+
+
+class TestWatchdog:
+    """
+    Kills the ctest test that runs longer than its time limit, so a hung test does not hold the VMs until the step
+    times out. Ctest reports the killed test as failed and goes on with the next one. Tests are tracked by the
+    "Start" and result lines of the ctest output, the test process is found among the descendants of this script.
+    The context of the ctest that runs the tests is recorded, so the failed tests can be run again afterwards.
+    """
+
+    def __init__(self, timeouts, checkInterval=WATCHDOG_INTERVAL):
+        self.limits = timeouts.get("tests", {})
+        self.defaultLimit = timeouts.get("default")
+        self.checkInterval = checkInterval
+        self.running = {}
+        self.pending = b""
+        self.ctestContext = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    def __call__(self, data):
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        with self.lock:
+            for line in lines:
+                self.processLine(line.decode(errors="replace"))
+
+    def processLine(self, line):
+        match = TEST_START_REGEX.match(line)
+        if match:
+            self.running[match.group(1)] = {"name": match.group(2), "start": time.monotonic(),
+                                            "command": None, "killed": None}
+            return
+        match = TEST_COMMAND_REGEX.match(line)
+        if match and match.group(1) in self.running:
+            self.running[match.group(1)]["command"] = os.path.basename(match.group(2))
+            return
+        match = parse_ctest_log.TEST_END_REGEX.search(line)
+        if match:
+            self.running.pop(match.group(3), None)
+
+    def clear(self):
+        """Forget the tests of the finished ctest run"""
+        with self.lock:
+            self.running = {}
+            self.pending = b""
+
+    def limit(self, name):
+        return self.limits.get(name, self.defaultLimit)
+
+    def watch(self):
+        while not self.stopped.wait(self.checkInterval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Unable to check the running tests")
+
+    def check(self):
+        now = time.monotonic()
+        with self.lock:
+            overdue = [test for test in self.running.values()
+                       if self.limit(test["name"]) is not None and now - test["start"] > self.limit(test["name"])
+                       and (test["killed"] is None or now - test["killed"] > WATCHDOG_RETRY_INTERVAL)]
+            singleTest = len(self.running) == 1
+            testsRunning = bool(self.running)
+        if testsRunning:
+            self.recordCtestContext()
+        for test in overdue:
+            logging.warning("Test %s has been running for %d seconds, longer than its limit of %d seconds, "
+                            "killing it", test["name"], now - test["start"], self.limit(test["name"]))
+            test["killed"] = now
+            self.kill(test, singleTest)
+
+    def recordCtestContext(self):
+        """Remember the ctest process that runs the tests"""
+        processes = listProcesses()
+        for processId in descendantsOf(processes, os.getpid()):
+            if processes[processId][1] == "ctest":
+                context = readCtestContext(processId)
+                if context is not None:
+                    self.ctestContext = context
+                    return
+
+    def kill(self, test, singleTest):
+        processes = listProcesses()
+        scriptProcesses = descendantsOf(processes, os.getpid())
+        names = {test["name"], test["command"]}
+        # Scripts run by an interpreter have their name in the second argument
+        targets = [processId for processId in scriptProcesses
+                   if names & {os.path.basename(argument) for argument in processes[processId][2][:2]}]
+        if not targets and singleTest:
+            # Ctest runs the test as its child, the name of the executable may differ from the name of the test
+            targets = [processId for processId in scriptProcesses if processes[processes[processId][0]][1] == "ctest"]
+        if not targets:
+            logging.warning("Unable to find the process of the test %s", test["name"])
+        for target in targets:
+            for processId in [target] + descendantsOf(processes, target):
+                try:
+                    os.kill(processId, signal.SIGKILL)
+                except OSError as error:
+                    logging.warning("Unable to kill process %d of the test %s: %s", processId, test["name"], error)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ChainedConsumer:
+    """Passes the output of the script to several consumers"""
+
+    def __init__(self, *consumers):
+        self.consumers = [consumer for consumer in consumers if consumer is not None]
+
+    def __call__(self, data):
+        for consumer in self.consumers:
+            consumer(data)
+
+
+def rerunFailedTests(liveParser, watchdog, rerunLogFile, maxTests=RERUN_MAX_TESTS):
+    """
+    Run the tests that have failed once more with the same ctest, working directory and environment, so they
+    use the VMs the script has created. The output goes into its own log, parse_ctest_log.py merges the results.
+    """
+    if liveParser is None or liveParser.failed:
+        logging.warning("The log has not been parsed while the script was running, the failed tests are not rerun")
+        return
+    parser = liveParser.parser
+    failedTests = [number for number in parser.failedCtests if number in parser.reportedFailures]
+    if not failedTests:
+        return
+    if len(failedTests) > maxTests:
+        logging.info("%d tests have failed, more than %d, the failed tests are not rerun", len(failedTests), maxTests)
+        return
+    if watchdog.ctestContext is None:
+        logging.warning("Ctest has not been seen running the tests, unable to run the failed tests again")
+        return
+    command = [watchdog.ctestContext.executable, "-VV", "-I", parse_ctest_log.ctestIndexArgument(failedTests)]
+    logging.info("Running %d failed tests again: %s", len(failedTests), " ".join(command))
+    watchdog.clear()
+    try:
+        log_tee.runAndTee(command, rerunLogFile, consumer=watchdog, cwd=watchdog.ctestContext.directory,
+                          env=watchdog.ctestContext.environment)
+    except OSError:
+        logging.exception("Unable to run the failed tests again")
+
+
+def scriptEnvironment(rerunLogFile):
+    """
+    Environment of the script. The script destroys the VMs when it finishes, so it is told to keep them when
+    the failed tests are rerun. The build destroys them afterwards unless do_not_destroy_vm is set for it.
+    """
+    environment = dict(os.environ)
+    if rerunLogFile:
+        environment["do_not_destroy_vm"] = "yes"
+    return environment
+
+
+def runScript(scriptPath, buildLogFile, resultFile, liveParser=None, parsedLogStateFile=None, watchdog=None,
+              rerunLogFile=None, rerunMaxTests=RERUN_MAX_TESTS):
     logging.info("Executing script '%s'", scriptPath)
-    logFile = open(buildLogFile, "w")
-    process = subprocess.Popen([scriptPath], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    for byteLine in process.stdout:
-        line = byteLine.decode("utf-8", "replace")
-        sys.stdout.write(line)
-        sys.stdout.flush()
-        logFile.write(line)
-    process.wait()
-    logFile.close()
+    if rerunLogFile and os.path.exists(rerunLogFile):
+        os.remove(rerunLogFile)
+    consumer = ChainedConsumer(liveParser, watchdog) if liveParser is not None or watchdog is not None else None
+    try:
+        returnCode = log_tee.runAndTee([scriptPath], buildLogFile, consumer=consumer,
+                                       env=scriptEnvironment(rerunLogFile))
+        if liveParser is not None:
+            liveParser.finish(parsedLogStateFile)
+        if rerunLogFile and watchdog is not None:
+            rerunFailedTests(liveParser, watchdog, rerunLogFile, rerunMaxTests)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
 
     testLogFile = open(resultFile, "w")
-    testLogFile.write(str(process.returncode))
+    testLogFile.write(str(returnCode))
     testLogFile.close()
-    sys.exit(process.returncode)
+    sys.exit(returnCode)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import gzip
+import json
+import math
+import os
+import re
+import sys
+
+# Command line options
+DB_INFO_OPTION = '--database-info'
+STORE_OPTION = '--store'
+BRANCH_OPTION = '--branch'
+BOX_OPTION = '--box'
+BACKEND_OPTION = '--backend'
+TEST_OPTION = '--test'
+JSON_OPTION = '--json'
+
+STORE_FORMAT = 'durations-1'
+DEFAULT_STORE_DIRECTORY = "~/.cache/maxscale-buildbot"
+
+# Number of the latest durations of every test the statistics are computed from
+DURATION_WINDOW = 50
+# Number of the latest test runs read into an empty store
+INITIAL_RUNS = 2000
+# Test runs below the latest known one that are checked again, results of concurrent writers may appear late
+RESCAN_RUNS = 50
+
+# Time limits of the tests in seconds, see testTimeouts
+DEFAULT_TEST_TIMEOUT = 1800
+TEST_TIMEOUT_FLOOR = 300
+TEST_TIMEOUT_FACTOR = 3
+# Number of durations of the test that are needed to set its limit
+MIN_TIMEOUT_SAMPLES = 5
+
+# Generated targets are named <branch>-buildbot-<start time>, see common.initTargetProperty
+GENERATED_TARGET_SUFFIX = re.compile(r"-buildbot-\d{4}-\w{3}-\d{2}-\d{2}-\d{2}-\d{2}$")
+
+KEY_SEPARATOR = "\t"
+
+NEW_RESULTS_QUERY = """
+    SELECT test_run.id AS run_id, test_run.target, test_run.box, test_run.product, test_run.start_time,
+           results.test, results.test_time
+    FROM test_run
+    JOIN results ON results.id = test_run.id
+    WHERE test_run.id > %s AND results.result = 0 AND results.test_time > 0
+    ORDER BY test_run.id
+    """
+
+TestDurationStats = collections.namedtuple("TestDurationStats", ["mean", "p50", "p95", "lastSeen", "count"])
+
+
+def branchOfTarget(target):
+    """Name of the branch the target has been built from"""
+    return GENERATED_TARGET_SUFFIX.sub("", target or "")
+
+
+def percentile(sortedValues, share):
+    """Nearest-rank percentile of the sorted list"""
+    return sortedValues[max(0, math.ceil(share * len(sortedValues)) - 1)]
+
+
+def computeStats(durations, lastSeen, count):
+    durations = sorted(durations)
+    return TestDurationStats(
+        mean=sum(durations) / len(durations),
+        p50=percentile(durations, 0.5),
+        p95=percentile(durations, 0.95),
+        lastSeen=lastSeen,
+        count=count,
+    )
+
+
+class TestDurationStore:
+    """
+    Durations of the passed tests per branch, box and backend kept in a local file between runs.
+    Only the latest DURATION_WINDOW durations of every test are kept, the store is brought up to date
+    by reading the test runs written since the previous refresh.
+    """
+
+    def __init__(self, fileName=None):
+        self.fileName = fileName
+        self.reset()
+
+    def reset(self):
+        self.tests = {}
+        self.lastRunId = 0
+        self.recentRuns = set()
+
+    @staticmethod
+    def fromDirectory(directory, dataBaseInfo):
+        """Create the store kept in the directory for the database described by dataBaseInfo"""
+        info = json.loads(dataBaseInfo)
+        name = re.sub(r"[^\w.-]", "_", "test_durations_{}_{}.json.gz".format(info.get("host"), info.get("database")))
+        return TestDurationStore(os.path.join(os.path.expanduser(directory), name))
+
+    def load(self):
+        if not self.fileName:
+            return
+        try:
+            with gzip.open(self.fileName, "rt") as file:
+                content = json.load(file)
+            if content["format"] != STORE_FORMAT:
+                raise ValueError("Unknown format {}".format(content["format"]))
+            self.tests = content["tests"]
+            self.lastRunId = content["last_run_id"]
+            self.recentRuns = set(content["recent_runs"])
+        except (OSError, ValueError, KeyError):
+            self.reset()
+
+    def save(self):
+        if not self.fileName:
+            return
+        temporaryFileName = "{}.{}".format(self.fileName, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.fileName)), exist_ok=True)
+            with gzip.open(temporaryFileName, "wt") as file:
+                json.dump({
+                    "format": STORE_FORMAT,
+                    "last_run_id": self.lastRunId,
+                    "recent_runs": sorted(self.recentRuns),
+                    "tests": self.tests,
+                }, file, separators=(",", ":"))
+            os.replace(temporaryFileName, self.fileName)
+        except OSError as error:
+            print("Unable to save test durations: {}".format(error))
+
+    def add(self, branch, box, backend, test, duration, seen):
+        """Add the duration of the test to the store, the runs are expected to be added in the order of ids"""
+        key = KEY_SEPARATOR.join((branch, box or "", backend or "", test))
+        durations, lastSeen, count = self.tests.get(key, ([], "", 0))
+        durations.append(round(duration, 1))
+        del durations[:-DURATION_WINDOW]
+        self.tests[key] = [durations, max(lastSeen, seen), count + 1]
+
+    def refresh(self, client):
+        """
+        Read the results of the test runs that are not in the store yet
+        :param client: mysql.connector connection to the results database
+        :return: number of the new durations
+        """
+        return self.addResults(self.fetchNewResults(client))
+
+    def fetchNewResults(self, client):
+        """Read the rows of the results that may be missing from the store, the store itself is not changed"""
+        cursor = client.cursor(dictionary=True)
+        startRunId = self.lastRunId
+        if not startRunId:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM test_run")
+            startRunId = max(0, int(cursor.fetchone()["max_id"]) - INITIAL_RUNS) + RESCAN_RUNS
+        cursor.execute(NEW_RESULTS_QUERY, (max(0, startRunId - RESCAN_RUNS),))
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def addResults(self, rows):
+        """
+        Add the rows read by fetchNewResults to the store, rows of the test runs already in the store are skipped
+        :return: number of the new durations
+        """
+        added = 0
+        newRuns = set()
+        for row in rows:
+            runId = int(row["run_id"])
+            if runId in self.recentRuns:
+                continue
+            newRuns.add(runId)
+            seen = row["start_time"].isoformat() if hasattr(row["start_time"], "isoformat") \
+                else str(row["start_time"] or "")
+            self.add(branchOfTarget(row["target"]), row["box"], row["product"], row["test"],
+                     float(row["test_time"]), seen)
+            added += 1
+        self.lastRunId = max([self.lastRunId] + list(newRuns))
+        self.recentRuns = {runId for runId in self.recentRuns | newRuns if runId > self.lastRunId - RESCAN_RUNS}
+        return added
+
+    def matchingEntries(self, test=None, branch=None, box=None, backend=None):
+        """Entries of the store for the given filters, None matches any value"""
+        for key, entry in self.tests.items():
+            keyBranch, keyBox, keyBackend, keyTest = key.split(KEY_SEPARATOR)
+            if ((test is None or keyTest == test) and (branch is None or keyBranch == branch)
+                    and (box is None or keyBox == box) and (backend is None or keyBackend == backend)):
+                yield keyTest, entry
+
+    def stats(self, test, branch=None, box=None, backend=None):
+        """
+        Duration statistics of the test over all branches, boxes and backends that match the filters
+        :return: TestDurationStats or None if the test has not been seen
+        """
+        return self.allStats(branch, box, backend, test=test).get(test)
+
+    def allStats(self, branch=None, box=None, backend=None, test=None):
+        """
+        Duration statistics of all tests that match the filters
+        :return: dictionary with test names mapped to TestDurationStats
+        """
+        merged = {}
+        for name, (durations, lastSeen, count) in self.matchingEntries(test, branch, box, backend):
+            mergedDurations, mergedLastSeen, mergedCount = merged.get(name, ([], "", 0))
+            merged[name] = (mergedDurations + durations, max(mergedLastSeen, lastSeen), mergedCount + count)
+        return {name: computeStats(*entry) for name, entry in merged.items()}
+
+    def durations(self, statistic="p50", branch=None, box=None, backend=None):
+        """Dictionary with the test names mapped to the given statistic of their durations"""
+        return {name: getattr(stats, statistic) for name, stats in self.allStats(branch, box, backend).items()}
+
+
+def timeLimit(p95, floor=TEST_TIMEOUT_FLOOR, factor=TEST_TIMEOUT_FACTOR):
+    """Time limit for the task with the given 95th percentile of the duration, at least floor seconds"""
+    return max(floor, math.ceil(p95 * factor))
+
+
+def testTimeouts(store, branch=None, box=None, backend=None):
+    """
+    Time limits of the tests, statistics of the branch, box and backend are preferred when there are enough of them
+    :param store: TestDurationStore
+    :return: dictionary with the default limit and the limits of the tests with enough history in seconds
+    """
+    limits = {}
+    for filters in ((branch, box, backend), (branch, None, None), (None, None, None)):
+        for name, stats in store.allStats(*filters).items():
+            if name not in limits and stats.count >= MIN_TIMEOUT_SAMPLES:
+                limits[name] = timeLimit(stats.p95)
+    return {"default": DEFAULT_TEST_TIMEOUT, "tests": limits}
+
+
+def connectMdb(dataBaseInfo):
+    import mysql.connector
+    return mysql.connector.connect(**json.loads(dataBaseInfo))
+
+
+def createStore(args):
+    if args.store:
+        store = TestDurationStore(args.store)
+    elif args.database_info:
+        store = TestDurationStore.fromDirectory(DEFAULT_STORE_DIRECTORY, args.database_info)
+    else:
+        raise ValueError("Either {} or {} should be specified".format(STORE_OPTION, DB_INFO_OPTION))
+    store.load()
+    return store
+
+
+def refresh(args):
+    store = createStore(args)
+    if not args.database_info:
+        raise ValueError("{} is required to refresh the store".format(DB_INFO_OPTION))
+    client = connectMdb(args.database_info)
+    try:
+        added = store.refresh(client)
+    finally:
+        client.close()
+    store.save()
+    print("Added {} durations, the latest test run is {}".format(added, store.lastRunId))
+
+
+def show(args):
+    store = createStore(args)
+    allStats = store.allStats(args.branch, args.box, args.backend, test=args.test)
+    if args.json:
+        json.dump({name: stats._asdict() for name, stats in sorted(allStats.items())}, sys.stdout, indent=2)
+        print()
+        return
+    print("{:<50} {:>9} {:>9} {:>9} {:>6}  {}".format("Test", "Mean", "P50", "P95", "Count", "Last seen"))
+    for name, stats in sorted(allStats.items()):
+        print("{:<50} {:>9.1f} {:>9.1f} {:>9.1f} {:>6}  {}".format(
+            name, stats.mean, stats.p50, stats.p95, stats.count, stats.lastSeen))
+
+
+def timeouts(args):
+    store = createStore(args)
+    json.dump(testTimeouts(store, args.branch, args.box, args.backend), sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+options = argparse.ArgumentParser(description="Statistics of the test durations stored in the results database")
+options.add_argument("-db", DB_INFO_OPTION, help="database information (database, host, password, user) in json format")
+options.add_argument("-s", STORE_OPTION, help="file to keep the statistics in, by default it is named after the "
+                                              "database and kept in {}".format(DEFAULT_STORE_DIRECTORY))
+commands = options.add_subparsers(dest="command")
+commands.required = True
+refreshCommand = commands.add_parser("refresh", help="read the new results from the database")
+refreshCommand.set_defaults(function=refresh)
+showCommand = commands.add_parser("show", help="print the statistics of the test durations")
+showCommand.add_argument("-t", TEST_OPTION, help="name of the test")
+showCommand.add_argument("-b", BRANCH_OPTION, help="branch the tests were run on")
+showCommand.add_argument("-x", BOX_OPTION, help="box the tests were run on")
+showCommand.add_argument("-p", BACKEND_OPTION, help="backend product the tests were run with")
+showCommand.add_argument("-j", JSON_OPTION, action="store_true", help="print the statistics in the json format")
+showCommand.set_defaults(function=show)
+timeoutsCommand = commands.add_parser("timeouts", help="print the time limits of the tests in the json format")
+timeoutsCommand.add_argument("-b", BRANCH_OPTION, help="branch the tests are run on")
+timeoutsCommand.add_argument("-x", BOX_OPTION, help="box the tests are run on")
+timeoutsCommand.add_argument("-p", BACKEND_OPTION, help="backend product the tests are run with")
+timeoutsCommand.set_defaults(function=timeouts)
+
+
+def main(args=None):
+    args = options.parse_args(args=args)
+    try:
+        args.function(args)
+    except Exception as error:
+        print(error)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
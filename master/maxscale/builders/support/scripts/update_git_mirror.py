@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Script to keep the bare mirror of the repository that the builds of the host clone with --reference
+
+import argparse
+import fcntl
+import logging
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+DEFAULT_MIRRORS_DIRECTORY = "~/.cache/maxscale-buildbot/git-mirrors"
+# Builds that start within this number of seconds after the fetch use the mirror as it is
+FETCH_INTERVAL = 60
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    arguments = parseArguments()
+    path = mirrorPath(arguments.directory, arguments.repository)
+    try:
+        updateMirror(path, arguments.repository)
+    except (OSError, subprocess.CalledProcessError):
+        logging.exception("Unable to create the mirror of %s", arguments.repository)
+        sys.exit(1)
+    # The path is the only output on the standard output, the build takes it as the reference repository
+    print(path)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Create or update the shared mirror of the git repository")
+    parser.add_argument("--repository", help="URL of the repository to mirror", required=True)
+    parser.add_argument("--directory", help="directory to keep the mirrors in", default=DEFAULT_MIRRORS_DIRECTORY)
+    return parser.parse_args()
+
+
+def mirrorPath(directory, repository):
+    """Location of the mirror of the repository, every repository URL gets its own mirror"""
+    name = re.sub(r"[^\w.-]", "_", re.sub(r"(\.git)?/*$", "", repository))
+    return os.path.join(os.path.expanduser(directory), "{}.git".format(name))
+
+
+def runGit(*arguments):
+    logging.info("Running git %s", " ".join(arguments))
+    subprocess.run(["git", *arguments], check=True, stdout=sys.stderr)
+
+
+def updateMirror(path, repository):
+    """
+    Clone the mirror if it does not exist and fetch the new commits otherwise. Builds of the host that start
+    at once wait for each other, and the ones that get the lock within FETCH_INTERVAL seconds after the fetch
+    do not fetch again, so the repository is fetched once. The clone is created next to the mirror and
+    renamed when it is complete, builds never use a partial one.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Touched after each successful clone and fetch, the mirror has no FETCH_HEAD until it is fetched once
+    fetchedMarker = "{}.fetched".format(path)
+    with open("{}.lock".format(path), "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        if os.path.isdir(path):
+            if os.path.exists(fetchedMarker) and time.time() - os.path.getmtime(fetchedMarker) < FETCH_INTERVAL:
+                logging.info("The mirror %s has been fetched recently, using it as it is", path)
+                return
+            try:
+                runGit("--git-dir", path, "fetch", "--prune", "--quiet")
+            except subprocess.CalledProcessError:
+                # The outdated mirror still provides most of the objects, the clone fetches the rest
+                logging.warning("Unable to update the mirror %s, using it as it is", path)
+                return
+        else:
+            temporaryPath = "{}.{}".format(path, os.getpid())
+            shutil.rmtree(temporaryPath, ignore_errors=True)
+            runGit("clone", "--mirror", "--quiet", repository, temporaryPath)
+            # Clones refer to the objects of the mirror, so they should never be pruned
+            runGit("--git-dir", temporaryPath, "config", "gc.pruneExpire", "never")
+            os.replace(temporaryPath, path)
+        pathlib.Path(fetchedMarker).touch()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
+import gzip
 import json
 import os
+import pathlib
 import re
 import sys
-import subprocess
 import argparse
-import mysql.connector
+
+sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
+import coredump_finder
 
 
 # Command line options
@@ -15,48 +18,232 @@ ENV_FILE_OPTION = '--env-file'
 HELP_OPTION = '--help'
 RUN_ID_OPTION = '--run-id'
 DB_INFO_OPTION = '--database-info'
+BULK_OPTION = '--bulk'
+TEST_CASES_CACHE_OPTION = '--test-cases-cache'
+CORE_DUMP_INDEX_OPTION = '--core-dump-index'
 
 # parse_ctest_log.rb keys definition
 TEST_NAME = 'test_name'
 TEST_TIME = 'test_time'
 TEST_SUCCESS = 'test_success'
 PASSED = 'Passed'
+RESULTS_FORMAT = 'format'
+COMPACT_RESULTS_FORMAT = 'compact-1'
+TEST_STATUSES = 'test_statuses'
+FAILURE_CLASSES = 'failure_classes'
+FLAKY = 'flaky'
+GZIP_MAGIC = b'\x1f\x8b'
 
 ERROR = 'Error'
 
 DB_WRITE_ERROR = 'DB_WRITE_ERROR'
 
+# Maximum number of rows referenced by a single batched query
+QUERY_BATCH_SIZE = 1000
+
+DEFAULT_TEST_CASES_CACHE_DIRECTORY = "~/.cache/maxscale-buildbot"
+
+# Weight of the latest run in the rolling flake score of the test
+FLAKE_SCORE_WEIGHT = 0.1
+
+FLAKINESS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS test_flakiness (
+        test_case_id INT NOT NULL PRIMARY KEY,
+        flake_score DOUBLE NOT NULL DEFAULT 0,
+        runs INT NOT NULL DEFAULT 0,
+        flaky_runs INT NOT NULL DEFAULT 0,
+        last_flaky_run INT NULL
+    )
+    """
+
 
 options = argparse.ArgumentParser(description="write_build_results usage:")
-options.add_argument(INPUT_FILE_OPTION, help="parse_ctest_log.rb result json file")
+options.add_argument(INPUT_FILE_OPTION, help="parse_ctest_log.rb result json file, may be compact or gzipped")
 options.add_argument("-r", RUN_ID_OPTION, help="id of main task (run id)")
 options.add_argument("-e", ENV_FILE_OPTION,
                      help="ENVIRONMENT VARIABLES FILE, WHERE POSSIBLE DB_WRITING_ERROR CAN BE REPORTED")
 options.add_argument("-db", DB_INFO_OPTION, help="database information (database, host, password, user) in json format")
+options.add_argument("-b", BULK_OPTION, action="store_true",
+                     help="WRITE ALL TEST RESULTS IN A SINGLE TRANSACTION USING BATCHED QUERIES")
+options.add_argument("-c", TEST_CASES_CACHE_OPTION, metavar="directory", default=DEFAULT_TEST_CASES_CACHE_DIRECTORY,
+                     help="DIRECTORY TO KEEP TEST CASE IDS BETWEEN RUNS, EMPTY VALUE DISABLES THE CACHE")
+options.add_argument("-i", CORE_DUMP_INDEX_OPTION, metavar="index_file",
+                     help="CORE DUMP INDEX CREATED BY coredump_finder.py, THE LOGS ARE SCANNED IF IT DOES NOT MATCH")
+
+
+def readResultsFile(fileName):
+    """Read results created by the parse_ctest_log.py, the file may be gzip-compressed"""
+    with open(fileName, "rb") as file:
+        compressed = file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    openFile = gzip.open if compressed else open
+    with openFile(fileName, "rt") as file:
+        return json.load(file)
+
+
+def expandTests(results):
+    """
+    Get the list of test dictionaries from the results in either the default or the compact format
+    :param results: results created by the parse_ctest_log.py
+    :return: list of dictionaries with test name, status and time
+    """
+    tests = results.get("tests")
+    if not tests:
+        return []
+    if results.get(RESULTS_FORMAT) != COMPACT_RESULTS_FORMAT:
+        return [{TEST_NAME: test[TEST_NAME], TEST_SUCCESS: test[TEST_SUCCESS], TEST_TIME: test[TEST_TIME]}
+                for test in tests]
+    statuses = tests[TEST_STATUSES]
+    return [{TEST_NAME: name, TEST_SUCCESS: statuses[status], TEST_TIME: time}
+            for name, status, time in zip(tests[TEST_NAME], tests[TEST_SUCCESS], tests[TEST_TIME])]
+
+
+def flakyTestCases(tests, testCaseIds, failureClasses):
+    """Ids of the test cases of the run mapped to True if the test has been classified as flaky"""
+    flakyTests = {}
+    for test in tests:
+        testCaseId = testCaseIds[test[TEST_NAME]]
+        flakyTests[testCaseId] = flakyTests.get(testCaseId, False) or failureClasses.get(test[TEST_NAME]) == FLAKY
+    return flakyTests
+
+
+class TestCaseCache:
+    """
+    Mapping of test case names to ids of the test_cases table that is kept between runs.
+    The cache is checked against the table before use, so only new test cases are looked up in the database.
+    """
+
+    def __init__(self, fileName=None):
+        self.fileName = fileName
+        self.testCases = {}
+        self.maxId = 0
+        self.count = 0
+
+    @staticmethod
+    def fromDirectory(directory, dataBaseInfo):
+        """Create the cache stored in the directory for the database described by dataBaseInfo"""
+        if not directory:
+            return TestCaseCache()
+        info = json.loads(dataBaseInfo)
+        name = re.sub(r"[^\w.-]", "_", "test_cases_{}_{}.json".format(info.get("host"), info.get("database")))
+        return TestCaseCache(os.path.join(os.path.expanduser(directory), name))
+
+    def load(self):
+        if not self.fileName:
+            return
+        try:
+            with open(self.fileName, "r") as file:
+                content = json.load(file)
+            self.testCases = content["test_cases"]
+            self.maxId = content["max_id"]
+            self.count = content["count"]
+        except (OSError, ValueError, KeyError):
+            self.testCases, self.maxId, self.count = {}, 0, 0
+
+    def save(self):
+        if not self.fileName:
+            return
+        temporaryFileName = "{}.{}".format(self.fileName, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+            with open(temporaryFileName, "w") as file:
+                json.dump({"max_id": self.maxId, "count": self.count, "test_cases": self.testCases}, file)
+            os.replace(temporaryFileName, self.fileName)
+        except OSError as error:
+            print("Unable to save test cases cache: {}".format(error))
+
+    def synchronize(self, client):
+        """
+        Bring the cache up to date with the test_cases table. Test cases added since the last run are loaded,
+        the whole table is reloaded only if rows were removed from it.
+        """
+        cursor = client.cursor(dictionary=True)
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id, COUNT(*) AS count FROM test_cases")
+        state = cursor.fetchone()
+        maxId, count = int(state["max_id"]), int(state["count"])
+        if (maxId, count) != (self.maxId, self.count):
+            rows = []
+            if maxId >= self.maxId:
+                cursor.execute("SELECT id, name FROM test_cases WHERE id > %s ORDER BY id", (self.maxId,))
+                rows = cursor.fetchall()
+            if maxId < self.maxId or self.count + len(rows) != count:
+                self.testCases = {}
+                cursor.execute("SELECT id, name FROM test_cases ORDER BY id")
+                rows = cursor.fetchall()
+            for row in rows:
+                self.testCases.setdefault(row["name"], row["id"])
+            self.maxId, self.count = maxId, count
+        cursor.close()
+
+    def get(self, name):
+        return self.testCases.get(name)
+
+    def add(self, name, testCaseId):
+        """Remember the committed test case, counters are updated on the next synchronization"""
+        self.testCases[name] = testCaseId
+
+
+def createFlakinessTable(client):
+    """
+    Create the table of the flake scores if it does not exist. The statement commits the transaction, so it is run
+    before the results are written. Results are written without the flake scores if the table can not be created,
+    e.g. when the user has no CREATE privilege.
+    :param client: connection to the database
+    :return: True if the flake scores can be written
+    """
+    cursor = client.cursor()
+    try:
+        cursor.execute(FLAKINESS_TABLE_QUERY)
+    except Exception as error:
+        print("Unable to create the test_flakiness table, flake scores are not written: {}".format(error))
+        return False
+    finally:
+        cursor.close()
+    return True
 
 
 class BuildResultsWriter:
 
-    def __init__(self, runId):
+    def __init__(self, runId, bulk=False, testCasesCacheDirectory=None, coreDumpIndexFile=None):
         self.client = None
         self.parsedContent = None
         self.runId = runId
+        self.bulk = bulk
+        self.testCasesCacheDirectory = testCasesCacheDirectory
+        self.testCaseCache = TestCaseCache()
+        self.coreDumpIndexFile = coreDumpIndexFile
+        self.coreDumpIndex = None
+        self.deferCommit = False
+        self.flakinessEnabled = True
 
     def writeResultsFromInputFile(self, inputFilePath, dataBaseInfo):
         self.parseInputFile(inputFilePath)
         self.connectMdb(dataBaseInfo)
+        self.testCaseCache = TestCaseCache.fromDirectory(self.testCasesCacheDirectory, dataBaseInfo)
+        self.testCaseCache.load()
+        self.testCaseCache.synchronize(self.client)
+        self.flakinessEnabled = createFlakinessTable(self.client)
         self.writeBuildResultsToDb(self.parsedContent)
+        self.testCaseCache.save()
         self.client.close()
 
     def parseInputFile(self, inputFilePath):
-        with open(inputFilePath, "r") as file:
-            self.parsedContent = json.load(file)
+        self.parsedContent = readResultsFile(inputFilePath)
 
     def connectMdb(self, content):
+        # Imported here, the master reuses the writer through its own connection pool without mysql.connector
+        import mysql.connector
         self.client = mysql.connector.connect(**json.loads(content))
         print("Successfully connected to database")
 
+    def commit(self):
+        """Commit the transaction unless the caller writes results of several runs within a single one"""
+        if not self.deferCommit:
+            self.client.commit()
+
     def findTestCase(self, name):
+        cachedId = self.testCaseCache.get(name)
+        if cachedId is not None:
+            return cachedId
         cursor = self.client.cursor(dictionary=True)
         query = """
                 SELECT id FROM test_cases
@@ -68,6 +255,7 @@ class BuildResultsWriter:
         if test_case is None:
             return None
         else:
+            self.testCaseCache.add(name, test_case["id"])
             return test_case["id"]
 
     def writeTestCasesTable(self, name):
@@ -79,11 +267,81 @@ class BuildResultsWriter:
         values = (name,)
         cursor.execute(query, values)
         id = cursor.lastrowid
-        self.client.commit()
+        self.commit()
         cursor.close()
+        self.testCaseCache.add(name, id)
         print("Performed insert (test_case, id = {}: {}".format(id, query % values))
         return id
 
+    def findTestCases(self, names):
+        """
+        Find test cases with the given names using batched queries
+        :param names: list of test case names
+        :return: dictionary with test case name mapped to its id
+        """
+        testCases = {}
+        cursor = self.client.cursor(dictionary=True)
+        for start in range(0, len(names), QUERY_BATCH_SIZE):
+            batch = names[start:start + QUERY_BATCH_SIZE]
+            query = "SELECT id, name FROM test_cases WHERE name IN ({})".format(", ".join(["%s"] * len(batch)))
+            cursor.execute(query, batch)
+            for testCase in cursor.fetchall():
+                testCases[testCase["name"]] = testCase["id"]
+        cursor.close()
+        return testCases
+
+    def writeTestCasesInBulk(self, names):
+        """
+        Find ids of the test cases and insert the missing ones without committing the transaction
+        :param names: list of test case names
+        :return: dictionary with test case name mapped to its id
+        """
+        uniqueNames = list(dict.fromkeys(names))
+        testCases = {}
+        for name in uniqueNames:
+            cachedId = self.testCaseCache.get(name)
+            if cachedId is not None:
+                testCases[name] = cachedId
+        uncachedNames = [name for name in uniqueNames if name not in testCases]
+        if uncachedNames:
+            for name, testCaseId in self.findTestCases(uncachedNames).items():
+                self.testCaseCache.add(name, testCaseId)
+                testCases[name] = testCaseId
+        missingNames = [name for name in uniqueNames if name not in testCases]
+        if not missingNames:
+            return testCases
+        cursor = self.client.cursor()
+        for start in range(0, len(missingNames), QUERY_BATCH_SIZE):
+            batch = missingNames[start:start + QUERY_BATCH_SIZE]
+            query = "INSERT INTO test_cases (name) VALUES {}".format(", ".join(["(%s)"] * len(batch)))
+            cursor.execute(query, batch)
+        cursor.close()
+        print("Performed insert (test_cases): {}".format(", ".join(missingNames)))
+        testCases.update(self.findTestCases(missingNames))
+        return testCases
+
+    def writeFlakinessTable(self, testRunId, flakyTests):
+        """
+        Update the rolling flake scores of the tests without committing the transaction. The score is the moving
+        average of the runs where the test has failed and passed when it was run again.
+        :param testRunId: id of the test run
+        :param flakyTests: dictionary with ids of the test cases that have run mapped to True if they were flaky
+        """
+        # Rows are written in the order of the primary key, so concurrent writers lock them in the same order
+        rows = [(testCaseId, FLAKE_SCORE_WEIGHT * flaky, int(flaky), testRunId if flaky else None)
+                for testCaseId, flaky in sorted(flakyTests.items())]
+        query = ("INSERT INTO test_flakiness (test_case_id, flake_score, runs, flaky_runs, last_flaky_run) "
+                 "VALUES (%s, %s, 1, %s, %s) "
+                 "ON DUPLICATE KEY UPDATE flake_score = flake_score * {} + VALUES(flake_score), "
+                 "runs = runs + VALUES(runs), flaky_runs = flaky_runs + VALUES(flaky_runs), "
+                 "last_flaky_run = COALESCE(VALUES(last_flaky_run), last_flaky_run)").format(1 - FLAKE_SCORE_WEIGHT)
+        cursor = self.client.cursor()
+        for start in range(0, len(rows), QUERY_BATCH_SIZE):
+            cursor.executemany(query, rows[start:start + QUERY_BATCH_SIZE])
+        cursor.close()
+        print("Performed update (test_flakiness): {} tests, {} flaky".format(
+            len(flakyTests), sum(flakyTests.values())))
+
     def findTargetBuild(self, runId):
         cursor = self.client.cursor(dictionary=True)
         query = """
@@ -114,7 +372,7 @@ class BuildResultsWriter:
                   cmakeFlags, maxscaleSource)
         cursor.execute(query, values)
         id = cursor.lastrowid
-        self.client.commit()
+        self.commit()
         cursor.close()
         print("Performed insert (target_build, id = {}: {}".format(id, query % values))
         return id
@@ -131,7 +389,7 @@ class BuildResultsWriter:
         """
         cursor = self.client.cursor()
         cursor.execute(query, {"id": targetBuildId})
-        self.client.commit()
+        self.commit()
         cursor.close()
 
     def writeTestRunTable(self, targetBuildId, jenkinsId, startTime, targat, box, product, mariadbVersion,
@@ -148,7 +406,7 @@ class BuildResultsWriter:
                   cmakeFlags, maxscaleSource, logsDir, targetBuildId)
         cursor.execute(query, values)
         id = cursor.lastrowid
-        self.client.commit()
+        self.commit()
         cursor.close()
         print("Performed insert (test_run, id = {}: {}".format(id, query % values))
         return id
@@ -160,30 +418,62 @@ class BuildResultsWriter:
                  "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
         values = (id, test, result, testTime, coreDumpPath, leakSummary, targetBuildId, testCaseId)
         cursor.execute(query, values)
-        self.client.commit()
+        self.commit()
         cursor.close()
         print("Performed insert (results): {}".format(query % values))
 
+    def writeResultsTableInBulk(self, rows):
+        """Insert rows into the results table without committing the transaction"""
+        cursor = self.client.cursor()
+        query = ("INSERT INTO results (id, test, result, test_time, core_dump_path, "
+                 "leak_summary, target_build_id, test_case_id) "
+                 "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+        for start in range(0, len(rows), QUERY_BATCH_SIZE):
+            cursor.executemany(query, rows[start:start + QUERY_BATCH_SIZE])
+        cursor.close()
+        print("Performed insert (results): {} rows".format(len(rows)))
+
+    def writeTestsInBulk(self, testRunId, tests, testsLeakSummary, logsDir, targetBuildId, failureClasses=None):
+        """Write test cases and results of all tests within a single transaction"""
+        try:
+            testCaseIds = self.writeTestCasesInBulk([test[TEST_NAME] for test in tests])
+            rows = []
+            for test in tests:
+                name = test[TEST_NAME]
+                if (name in testsLeakSummary) and (testsLeakSummary[name]):
+                    leakSummary = ";\n".join(testsLeakSummary[name])
+                else:
+                    leakSummary = None
+                rows.append((testRunId, name, int(test[TEST_SUCCESS] != PASSED), test[TEST_TIME],
+                             self.findCoreDumpPath(logsDir, name), leakSummary, targetBuildId, testCaseIds[name]))
+            self.writeResultsTableInBulk(rows)
+            if failureClasses is not None:
+                self.writeFlakinessTable(testRunId, flakyTestCases(tests, testCaseIds, failureClasses))
+            self.commit()
+            for name, testCaseId in testCaseIds.items():
+                self.testCaseCache.add(name, testCaseId)
+        except Exception:
+            if not self.deferCommit:
+                self.client.rollback()
+            raise
+
+    def loadCoreDumpIndex(self, runTestDir):
+        """Read the core dump index of the test run or scan the logs directory once to create it"""
+        testsLogsDir = "{}/LOGS/{}/LOGS".format(os.environ['HOME'], runTestDir)
+        index = None
+        if self.coreDumpIndexFile:
+            index = coredump_finder.readCoreDumpIndex(testsLogsDir, self.coreDumpIndexFile)
+        if index is None:
+            index = coredump_finder.buildCoreDumpIndex(testsLogsDir) if os.path.isdir(testsLogsDir) else {}
+        return index
+
     def findCoreDumpPath(self, runTestDir, testName):
-        coreDumpPathRegex = re.compile(br".*\/run_test[^\/.+]+(\/.+)")
-        dir = "{}/LOGS/{}/LOGS/{}".format(os.environ['HOME'], runTestDir, testName)
-        if not os.path.isdir(dir):
-            return ""
-        result = subprocess.check_output(["find {} | grep core | sed -e 's|/[^/]*$|/*|g'".format(dir)],
-                                         shell=True)
-        if not result or not coreDumpPathRegex.match(result):
-            return ""
-        return coreDumpPathRegex.match(result).group(0)
+        if self.coreDumpIndex is None:
+            self.coreDumpIndex = self.loadCoreDumpIndex(runTestDir)
+        return self.coreDumpIndex.get(testName, "")
 
     def writeBuildResultsToDb(self, results):
-        tests = []
-        if results.get("tests"):
-            for test in results["tests"]:
-                tests.append({
-                    TEST_NAME: test[TEST_NAME],
-                    TEST_SUCCESS: test[TEST_SUCCESS],
-                    TEST_TIME: test[TEST_TIME]
-                })
+        tests = expandTests(results)
         testsLeakSummary = results["leak_summary"]
 
         targetBuildId = self.writeTargetBuildsTable(self.runId, None, *(results[key] for key in (
@@ -198,7 +488,12 @@ class BuildResultsWriter:
         )))
         self.writeTargetBuildStartTime(targetBuildId)
 
-        if not results.get(ERROR):
+        # Results of the parser that does not classify the failures are left out of the flake scores
+        failureClasses = results.get(FAILURE_CLASSES) if self.flakinessEnabled else None
+        if not results.get(ERROR) and self.bulk:
+            self.writeTestsInBulk(id, tests, testsLeakSummary, results["logs_dir"], targetBuildId, failureClasses)
+        elif not results.get(ERROR):
+            testCaseIds = {}
             for test in tests:
                 print("Preparing to write test={} into results".format(test))
                 name = test[TEST_NAME]
@@ -210,13 +505,17 @@ class BuildResultsWriter:
                 else:
                     leakSummary = None
                 testCaseId = self.writeTestCasesTable(name)
+                testCaseIds[name] = testCaseId
                 self.writeResultsTable(id, name, result, testTime, coreDumpPath, leakSummary, targetBuildId, testCaseId)
+            if failureClasses is not None:
+                self.writeFlakinessTable(id, flakyTestCases(tests, testCaseIds, failureClasses))
+                self.commit()
 
 
 def main(args=None):
     args = options.parse_args(args=args)
     try:
-        writer = BuildResultsWriter(args.run_id)
+        writer = BuildResultsWriter(args.run_id, args.bulk, args.test_cases_cache, args.core_dump_index)
         writer.writeResultsFromInputFile(args.file, args.database_info)
     except Exception as e:
         print(e)
@@ -226,7 +525,7 @@ def main(args=None):
         sys.exit(1)
 
 
-if os.path.samefile(__file__, sys.argv[0]):
+if __name__ == "__main__":
     print("Starting ./write_build_results.py")
     main()
     print("./write_build_results.py finished")
@@ -1,26 +1,61 @@
+import functools
 import re
 from buildbot.changes.gitpoller import GitPoller
 from maxscale.config import constants
 from maxscale.config.branches_list_file import MAXSCALE_BRANCHES_LIST
 from maxscale.config.branches_list_file import MAXSCALE_PERF_BRANCHES_LIST
 
+# Number of branch names whose matching rules are remembered
+BRANCH_RULES_CACHE_SIZE = 4096
+
+
+class BranchRules:
+    """
+    Branch rules compiled into a single regular expression. Each rule pattern is an alternative wrapped into
+    a lookahead, so the first rule of the list that matches anywhere in the name is found in a single pass,
+    the same rule the search through the list finds. Results are cached per branch name.
+    """
+
+    def __init__(self, rules, cacheSize=BRANCH_RULES_CACHE_SIZE):
+        self.rules = rules
+        try:
+            self.regex = re.compile("|".join("(?=.*?(?:{}))(?P<rule{}>)".format(rule["branch"], index)
+                                             for index, rule in enumerate(rules)), re.DOTALL)
+        except re.error:
+            # Patterns that can not be combined, e.g. ones that reuse group names, are searched one by one
+            self.regex = None
+            self.ruleRegexes = [re.compile(rule["branch"]) for rule in rules]
+        self.find = functools.lru_cache(maxsize=cacheSize)(self.findRule)
+
+    def findRule(self, branch):
+        """
+        Find the first rule that matches the branch
+        :param branch: name of the branch
+        :return: dictionary of the rule with all its attributes or None if no rule matches
+        """
+        if self.regex is None:
+            return next((rule for rule, regex in zip(self.rules, self.ruleRegexes) if regex.search(branch)), None)
+        match = self.regex.match(branch)
+        if match is None:
+            return None
+        return self.rules[int(match.lastgroup[len("rule"):])]
+
+
+MAXSCALE_BRANCH_RULES = BranchRules(MAXSCALE_BRANCHES_LIST)
+MAXSCALE_PERF_BRANCH_RULES = BranchRules(MAXSCALE_PERF_BRANCHES_LIST)
+
+
 def check_branch_fn(branch):
     """
     Checks if branch is in the list of MaxScale branches
     :param branch: Name of the MaxScale branch
     :return: True if branch is found
     """
-    for branch_item in MAXSCALE_BRANCHES_LIST:
-        if re.search(branch_item["branch"], branch.split('/')[-1]):
-            return True
-    return False
+    return MAXSCALE_BRANCH_RULES.find(branch.split('/')[-1]) is not None
 
 
 def check_branch_fn_perf(branch):
-    for branch_item in MAXSCALE_PERF_BRANCHES_LIST:
-        if re.search(branch_item["branch"], branch.split('/')[-1]):
-            return True
-    return False
+    return MAXSCALE_PERF_BRANCH_RULES.find(branch.split('/')[-1]) is not None
 
 
 def get_test_set_by_branch(branch):
@@ -29,10 +64,10 @@ def get_test_set_by_branch(branch):
     :param branch: Name of the MaxScale branch
     :return: Test set name
     """
-    for branch_item in MAXSCALE_BRANCHES_LIST:
-        if re.search(branch_item["branch"], branch):
-            return branch_item["test_set"]
-    return None
+    rule = MAXSCALE_BRANCH_RULES.find(branch)
+    if rule is None:
+        return None
+    return rule["test_set"]
 
 
 POLLERS = [
@@ -88,6 +88,8 @@ DEFAULT_RELEASE_CMAKE_FLAGS = ('-DBUILD_TESTS=N -DBUILD_MMMON=Y '
                                '-DBUILD_CDC=Y -DBUILD_GUI=N')
 
 MAXSCALE_REPOSITORY = 'https://github.com/mariadb-corporation/MaxScale.git'
+# Number of commits the builds clone from the repository, the whole history is cloned if it is not set
+GIT_CLONE_DEPTH = None
 MAXSCALE_PRODUCT = 'MaxScale'
 MDBCI_REPOSITORY = 'https://github.com/mariadb-corporation/mdbci.git'
 
@@ -163,3 +165,51 @@ UPLOAD_SERVERS = {
 }
 
 UPLOAD_PATH = "/srv/repository/Maxscale"
+# Directories named by the artifact key of the build with hard-linked copies of the packages uploaded for it
+ARTIFACTS_PATH = UPLOAD_PATH + "/.artifacts"
+
+RESULTS_INGESTION_SERVICE = "results_ingestion"
+HOST_LOAD_SERVICE = "host_load"
+
+# Resources of the worker hosts used to place builds, memory is in megabytes. Hosts that are not listed are
+# limited only by the number of their workers. The capacity limit is off until the hosts are listed here: with
+# the empty table builds go to the host with the least running builds per worker and never wait for capacity.
+HOST_CAPACITY = {
+    # "max-tst-01": {"vms": 16, "cpus": 32, "memory": 131072},
+}
+
+# Resources a single build of the builder uses on the worker host
+ORCHESTRATION_FOOTPRINT = {"vms": 0, "cpus": 0, "memory": 0}
+BUILDER_FOOTPRINTS = {
+    "build": {"vms": 1, "cpus": 4, "memory": 8192},
+    "build_docker_image": {"vms": 0, "cpus": 2, "memory": 4096},
+    "build_mdbci": {"vms": 0, "cpus": 1, "memory": 2048},
+    "run_test": {"vms": 10, "cpus": 10, "memory": 20480},
+    "run_performance_test": {"vms": 5, "cpus": 8, "memory": 16384},
+    "create_full_repo": {"vms": 0, "cpus": 1, "memory": 1024},
+    "generate_and_sync_repod": {"vms": 0, "cpus": 1, "memory": 1024},
+    "publish_release": {"vms": 0, "cpus": 1, "memory": 1024},
+    "destroy": ORCHESTRATION_FOOTPRINT,
+    "build_all": ORCHESTRATION_FOOTPRINT,
+    "build_and_test": ORCHESTRATION_FOOTPRINT,
+    "build_and_performance_test": ORCHESTRATION_FOOTPRINT,
+    "build_for_release": ORCHESTRATION_FOOTPRINT,
+    "build_and_test_parall": ORCHESTRATION_FOOTPRINT,
+    "create_full_repo_all": ORCHESTRATION_FOOTPRINT,
+}
+
+# Changed files of MaxScale mapped to the ctest labels and tests they affect, the first rule matching the path is
+# used. Label and test templates may refer to the groups of the path expression, labels are matched by ctest as
+# regular expressions. A rule without labels and tests affects no tests, a "full" rule and the files that match
+# no rule run all tests.
+TEST_IMPACT_RULES = [
+    {"path": r"^(Documentation|docs?)/|\.md$|^\.github/|^(LICENSE|COPYRIGHT|README)"},
+    {"path": r"^server/modules/(protocol|authenticator)/", "full": True},
+    {"path": r"^server/modules/(filter|routing|monitor)/(\w+)/", "labels": [r"\2"]},
+    {"path": r"^maxctrl/", "labels": ["maxctrl"]},
+    {"path": r"^(maxscale-)?system-test/(\w+)\.(cpp|cc|c|sh|py)$", "tests": [r"\2"]},
+]
+# The push build of the branch runs all tests after this number of builds with the selected tests or this time
+# in seconds since the previous full run
+IMPACT_FULL_RUN_INTERVAL = 10
+IMPACT_FULL_RUN_MAX_AGE = 24 * 60 * 60
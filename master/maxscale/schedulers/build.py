@@ -13,6 +13,7 @@ BUILD_PROPERTIES = [
     properties.old_target(),
     properties.run_upgrade_test(),
     properties.try_already_running(),
+    properties.use_build_cache(),
 ]
 
 TRIGGERABLE_SCHEDULER = schedulers.Triggerable(
@@ -51,6 +51,7 @@ for branch_item in NIGHTLY_BRANCHES_LIST:
     nightlyProperties['owners'] = constants.NIGHTLY_MAIL_LIST
     nightlyProperties['buildHosts'] = ["bb-host"]
     nightlyProperties['test_set'] = branch_item["test_set"]
+    nightlyProperties['test_sharding'] = "duration"
     nightlyProperties['cmake_flags'] = constants.DEFAULT_DAILY_TEST_CMAKE_FLAGS
     nightlyProperties["targetInitMode"] = TargetInitOptions.GENERATE
 
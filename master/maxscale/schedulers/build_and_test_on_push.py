@@ -21,6 +21,7 @@ DEFAULT_PROPERTIES['cmake_flags'] = constants.DEFAULT_DAILY_TEST_CMAKE_FLAGS
 DEFAULT_PROPERTIES["targetInitMode"] = TargetInitOptions.GENERATE
 DEFAULT_PROPERTIES["nameInitMode"] = NameInitOptions.GENERATE
 DEFAULT_PROPERTIES["buildHosts"] = ["bb-host"]
+DEFAULT_PROPERTIES["test_selection"] = "impact"
 
 CHANGE_SOURCE_SCHEDULER = schedulers.SingleBranchScheduler(
     name="build_and_test_on_push",
@@ -12,6 +12,9 @@ BUILD_AND_TEST_PROPERTIES = [
     properties.cmake_flags(),
     properties.keep_virtual_machines(),
     properties.test_set(),
+    properties.test_sharding(),
+    properties.test_shards(),
+    properties.test_selection(),
     properties.ci_url(),
     properties.smoke_tests(),
     properties.big_number_of_vms(),
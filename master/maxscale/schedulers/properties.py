@@ -74,6 +74,14 @@ def try_already_running():
         default="no")
 
 
+def use_build_cache():
+    return util.ChoiceStringParameter(
+        name="use_build_cache",
+        label="Reuse packages of the same commit, box and flags",
+        choices=["yes", "no"],
+        default="yes")
+
+
 def run_upgrade_test():
     return util.ChoiceStringParameter(
         name="run_upgrade_test",
@@ -122,6 +130,29 @@ def test_set():
         default="-LE HEAVY")
 
 
+def test_sharding():
+    return util.ChoiceStringParameter(
+        name="test_sharding",
+        label="Split tests into sets by",
+        choices=["static", "duration"],
+        default="static")
+
+
+def test_shards():
+    return util.IntParameter(
+        name="test_shards",
+        label="Number of test sets for the duration-based split",
+        default=5)
+
+
+def test_selection():
+    return util.ChoiceStringParameter(
+        name="test_selection",
+        label="Tests to run",
+        choices=["full", "impact"],
+        default="full")
+
+
 def backend_use_ssl():
     return util.ChoiceStringParameter(
         name="backend_ssl",
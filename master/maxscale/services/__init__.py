@@ -7,6 +7,8 @@ from . import build_and_test
 from . import build_and_test_parall
 from . import build_and_test_shapshot
 from . import build_for_release
+from . import results_ingestion
+from . import host_load
 
 MAXSCALE_SERVICES = list(itertools.chain(
     build.SERVICES,
@@ -17,4 +19,6 @@ MAXSCALE_SERVICES = list(itertools.chain(
     build_and_test_parall.SERVICES,
     build_and_test_shapshot.SERVICES,
     build_for_release.SERVICES,
+    results_ingestion.SERVICES,
+    host_load.SERVICES,
 ))
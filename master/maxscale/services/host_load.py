@@ -0,0 +1,152 @@
+from buildbot.data import resultspec
+from buildbot.util import service
+from twisted.internet import defer, task, utils
+from twisted.python import log
+from maxscale import workers
+from maxscale.config import constants
+
+# Command that reports the load average and the memory of the host, see proc(5)
+LIVE_LOAD_COMMAND = "cat /proc/loadavg /proc/meminfo"
+
+
+def parseLiveUsage(output):
+    """
+    Get the used resources from the output of the LIVE_LOAD_COMMAND
+    :param output: output of the command
+    :return: dictionary with the number of busy cpus and used memory in megabytes
+    """
+    lines = output.splitlines()
+    memory = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        memory[name] = int(value.split()[0]) // 1024
+    return {
+        "cpus": float(lines[0].split()[0]),
+        "memory": memory["MemTotal"] - memory.get("MemAvailable", memory.get("MemFree", 0)),
+    }
+
+
+class HostLoadService(service.BuildbotService):
+    """
+    Keeps the HostLoadTracker up to date with the builds the master starts and finishes,
+    so the worker assignment does not have to count running builds on every request.
+    The load of the hosts that can be reached over SSH is polled to catch work that is not started by this master.
+    """
+    name = constants.HOST_LOAD_SERVICE
+    tracker = None
+    consumers = None
+    pollCall = None
+
+    def checkConfig(self, registry=None, capacities=None, footprints=None, pollInterval=60):
+        if pollInterval < 0:
+            raise ValueError("pollInterval should not be negative")
+
+    @defer.inlineCallbacks
+    def reconfigService(self, registry=None, capacities=None, footprints=None, pollInterval=60):
+        self.tracker = workers.HostLoadTracker(registry or workers.REGISTRY, capacities, footprints)
+        if not capacities:
+            log.msg("Host capacities are not configured, builds are placed by the number of running builds only")
+        self.workerNames = {}
+        self.builderNames = {}
+        self.startingBuilds = set()
+        self.finishedBuilds = set()
+        self.pollInterval = pollInterval
+        if self.running:
+            yield self.loadRunningBuilds()
+            self.startPolling()
+
+    @defer.inlineCallbacks
+    def startService(self):
+        yield super().startService()
+        self.consumers = [
+            (yield self.master.mq.startConsuming(self.buildStarted, ("builds", None, "new"))),
+            (yield self.master.mq.startConsuming(self.buildFinished, ("builds", None, "finished"))),
+        ]
+        yield self.loadRunningBuilds()
+        self.startPolling()
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        self.stopPolling()
+        for consumer in self.consumers or []:
+            yield consumer.stopConsuming()
+        self.consumers = None
+        yield super().stopService()
+
+    def startPolling(self):
+        self.stopPolling()
+        if self.pollInterval:
+            self.pollCall = task.LoopingCall(self.pollLiveUsage)
+            self.pollCall.start(self.pollInterval, now=True).addErrback(log.err, "Host load polling has failed")
+
+    def stopPolling(self):
+        if self.pollCall is not None and self.pollCall.running:
+            self.pollCall.stop()
+        self.pollCall = None
+
+    @defer.inlineCallbacks
+    def pollLiveUsage(self):
+        hosts = [host for host in self.tracker.registry.hostToWorkers if host in constants.HOST_FULL]
+        yield defer.DeferredList([self.pollHost(host) for host in hosts], consumeErrors=True)
+        # Requests that were left in the queue for the lack of capacity may fit now
+        self.master.botmaster.maybeStartBuildsForAllBuilders()
+
+    @defer.inlineCallbacks
+    def pollHost(self, host):
+        address = "{}@{}".format(constants.HOST_USERS[host], constants.HOST_FULL[host]) \
+            if host in constants.HOST_USERS else constants.HOST_FULL[host]
+        output, error, code = yield utils.getProcessOutputAndValue(
+            "ssh", ["-o", "BatchMode=yes", "-o", "ConnectTimeout=10", address, LIVE_LOAD_COMMAND])
+        try:
+            if code != 0:
+                raise Exception(error.decode(errors="replace").strip())
+            self.tracker.updateLiveUsage(host, parseLiveUsage(output.decode()))
+        except Exception as error:
+            log.msg("Unable to get the load of host {}: {}".format(host, error))
+            self.tracker.updateLiveUsage(host, None)
+
+    @defer.inlineCallbacks
+    def getName(self, names, endpoint, identifier):
+        if identifier not in names:
+            entity = yield self.master.data.get((endpoint, identifier))
+            names[identifier] = entity["name"] if entity else None
+        return names[identifier]
+
+    @defer.inlineCallbacks
+    def buildStarted(self, _key, build):
+        buildId = build["buildid"]
+        self.startingBuilds.add(buildId)
+        try:
+            workerName = yield self.getName(self.workerNames, "workers", build["workerid"])
+            builderName = yield self.getName(self.builderNames, "builders", build["builderid"])
+        finally:
+            self.startingBuilds.discard(buildId)
+        if buildId in self.finishedBuilds:  # The build has finished while the names were looked up
+            self.finishedBuilds.discard(buildId)
+            return
+        self.tracker.buildStarted(buildId, workerName, builderName)
+
+    def buildFinished(self, _key, build):
+        if build["buildid"] in self.startingBuilds:
+            self.finishedBuilds.add(build["buildid"])
+        self.tracker.buildFinished(build["buildid"])
+
+    @defer.inlineCallbacks
+    def loadRunningBuilds(self):
+        """Count the builds that are already running, e.g. after the configuration has been reloaded"""
+        allWorkers = yield self.master.data.get(("workers",))
+        self.workerNames = {worker["workerid"]: worker["name"] for worker in allWorkers}
+        allBuilders = yield self.master.data.get(("builders",))
+        self.builderNames = {builder["builderid"]: builder["name"] for builder in allBuilders}
+        builds = yield self.master.data.get(("builds",), filters=[resultspec.Filter("complete", "eq", [False])])
+        self.tracker.reset()
+        for build in builds:
+            self.tracker.buildStarted(build["buildid"], self.workerNames.get(build["workerid"]),
+                                      self.builderNames.get(build["builderid"]))
+
+
+SERVICES = [HostLoadService(
+    registry=workers.REGISTRY,
+    capacities=constants.HOST_CAPACITY,
+    footprints=constants.BUILDER_FOOTPRINTS,
+)]
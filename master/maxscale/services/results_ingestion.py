@@ -0,0 +1,235 @@
+import json
+import os
+import sys
+from buildbot.util import service
+from MySQLdb.cursors import DictCursor
+from twisted.enterprise import adbapi
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+from maxscale.builders.support.scripts import test_durations
+from maxscale.config import constants
+
+# The writer imports the other worker scripts by their names
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "builders", "support", "scripts"))
+import write_build_results
+
+
+DATABASE_INFO_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "secrets", "dataBaseInfo.json")
+
+
+class PooledConnection:
+    """
+    Provides the mysql.connector interface used by the BuildResultsWriter on top of the pooled connection.
+    The transaction is committed or rolled back by the pool, the writer is configured to defer commits.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self, dictionary=False):
+        # All cursors of the pool return dictionaries, the writer only fetches rows from the dictionary ones
+        return self.connection.cursor()
+
+
+class ResultsIngestionService(service.BuildbotService):
+    """
+    Writes test results uploaded by the workers to the results database.
+    Results are queued and written in batches through the connection pool, so builds do not wait for the database.
+    Results queued within the batch delay, e.g. shards of the parallel test run, are written in a single transaction.
+    Builds that pass the tracking key when they queue the results get the outcome of the write with writeOutcome().
+    The statistics of the test durations are refreshed after each write and are available as testDurations.
+    """
+    name = constants.RESULTS_INGESTION_SERVICE
+    lock = None
+    queue = None
+    pool = None
+    flushCall = None
+    testCaseCache = None
+    testDurations = None
+    pendingWrites = None
+    flakinessEnabled = None
+
+    def checkConfig(self, dataBaseInfoFile=DATABASE_INFO_FILE, batchDelay=5, maxBatchSize=20, poolSize=2):
+        if batchDelay < 0:
+            raise ValueError("batchDelay should not be negative")
+        if maxBatchSize < 1 or poolSize < 1:
+            raise ValueError("maxBatchSize and poolSize should be positive")
+
+    @defer.inlineCallbacks
+    def reconfigService(self, dataBaseInfoFile=DATABASE_INFO_FILE, batchDelay=5, maxBatchSize=20, poolSize=2):
+        if self.lock is None:
+            self.lock = defer.DeferredLock()
+            self.queue = []
+            self.pendingWrites = {}
+            self.testCaseCache = write_build_results.TestCaseCache()
+        yield self.flush()
+        yield self.lock.run(self.closePool)
+        self.dataBaseInfoFile = dataBaseInfoFile
+        self.batchDelay = batchDelay
+        self.maxBatchSize = maxBatchSize
+        self.poolSize = poolSize
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield self.flush()
+        yield self.lock.run(self.closePool)
+        yield super().stopService()
+
+    def enqueue(self, runId, results, coreDumpIndex=None, trackingKey=None):
+        """
+        Queue results of the test run for writing to the database
+        :param runId: identifier of the test run
+        :param results: results created by the parse_ctest_log.py
+        :param coreDumpIndex: dictionary with test names mapped to the core dump paths
+        :param trackingKey: key to get the outcome of the write with, e.g. id of the build
+        """
+        written = defer.Deferred()
+        if trackingKey is not None:
+            self.pendingWrites[trackingKey] = written
+        self.queue.append((runId, results, coreDumpIndex or {}, written))
+        if len(self.queue) >= self.maxBatchSize:
+            self.flush()
+        elif self.flushCall is None:
+            self.flushCall = reactor.callLater(self.batchDelay, self.flush)
+
+    def writeOutcome(self, trackingKey):
+        """
+        Get the outcome of the write of the results queued with the tracking key
+        :return: deferred that fires with True when the results are written and with False when they are dropped,
+                 None if no results have been queued with the key
+        """
+        return self.pendingWrites.pop(trackingKey, None)
+
+    def flush(self):
+        """Write all queued results, the returned deferred fires when the previously started writes are done"""
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+        self.flushCall = None
+        return self.lock.run(self.writeQueue)
+
+    @defer.inlineCallbacks
+    def writeQueue(self):
+        written = bool(self.queue)
+        while self.queue:
+            batch = self.queue[:self.maxBatchSize]
+            del self.queue[:self.maxBatchSize]
+            try:
+                yield self.writeBatch(batch)
+            except Exception:
+                log.err(None, "Unable to write results of runs {}".format(", ".join(str(item[0]) for item in batch)))
+                self.reportWritten([item for item in batch if not item[3].called], False)
+        if written:
+            yield self.updateTestDurations()
+
+    def refreshTestDurations(self):
+        """Bring the statistics of the test durations up to date with the database, returns the store"""
+        return self.lock.run(self.updateTestDurations)
+
+    @defer.inlineCallbacks
+    def updateTestDurations(self):
+        pool = self.getPool()
+        if pool is None:
+            return self.testDurations
+        if self.testDurations is None:
+            with open(self.dataBaseInfoFile) as file:
+                dataBaseInfo = file.read()
+            store = test_durations.TestDurationStore.fromDirectory(test_durations.DEFAULT_STORE_DIRECTORY,
+                                                                   dataBaseInfo)
+            yield threads.deferToThread(store.load)
+            self.testDurations = store
+        try:
+            # Rows are read in the pool thread, the store is changed in the reactor thread only
+            rows = yield pool.runWithConnection(
+                lambda connection: self.testDurations.fetchNewResults(PooledConnection(connection)))
+            if self.testDurations.addResults(rows):
+                yield threads.deferToThread(self.testDurations.save)
+        except Exception:
+            log.err(None, "Unable to refresh the test durations")
+        return self.testDurations
+
+    def getPool(self):
+        if self.pool is None and os.path.exists(self.dataBaseInfoFile):
+            with open(self.dataBaseInfoFile) as file:
+                dataBaseInfo = json.load(file)
+            self.pool = adbapi.ConnectionPool(
+                "MySQLdb",
+                host=dataBaseInfo["host"],
+                user=dataBaseInfo["user"],
+                passwd=dataBaseInfo["password"],
+                db=dataBaseInfo["database"],
+                cursorclass=DictCursor,
+                cp_min=1,
+                cp_max=self.poolSize,
+                cp_reconnect=True,
+            )
+        return self.pool
+
+    def isConfigured(self):
+        """Check whether the results database is configured, queued results are dropped otherwise"""
+        return self.getPool() is not None
+
+    def closePool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            self.flakinessEnabled = None
+
+    def runQuery(self, query, *args):
+        """Run the query through the connection pool, the result is None when the database is not configured"""
+        pool = self.getPool()
+        if pool is None:
+            return defer.succeed(None)
+        return pool.runQuery(query, *args)
+
+    @defer.inlineCallbacks
+    def writeBatch(self, batch):
+        pool = self.getPool()
+        if pool is None:
+            log.msg("Database information file {} does not exist, dropping results of runs {}".format(
+                self.dataBaseInfoFile, ", ".join(str(item[0]) for item in batch)))
+            self.reportWritten(batch, False)
+            return
+        try:
+            yield pool.runWithConnection(self.writeResults, batch)
+            self.reportWritten(batch, True)
+            return
+        except Exception:
+            log.err(None, "Unable to write results of {} runs in a single transaction".format(len(batch)))
+            # Test cases added by the rolled back transaction are not in the database
+            self.testCaseCache = write_build_results.TestCaseCache()
+        if len(batch) == 1:
+            self.reportWritten(batch, False)
+            return
+        for item in batch:
+            try:
+                yield pool.runWithConnection(self.writeResults, [item])
+                self.reportWritten([item], True)
+            except Exception:
+                log.err(None, "Unable to write results of run {}".format(item[0]))
+                self.testCaseCache = write_build_results.TestCaseCache()
+                self.reportWritten([item], False)
+
+    @staticmethod
+    def reportWritten(batch, written):
+        for _, _, _, outcome in batch:
+            outcome.callback(written)
+
+    def writeResults(self, connection, batch):
+        """Write the batch of results within a single transaction, the pool commits it when the call returns"""
+        client = PooledConnection(connection)
+        if self.flakinessEnabled is None:
+            self.flakinessEnabled = write_build_results.createFlakinessTable(client)
+        self.testCaseCache.synchronize(client)
+        for runId, results, coreDumpIndex, _ in batch:
+            writer = write_build_results.BuildResultsWriter(runId, bulk=True)
+            writer.client = client
+            writer.deferCommit = True
+            writer.testCaseCache = self.testCaseCache
+            writer.coreDumpIndex = coreDumpIndex
+            writer.flakinessEnabled = self.flakinessEnabled
+            writer.writeBuildResultsToDb(results)
+
+
+SERVICES = [ResultsIngestionService()]
@@ -1,7 +1,163 @@
+import time
 from buildbot.worker import Worker
 from maxscale.config.workers import WORKER_CREDENTIALS
 
 
+class WorkerRegistry:
+    """Indexes of the workers from the configuration that are built once when the configuration is loaded"""
+
+    def __init__(self, credentials):
+        self.names = [worker["name"] for worker in credentials]
+        self.workerToHost = {worker["name"]: worker["host"] for worker in credentials}
+        self.hostToWorkers = {}
+        for worker in credentials:
+            self.hostToWorkers.setdefault(worker["host"], []).append(worker["name"])
+        self.hostWorkerSets = {host: frozenset(names) for host, names in self.hostToWorkers.items()}
+        self.allWorkers = frozenset(self.names)
+
+    def hostOf(self, workerName):
+        return self.workerToHost.get(workerName)
+
+    def workersOnHosts(self, *hosts):
+        """Set of names of the workers that run on the hosts, all workers if no host is specified"""
+        hosts = [host for host in hosts if host]
+        if not hosts:
+            return self.allWorkers
+        if len(hosts) == 1:
+            return self.hostWorkerSets.get(hosts[0], frozenset())
+        return frozenset().union(*(self.hostWorkerSets.get(host, frozenset()) for host in hosts))
+
+
+REGISTRY = WorkerRegistry(WORKER_CREDENTIALS)
+
+
+# Resources of a host that builds are placed by
+RESOURCES = ("vms", "cpus", "memory")
+# Resources that are assumed for a builder that has no explicit configuration
+DEFAULT_BUILDER_FOOTPRINT = {"vms": 1, "cpus": 2, "memory": 4096}
+# Seconds a worker assignment keeps its resources reserved until the build starts
+RESERVATION_TIMEOUT = 120
+
+
+class HostLoadTracker:
+    """
+    Number of builds running on each host and the resources they use, updated when builds start and finish.
+    Each build uses the footprint of its builder, e.g. run_test creates several VMs while build creates one.
+    Resources are reserved when the worker is assigned, so builds assigned at once do not overload the host
+    before the master reports them as started. The live load reported by the host is used when it is higher.
+    """
+
+    def __init__(self, registry=REGISTRY, capacities=None, footprints=None):
+        self.registry = registry
+        self.capacities = capacities or {}
+        self.footprints = footprints or {}
+        self.reset()
+
+    def reset(self):
+        self.buildHosts = {}
+        self.hostLoad = {}
+        self.hostUsage = {}
+        self.reservations = {}
+        self.liveUsage = {}
+
+    def footprint(self, builderName):
+        return self.footprints.get(builderName, DEFAULT_BUILDER_FOOTPRINT)
+
+    def capacity(self, host):
+        """Resources of the host, None if they are not configured and the host is not limited by them"""
+        return self.capacities.get(host)
+
+    def addUsage(self, host, footprint, sign):
+        self.hostLoad[host] = self.hostLoad.get(host, 0) + sign
+        usage = self.hostUsage.setdefault(host, {})
+        for resource in RESOURCES:
+            usage[resource] = usage.get(resource, 0) + sign * footprint.get(resource, 0)
+
+    def reserve(self, workerName, builderName):
+        """Reserve resources of the worker host for the build that has been assigned to the worker"""
+        host = self.registry.hostOf(workerName)
+        if host is None:
+            return
+        self.releaseReservation(workerName)
+        footprint = self.footprint(builderName)
+        self.reservations[workerName] = (host, footprint, time.monotonic() + RESERVATION_TIMEOUT)
+        self.addUsage(host, footprint, 1)
+
+    def releaseReservation(self, workerName):
+        reservation = self.reservations.pop(workerName, None)
+        if reservation is not None:
+            self.addUsage(reservation[0], reservation[1], -1)
+
+    def expireReservations(self):
+        now = time.monotonic()
+        for workerName in [name for name, (_, _, deadline) in self.reservations.items() if deadline < now]:
+            self.releaseReservation(workerName)
+
+    def buildStarted(self, buildId, workerName, builderName=None):
+        self.releaseReservation(workerName)
+        host = self.registry.hostOf(workerName)
+        if host is None or buildId in self.buildHosts:
+            return
+        footprint = self.footprint(builderName)
+        self.buildHosts[buildId] = (host, footprint)
+        self.addUsage(host, footprint, 1)
+
+    def buildFinished(self, buildId):
+        host, footprint = self.buildHosts.pop(buildId, (None, None))
+        if host is not None:
+            self.addUsage(host, footprint, -1)
+
+    def updateLiveUsage(self, host, usage):
+        """
+        Set the resources the host reports as used
+        :param host: name of the host
+        :param usage: dictionary with the resource names mapped to the amount in use, None if unknown
+        """
+        if usage is None:
+            self.liveUsage.pop(host, None)
+        else:
+            self.liveUsage[host] = usage
+
+    def load(self, host):
+        """Number of builds running or about to start on the host"""
+        return self.hostLoad.get(host, 0)
+
+    def usage(self, host):
+        """Resources of the host in use, the higher of the reserved and the reported amounts"""
+        self.expireReservations()
+        reserved = self.hostUsage.get(host, {})
+        live = self.liveUsage.get(host, {})
+        return {resource: max(reserved.get(resource, 0), live.get(resource, 0)) for resource in RESOURCES}
+
+    def isIdle(self, host):
+        """Check that no build that uses resources of the host is running or about to start on it"""
+        self.expireReservations()
+        usage = self.hostUsage.get(host, {})
+        return not any(usage.get(resource, 0) > 0 for resource in RESOURCES)
+
+    def placementScore(self, host, builderName):
+        """
+        Highest share of a host resource that is in use once the build is placed on the host.
+        A host without configured capacity is limited only by its workers, each runs one build at a time,
+        its score is the number of builds per worker.
+        :param host: name of the host
+        :param builderName: name of the builder the build belongs to
+        :return: share of the resource, None if the host does not have capacity for the build
+        """
+        capacity = self.capacity(host)
+        if capacity is None:
+            return self.load(host) / max(1, len(self.registry.hostWorkerSets.get(host, ())))
+        usage = self.usage(host)
+        footprint = self.footprint(builderName)
+        score = max(((usage[resource] + footprint.get(resource, 0)) / capacity[resource]
+                     for resource in RESOURCES if capacity.get(resource)), default=0)
+        # A build that is larger than the host capacity still runs when no other build uses the host resources,
+        # builds that only wait for their children do not count
+        if score > 1 and not self.isIdle(host):
+            return None
+        return score
+
+
 def workerConfiguration():
     """Create worker configuration for use in BuildBot configuration"""
     configuration = []
@@ -12,11 +168,9 @@ def workerConfiguration():
 
 def workerNames(host=""):
     """Create a list of worker names that can be used in build configuration"""
-    workers = []
-    for credentials in WORKER_CREDENTIALS:
-        if host in credentials["host"]:
-            workers.append(credentials["name"])
-    return workers
+    if not host:
+        return list(REGISTRY.names)
+    return [name for name in REGISTRY.names if host in REGISTRY.workerToHost[name]]
 
 
 def workersOnHosts(*hosts):
@@ -24,29 +178,15 @@ def workersOnHosts(*hosts):
     Create a list of worker names that run on the specified hosts
     hosts (list): names of the host names to use
     """
-    acceptAll = True
-    for host in hosts:
-        if host:  # There is a valid host object, limiting to it
-            acceptAll = False
-
-    workers = []
-    for credentials in WORKER_CREDENTIALS:
-        if credentials["host"] in hosts or acceptAll:
-            workers.append(credentials["name"])
-    return workers
+    workers = REGISTRY.workersOnHosts(*hosts)
+    return [name for name in REGISTRY.names if name in workers]
 
 
 def workerToHostMap():
     """Creates dictionary with worker name mapped to host"""
-    workerToHost = {}
-    for credentials in WORKER_CREDENTIALS:
-        workerToHost[credentials["name"]] = credentials["host"]
-    return workerToHost
+    return dict(REGISTRY.workerToHost)
 
 
 def workerHosts():
     """Creates a list of hosts that are available in configuration"""
-    hosts = []
-    for credentials in WORKER_CREDENTIALS:
-        hosts.append(credentials["host"])
-    return list(set(hosts))
+    return list(REGISTRY.hostToWorkers)
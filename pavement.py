@@ -20,6 +20,15 @@ def check_code():
 # [[[endsection]]
 
 
+# [[[section run the tests]]]
+@task
+@consume_args
+def test(args):
+    """Run the tests of the master and the worker scripts"""
+    sh("python3 -m pytest {}".format(" ".join(args)))
+# [[[endsection]]]
+
+
 # [[[section run the buildbot in development mode]]
 @task
 @cmdopts([
@@ -46,3 +55,21 @@ def restart_buildbot():
     call_task("buildbot", options={"command": "restart"})
     sh("buildbot-worker restart worker-dev")
 # [[[endsection]]]
+
+
+# [[[section benchmark the worker-side result pipeline]]]
+@task
+@consume_args
+def benchmark(args):
+    """Benchmark parse_ctest_log.py, coredump_finder.py and write_build_results.py on synthetic data"""
+    sh("python3 support/benchmark_result_pipeline.py {}".format(" ".join(args)))
+# [[[endsection]]]
+
+
+# [[[section benchmark the ctest log parser against its baseline]]]
+@task
+@consume_args
+def benchmark_parser(args):
+    """Compare parse_ctest_log.py with its baseline version on a generated build log"""
+    sh("python3 support/benchmark_ctest_parser.py {}".format(" ".join(args)))
+# [[[endsection]]]
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark of parse_ctest_log.py against its baseline version.
+
+A synthetic build log of the given size with passed, failed, timed out and retried tests and the valgrind logs
+of the tests are generated in a temporary directory that acts as the home directory of the worker. The baseline
+parser is taken from the git history, both parsers are run on the same log with the arguments of the run_test
+builder, their wall time and peak RSS are reported and their outputs are compared. The script fails if the
+outputs differ.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import benchmark_result_pipeline
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSER_PATH = "master/maxscale/builders/support/scripts/parse_ctest_log.py"
+# Parser before it was rewritten to parse the log in a single pass
+BASELINE_REVISION = "b838029^"
+RUN_TEST_DIRECTORY = benchmark_result_pipeline.RUN_TEST_DIRECTORY
+# Keys that the new parser adds to the JSON results, they are not compared
+ADDED_RESULT_KEYS = ["flaky_tests", "failure_classes"]
+# Average length of the generated output line of a test
+OUTPUT_LINE_SIZE = 80
+
+
+def parseArguments(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark of parse_ctest_log.py against its baseline version")
+    parser.add_argument("--size", type=int, default=2048, help="approximate size of the build log in MiB")
+    parser.add_argument("--output-lines", type=int, default=200, help="lines of output of each test run")
+    parser.add_argument("--failed-tests", type=float, default=0.05, help="fraction of the tests that fail")
+    parser.add_argument("--retried-tests", type=float, default=0.5,
+                        help="fraction of the failed tests that are retried")
+    parser.add_argument("--retries", type=int, default=2, help="number of retries of the retried tests")
+    parser.add_argument("--leaking-tests", type=float, default=0.05,
+                        help="fraction of the tests with a leak summary in their valgrind log")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated data")
+    parser.add_argument("--baseline-revision", default=BASELINE_REVISION,
+                        help="git revision to take the baseline parser from")
+    parser.add_argument("--baseline-script", help="baseline parser to use instead of the one from git")
+    parser.add_argument("--work-directory", help="keep generated data in this directory")
+    parser.add_argument("--output-file", help="save measurements to this JSON file")
+    return parser.parse_args(args)
+
+
+def generateLog(args, homeDirectory):
+    """
+    Create the build log and the valgrind logs of the tests in the layout of the run_test builder
+    :return: path to the build log
+    """
+    generator = random.Random(args.seed)
+    testsLogsDirectory = os.path.join(homeDirectory, "LOGS", RUN_TEST_DIRECTORY, "LOGS")
+    testSize = args.output_lines * OUTPUT_LINE_SIZE * (1 + args.failed_tests * args.retried_tests * args.retries)
+    testsCount = max(int(args.size * 1024 * 1024 / testSize), 1)
+    testNames = ["parser_test_{:06d}".format(number) for number in range(1, testsCount + 1)]
+    ctestLog = os.path.join(homeDirectory, "build_log")
+    failedCount = 0
+    with open(ctestLog, "w") as log:
+        log.write("MaxScale 2.5.0 - 0123456789abcdef0123456789abcdef01234567\n")
+        log.write("CMake flags: -DCMAKE_BUILD_TYPE=Debug -DBUILD_TESTS=Y\n")
+        log.write("Source: refs/heads/develop\n")
+        log.write("Logs go to /home/vagrant/LOGS/{}\n".format(RUN_TEST_DIRECTORY))
+        log.write("Maxscale_full_version_start:\nmaxscale 2.5.0 develop\nMaxscale_full_version_end\n")
+        log.write("Constructing a list of tests\nDone constructing a list of tests\n")
+        log.write("Checking test dependency graph...\nChecking test dependency graph end\n")
+        # The baseline parser mixes up the failed tests after a failed test passes, so the log has no full test
+        # list, where every test is failed until it runs, and the retried tests fail on every run
+        index = 0
+        for number, name in enumerate(testNames, 1):
+            failed = generator.random() < args.failed_tests
+            failedCount += failed
+            runs = args.retries + 1 if failed and generator.random() < args.retried_tests else 1
+            for run in range(runs):
+                index += 1
+                if generator.random() < args.leaking_tests:
+                    writeValgrindLog(generator, os.path.join(testsLogsDirectory, name, "{:03d}".format(run)))
+                log.write("test {}\n    Start {}: {}\n\n".format(number, number, name))
+                for line in range(args.output_lines):
+                    log.write("{}: {} output line {} {}\n".format(number, name, line, "x" * generator.randint(0, 80)))
+                status = generator.choice(["***Failed", "***Timeout"]) if failed else "Passed"
+                log.write("{:>4}/{} Test #{}: {} {} {:>10}   {:.2f} sec\n".format(
+                    index, testsCount, number, name, "." * (40 - len(name) % 40), status,
+                    generator.uniform(1, 300)))
+        log.write("\n{}% tests passed, {} tests failed out of {}\n".format(
+            (testsCount - failedCount) * 100 // testsCount, failedCount, testsCount))
+        log.write("\nTotal Test time (real) = 1000.00 sec\n")
+    return ctestLog
+
+
+def writeValgrindLog(generator, runDirectory):
+    os.makedirs(runDirectory, exist_ok=True)
+    with open(os.path.join(runDirectory, "valgrind_{}.log".format(generator.randint(1000, 9999))), "w") as file:
+        file.write("==1234== Memcheck, a memory error detector\n")
+        file.write("==1234== LEAK SUMMARY:\n")
+        file.write("==1234==    definitely lost: {} bytes in 1 blocks\n".format(generator.randint(0, 64)))
+        file.write("==1234==    indirectly lost: 0 bytes in 0 blocks\n")
+        file.write("==1234==      possibly lost: {} bytes in 2 blocks\n".format(generator.randint(0, 512)))
+        file.write("==1234==    still reachable: 1,024 bytes in 8 blocks\n")
+        file.write("==1234== \n")
+        file.write("==1234== ERROR SUMMARY: 0 errors from 0 contexts (suppressed: 0 from 0)\n")
+
+
+def extractBaselineParser(revision, fileName):
+    """Save the parser of the git revision into the file"""
+    with open(fileName, "wb") as file:
+        subprocess.run(["git", "show", "{}:{}".format(revision, PARSER_PATH)], cwd=REPOSITORY_DIRECTORY,
+                       stdout=file, check=True)
+
+
+def digestDirectory(directory):
+    """Get the SHA-256 of each file in the directory by its relative path"""
+    digests = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                digest = hashlib.sha256()
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(block)
+            digests[os.path.relpath(path, directory)] = digest.hexdigest()
+    return digests
+
+
+def readOutput(fileName):
+    with open(fileName) as file:
+        return file.read()
+
+
+def runParser(name, script, ctestLog, homeDirectory, environment):
+    """
+    Run the parser as the run_test builder does and collect its outputs. Sublogs are kept only as digests,
+    so the sublogs of the two parsers do not take the disk space at once.
+    :return: measurement of the run and the outputs of the parser
+    """
+    outputDirectory = os.path.join(homeDirectory, name)
+    shutil.rmtree(outputDirectory, ignore_errors=True)
+    os.makedirs(outputDirectory)
+    sublogsDirectory = os.path.join(outputDirectory, "ctest_sublogs")
+    storeDirectory = os.path.join(outputDirectory, "store")
+    command = [
+        sys.executable, script, ctestLog,
+        "--output-log-file", os.path.join(outputDirectory, "results"), "--human-readable", "--only-failed",
+        "--output-log-json-file", os.path.join(outputDirectory, "results.json"),
+        "--ctest-sublogs-path", sublogsDirectory, "--store-directory", storeDirectory]
+    measurement = benchmark_result_pipeline.runStage(command, environment, False, outputDirectory)
+    results = json.loads(readOutput(os.path.join(outputDirectory, "results.json")))
+    outputs = {
+        "human-readable results": readOutput(os.path.join(outputDirectory, "results")),
+        "JSON results": {key: value for key, value in results.items() if key not in ADDED_RESULT_KEYS},
+        "ctest sublogs": digestDirectory(sublogsDirectory),
+        "stored sublogs": digestDirectory(storeDirectory),
+    }
+    shutil.rmtree(outputDirectory)
+    return measurement, outputs
+
+
+def compareOutputs(baselineOutputs, outputs):
+    """:return: names of the outputs that differ"""
+    return [name for name, value in outputs.items() if baselineOutputs[name] != value]
+
+
+def runBenchmark(args, homeDirectory):
+    baselineScript = args.baseline_script
+    if not baselineScript:
+        baselineScript = os.path.join(homeDirectory, "baseline_parse_ctest_log.py")
+        extractBaselineParser(args.baseline_revision, baselineScript)
+    ctestLog = generateLog(args, homeDirectory)
+    environment = dict(os.environ, HOME=homeDirectory)
+    environment.pop("WORKSPACE", None)
+    measurements = {}
+    outputs = {}
+    for name, script in [("baseline", baselineScript), ("current", os.path.join(REPOSITORY_DIRECTORY, PARSER_PATH))]:
+        measurements[name], outputs[name] = runParser(name, script, ctestLog, homeDirectory, environment)
+    return {
+        "parameters": {key: getattr(args, key) for key in
+                       ("size", "output_lines", "failed_tests", "retried_tests", "retries", "leaking_tests", "seed")},
+        "log_size": os.path.getsize(ctestLog),
+        "parsers": measurements,
+        "differences": compareOutputs(outputs["baseline"], outputs["current"]),
+    }
+
+
+def printReport(report):
+    print("Log size: {:.1f} MiB, parameters: {}".format(report["log_size"] / 1024 / 1024,
+                                                        json.dumps(report["parameters"], sort_keys=True)))
+    print("{:<12}{:>14}{:>16}".format("Parser", "Wall time, s", "Peak RSS, MiB"))
+    for name, measurement in report["parsers"].items():
+        print("{:<12}{:>14.3f}{:>16.1f}".format(name, measurement["wall_time"], measurement["peak_rss"] / 1024))
+    for difference in report["differences"]:
+        print("Outputs differ: {}".format(difference))
+    if not report["differences"]:
+        print("Outputs are the same")
+
+
+def main(args=None):
+    args = parseArguments(args)
+    if args.work_directory:
+        os.makedirs(args.work_directory, exist_ok=True)
+        report = runBenchmark(args, os.path.abspath(args.work_directory))
+    else:
+        with tempfile.TemporaryDirectory(prefix="maxscale-parser-benchmark-") as homeDirectory:
+            report = runBenchmark(args, homeDirectory)
+    printReport(report)
+    if args.output_file:
+        with open(args.output_file, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    if report["differences"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
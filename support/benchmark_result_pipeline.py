@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the worker-side result pipeline: parse_ctest_log.py, coredump_finder.py and write_build_results.py.
+
+Synthetic ctest log, valgrind logs and core dump tree are generated in a temporary directory that acts as the
+home directory of the worker. Each stage is run as a separate process, its wall time and peak RSS are measured,
+syscalls are counted with strace when it is installed. The writer uses SQLite in place of the results database
+unless the database information file is given.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "master", "maxscale", "builders", "support", "scripts")
+RUN_TEST_DIRECTORY = "run_test-1"
+WRITER_STAGE_OPTION = "--run-writer-stage"
+
+SQLITE_SCHEMA = """
+CREATE TABLE test_cases (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE);
+CREATE TABLE target_builds (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, start_time TEXT, target TEXT,
+    box TEXT, product TEXT, mariadb_version TEXT, test_code_commit_id TEXT, maxscale_commit_id TEXT,
+    cmake_flags TEXT, maxscale_source TEXT);
+CREATE TABLE test_run (id INTEGER PRIMARY KEY AUTOINCREMENT, jenkins_id INTEGER, start_time TEXT, target TEXT,
+    box TEXT, product TEXT, mariadb_version TEXT, test_code_commit_id TEXT, maxscale_commit_id TEXT, job_name TEXT,
+    cmake_flags TEXT, maxscale_source TEXT, logs_dir TEXT, target_build_id INTEGER);
+CREATE TABLE results (id INTEGER, test TEXT, result INTEGER, test_time REAL, core_dump_path TEXT,
+    leak_summary TEXT, target_build_id INTEGER, test_case_id INTEGER);
+"""
+
+
+def parseArguments(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the worker-side result pipeline")
+    parser.add_argument("--tests", type=int, default=300, help="number of tests in the ctest log")
+    parser.add_argument("--retries", type=int, default=2, help="number of failed runs of the retried tests")
+    parser.add_argument("--retried-tests", type=float, default=0.1, help="fraction of the tests that are retried")
+    parser.add_argument("--output-lines", type=int, default=200, help="lines of output of each test run")
+    parser.add_argument("--valgrind-lines", type=int, default=2000, help="lines of each valgrind log")
+    parser.add_argument("--core-dumps", type=float, default=0.05, help="fraction of the tests with a core dump")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated data")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each stage, the fastest is reported")
+    parser.add_argument("--syscalls", action="store_true", help="count syscalls with 'strace -f -c'")
+    parser.add_argument("--database-info", help="write to the database described by this file instead of SQLite")
+    parser.add_argument("--work-directory", help="keep generated data in this directory")
+    parser.add_argument("--output-file", help="save measurements to this JSON file")
+    parser.add_argument("--baseline", help="compare measurements with the JSON file saved by the previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed relative growth of the measurements compared to the baseline")
+    parser.add_argument(WRITER_STAGE_OPTION, nargs=4, metavar=("results", "index", "cache", "database"),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def generateData(args, homeDirectory):
+    """
+    Create the ctest log and the logs of the tests in the same layout the run_test builder produces them
+    :return: path to the ctest log
+    """
+    generator = random.Random(args.seed)
+    testsLogsDirectory = os.path.join(homeDirectory, "LOGS", RUN_TEST_DIRECTORY, "LOGS")
+    ctestLog = os.path.join(homeDirectory, "build_log")
+    testNames = ["benchmark_test_{:05d}".format(number) for number in range(1, args.tests + 1)]
+    with open(ctestLog, "w") as log:
+        log.write("MaxScale 2.5.0 - 0123456789abcdef0123456789abcdef01234567\n")
+        log.write("CMake flags: -DCMAKE_BUILD_TYPE=Debug -DBUILD_TESTS=Y\n")
+        log.write("Source: refs/heads/develop\n")
+        log.write("Logs go to /home/vagrant/LOGS/{}\n".format(RUN_TEST_DIRECTORY))
+        log.write("===Full test list begin===\n")
+        for number, name in enumerate(testNames, 1):
+            log.write("  Test #{}: {}\n".format(number, name))
+        log.write("===Full test list end===\n")
+        log.write("Constructing a list of tests\nDone constructing a list of tests\n")
+        log.write("Checking test dependency graph...\nChecking test dependency graph end\n")
+        index = 0
+        for number, name in enumerate(testNames, 1):
+            runs = args.retries + 1 if generator.random() < args.retried_tests else 1
+            for run in range(runs):
+                index += 1
+                runDirectory = os.path.join(testsLogsDirectory, name, "{:03d}".format(run))
+                writeTestLogs(generator, args, runDirectory, run == 0)
+                for line in range(args.output_lines):
+                    log.write("{}: {} output line {} {}\n".format(number, name, line, "x" * generator.randint(0, 80)))
+                status = "Passed" if run == runs - 1 else "***Failed"
+                log.write("{:>4}/{} Test #{}: {} {} {:>10}   {:.2f} sec\n".format(
+                    index, args.tests, number, name, "." * (40 - len(name) % 40), status,
+                    generator.uniform(1, 300)))
+            if generator.random() < args.core_dumps:
+                coreDirectory = os.path.join(testsLogsDirectory, name, "000", "node_000")
+                os.makedirs(coreDirectory, exist_ok=True)
+                with open(os.path.join(coreDirectory, "core.{}".format(number)), "wb") as core:
+                    core.write(b"\0" * 4096)
+        log.write("\n{}% tests passed, 0 tests failed out of {}\n".format(100, args.tests))
+    return ctestLog
+
+
+def writeTestLogs(generator, args, runDirectory, firstRun):
+    os.makedirs(runDirectory, exist_ok=True)
+    with open(os.path.join(runDirectory, "maxscale.log"), "w") as file:
+        for line in range(args.output_lines):
+            file.write("2020-01-01 00:00:00   info   : (1) Line {}\n".format(line))
+    if not firstRun:
+        return
+    with open(os.path.join(runDirectory, "valgrind_{}.log".format(generator.randint(1000, 9999))), "w") as file:
+        for line in range(args.valgrind_lines):
+            file.write("==1234==    at 0x{:08X}: function_{} (file.cc:{})\n".format(line, line % 97, line))
+        file.write("==1234== LEAK SUMMARY:\n")
+        file.write("==1234==    definitely lost: {} bytes in {} blocks\n".format(generator.randint(0, 64), 1))
+        file.write("==1234==    indirectly lost: 0 bytes in 0 blocks\n")
+        file.write("==1234==      possibly lost: {} bytes in 2 blocks\n".format(generator.randint(0, 512)))
+        file.write("==1234==    still reachable: 1,024 bytes in 8 blocks\n")
+        file.write("==1234== \n")
+        file.write("==1234== ERROR SUMMARY: 0 errors from 0 contexts (suppressed: 0 from 0)\n")
+
+
+def createSqliteDatabase(fileName):
+    connection = sqlite3.connect(fileName)
+    connection.executescript(SQLITE_SCHEMA)
+    connection.close()
+
+
+class SqliteCursor:
+    """Cursor of the mysql.connector interface used by the BuildResultsWriter"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @staticmethod
+    def convertQuery(query):
+        query = re.sub(r"%\((\w+)\)s", r":\1", query).replace("%s", "?")
+        # Upserts of MySQL are written with the equivalent clause of SQLite
+        query = query.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+        return re.sub(r"\bVALUES\((\w+)\)", r"excluded.\1", query)
+
+    def execute(self, query, params=()):
+        self.cursor.execute(self.convertQuery(query), params)
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(self.convertQuery(query), rows)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+class SqliteConnection:
+    """SQLite stand-in for the results database"""
+
+    def __init__(self, fileName):
+        self.connection = sqlite3.connect(fileName)
+        self.connection.row_factory = sqlite3.Row
+
+    def cursor(self, dictionary=False):
+        return SqliteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+def runWriterStage(resultsFile, indexFile, cacheDirectory, databaseFile):
+    """Run the BuildResultsWriter the same way write_build_results.py does, but on top of SQLite"""
+    sys.path.append(SCRIPTS_DIRECTORY)
+    import write_build_results
+    writer = write_build_results.BuildResultsWriter(1, bulk=True, coreDumpIndexFile=indexFile)
+    writer.parseInputFile(resultsFile)
+    writer.client = SqliteConnection(databaseFile)
+    writer.testCaseCache = write_build_results.TestCaseCache(os.path.join(cacheDirectory, "test_cases.json"))
+    writer.testCaseCache.load()
+    writer.testCaseCache.synchronize(writer.client)
+    writer.flakinessEnabled = write_build_results.createFlakinessTable(writer.client)
+    writer.writeBuildResultsToDb(writer.parsedContent)
+    writer.testCaseCache.save()
+    writer.client.close()
+
+
+def countSyscalls(straceOutput):
+    """Get the total number of calls from the 'strace -c' summary"""
+    header = None
+    with open(straceOutput) as file:
+        for line in file:
+            if "calls" in line and "syscall" in line:
+                header = line
+            elif header and line.rstrip().endswith("total"):
+                callsEnd = header.index("calls") + len("calls")
+                for match in re.finditer(r"\S+", line):
+                    if match.end() == callsEnd:
+                        return int(match.group(0))
+    return None
+
+
+def runStage(command, environment, syscalls, workDirectory):
+    """
+    Run the stage in a child process
+    :return: dictionary with wall time in seconds, peak RSS in KiB and number of syscalls
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=environment, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    measurement = {"wall_time": time.perf_counter() - start, "peak_rss": usage.ru_maxrss, "syscalls": None}
+    if process.returncode != 0:
+        raise RuntimeError("Command {} failed with code {}".format(" ".join(command), process.returncode))
+    if syscalls:
+        straceOutput = os.path.join(workDirectory, "strace.txt")
+        subprocess.run(["strace", "-f", "-c", "-o", straceOutput] + command, env=environment,
+                       stdout=subprocess.DEVNULL, check=True)
+        measurement["syscalls"] = countSyscalls(straceOutput)
+    return measurement
+
+
+def createStages(args, homeDirectory, ctestLog):
+    """
+    Create commands of the stages in the order the run_test builder runs them
+    :return: list of (name, preparation function, command) triples
+    """
+    resultsFile = os.path.join(homeDirectory, "json_1.gz")
+    indexFile = os.path.join(homeDirectory, "coredumps_index_1.json")
+    cacheDirectory = os.path.join(homeDirectory, "cache")
+    databaseFile = os.path.join(homeDirectory, "results.sqlite")
+    sublogsDirectory = os.path.join(homeDirectory, "ctest_sublogs")
+    storeDirectory = os.path.join(homeDirectory, "LOGS", "results_1", "LOGS")
+
+    def prepareParser():
+        shutil.rmtree(sublogsDirectory, ignore_errors=True)
+        shutil.rmtree(storeDirectory, ignore_errors=True)
+
+    def prepareWriter():
+        shutil.rmtree(cacheDirectory, ignore_errors=True)
+        os.makedirs(cacheDirectory)
+        if not args.database_info:
+            if os.path.exists(databaseFile):
+                os.remove(databaseFile)
+            createSqliteDatabase(databaseFile)
+
+    if args.database_info:
+        with open(args.database_info) as file:
+            dataBaseInfo = file.read()
+        writerCommand = [sys.executable, os.path.join(SCRIPTS_DIRECTORY, "write_build_results.py"),
+                         "--run-id", "1", "--database-info", dataBaseInfo, "--bulk",
+                         "--core-dump-index", indexFile, "--test-cases-cache", cacheDirectory, resultsFile]
+    else:
+        writerCommand = [sys.executable, os.path.abspath(__file__), WRITER_STAGE_OPTION,
+                         resultsFile, indexFile, cacheDirectory, databaseFile]
+    return [
+        ("parse_ctest_log", prepareParser, [
+            sys.executable, os.path.join(SCRIPTS_DIRECTORY, "parse_ctest_log.py"), ctestLog,
+            "--output-log-file", os.path.join(homeDirectory, "results_1"), "--human-readable", "--only-failed",
+            "--output-log-json-file", resultsFile, "--compact-json",
+            "--ctest-sublogs-path", sublogsDirectory, "--store-directory", storeDirectory]),
+        ("coredump_finder", None, [
+            sys.executable, os.path.join(SCRIPTS_DIRECTORY, "coredump_finder.py"),
+            "--directory", os.path.join(homeDirectory, "LOGS", RUN_TEST_DIRECTORY),
+            "--remote-prefix", "https://logs.example.com/{}/".format(RUN_TEST_DIRECTORY),
+            "--output-file", os.path.join(homeDirectory, "coredumps_1"), "--index-file", indexFile]),
+        ("write_build_results", prepareWriter, writerCommand),
+    ]
+
+
+def runBenchmark(args, homeDirectory):
+    ctestLog = generateData(args, homeDirectory)
+    environment = dict(os.environ, HOME=homeDirectory)
+    environment.pop("WORKSPACE", None)
+    measurements = {}
+    for name, prepare, command in createStages(args, homeDirectory, ctestLog):
+        runs = []
+        for _ in range(max(args.repeat, 1)):
+            if prepare:
+                prepare()
+            runs.append(runStage(command, environment, False, homeDirectory))
+        measurement = min(runs, key=lambda run: run["wall_time"])
+        measurement["peak_rss"] = max(run["peak_rss"] for run in runs)
+        if args.syscalls:
+            if prepare:
+                prepare()
+            measurement["syscalls"] = runStage(command, environment, True, homeDirectory)["syscalls"]
+        measurements[name] = measurement
+    return {
+        "parameters": {key: getattr(args, key) for key in
+                       ("tests", "retries", "retried_tests", "output_lines", "valgrind_lines", "core_dumps", "seed")},
+        "log_size": os.path.getsize(ctestLog),
+        "stages": measurements,
+    }
+
+
+def findRegressions(report, baseline, maxRegression):
+    """
+    Compare measurements of each stage with the baseline
+    :return: list of descriptions of the measurements that grew more than allowed
+    """
+    regressions = []
+    for stage, measurement in report["stages"].items():
+        baselineMeasurement = baseline.get("stages", {}).get(stage, {})
+        for key, value in measurement.items():
+            baselineValue = baselineMeasurement.get(key)
+            if value is None or not baselineValue:
+                continue
+            if value > baselineValue * (1 + maxRegression):
+                regressions.append("{} {}: {:.6g} > {:.6g}".format(stage, key, value, baselineValue))
+    return regressions
+
+
+def printReport(report):
+    print("Log size: {:.1f} MiB, parameters: {}".format(report["log_size"] / 1024 / 1024,
+                                                        json.dumps(report["parameters"], sort_keys=True)))
+    print("{:<22}{:>12}{:>16}{:>12}".format("Stage", "Wall time, s", "Peak RSS, MiB", "Syscalls"))
+    for stage, measurement in report["stages"].items():
+        syscalls = measurement["syscalls"]
+        print("{:<22}{:>12.3f}{:>16.1f}{:>12}".format(stage, measurement["wall_time"], measurement["peak_rss"] / 1024,
+                                                      "n/a" if syscalls is None else syscalls))
+
+
+def main(args=None):
+    args = parseArguments(args)
+    if args.run_writer_stage:
+        runWriterStage(*args.run_writer_stage)
+        return
+    if args.syscalls and shutil.which("strace") is None:
+        print("strace is not installed, syscalls are not counted")
+        args.syscalls = False
+    if args.work_directory:
+        os.makedirs(args.work_directory, exist_ok=True)
+        report = runBenchmark(args, os.path.abspath(args.work_directory))
+    else:
+        with tempfile.TemporaryDirectory(prefix="maxscale-benchmark-") as homeDirectory:
+            report = runBenchmark(args, homeDirectory)
+    printReport(report)
+    if args.output_file:
+        with open(args.output_file, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = findRegressions(report, json.load(file), args.max_regression)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
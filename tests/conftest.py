@@ -0,0 +1,22 @@
+import importlib
+import os
+import sys
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MASTER_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, "master")
+SCRIPTS_DIRECTORY = os.path.join(MASTER_DIRECTORY, "maxscale", "builders", "support", "scripts")
+SUPPORT_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, "support")
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+sys.path.extend([MASTER_DIRECTORY, SCRIPTS_DIRECTORY, SUPPORT_DIRECTORY])
+
+
+def useExampleWorkersConfiguration():
+    """The list of workers is configured on the master, the tests that need it use the example"""
+    try:
+        importlib.import_module("maxscale.config.workers")
+    except ImportError:
+        sys.modules["maxscale.config.workers"] = importlib.import_module("maxscale.config.workers_example")
+
+
+useExampleWorkersConfiguration()
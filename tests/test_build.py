@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("buildbot")
+
+from buildbot.process.properties import Properties  # noqa: E402
+from maxscale.builders import build  # noqa: E402
+
+PROPERTIES = {"got_revision": "0123456789abcdef", "box": "ubuntu_bionic_libvirt", "cmake_flags": "-DBUILD_TESTS=Y",
+              "build_experimental": "yes", "target": "develop-1", "buildnumber": 7}
+
+
+def artifactKey(values):
+    properties = Properties(**{name: (value, "test") for name, value in values.items()})
+    keys = []
+    properties.render(build.artifactCacheKey).addCallback(keys.append)
+    return keys[0]
+
+
+def testKeyDependsOnlyOnTheSourcesAndOptions():
+    key = artifactKey(PROPERTIES)
+    assert key == artifactKey(dict(PROPERTIES, target="develop-2", buildnumber=8))
+    for name in build.ARTIFACT_KEY_PROPERTIES:
+        assert artifactKey(dict(PROPERTIES, **{name: "changed"})) != key, name
+
+
+def testMissingPropertyChangesTheKey():
+    values = dict(PROPERTIES)
+    del values["build_experimental"]
+    assert artifactKey(values) != artifactKey(PROPERTIES)
+
+
+@pytest.mark.parametrize("rc, stdout, cachedTarget", [
+    (0, "develop-1\n", "develop-1"),
+    (0, "warning\n.artifacts/abc\n", ".artifacts/abc"),
+    (0, "", None),
+    (1, "develop-1\n", None),
+])
+def testCachedTargetIsTakenFromTheLastLine(rc, stdout, cachedTarget):
+    assert build.extractCachedTarget(rc, stdout, "") == {"cachedTarget": cachedTarget}
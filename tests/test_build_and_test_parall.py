@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("buildbot")
+
+from maxscale.builders import build_and_test_parall  # noqa: E402
+
+
+def testLongestTestsAreSpreadFirst():
+    durations = {"a": 10, "b": 7, "c": 6, "d": 5, "e": 4}
+    assert build_and_test_parall.packTests(durations, 2) == [(15, ["a", "d"]), (17, ["b", "c", "e"])]
+
+
+def testEmptyShardsAreLeftOut():
+    assert build_and_test_parall.packTests({"a": 3, "b": 1}, 4) == [(3, ["a"]), (1, ["b"])]
+    assert build_and_test_parall.packTests({}, 3) == []
+
+
+def testTestsOfTheSameDurationArePackedByName():
+    durations = {"c": 1, "a": 1, "b": 1, "d": 1}
+    assert build_and_test_parall.packTests(durations, 2) == [(2, ["a", "c"]), (2, ["b", "d"])]
+
+
+def testDurationTestSetsCoverAllTestsOfTheGroup():
+    groups = build_and_test_parall.TEST_GROUPS
+    durations = {groups[0]["name"]: {"slow_test": 600, "medium_test": 300, "fast_test": 100, "other_test": 100}}
+    testSets = build_and_test_parall.createDurationTestSets(durations, len(groups) + 1)
+    assert len(testSets) == len(groups) + 1
+    shards = [testSet["test_set"] for testSet in testSets if testSet["name"].startswith(groups[0]["name"])]
+    assert shards == [groups[0]["labels"] + " -R '^(slow_test)$'",
+                      groups[0]["labels"] + " -E '^(slow_test)$'"]
+    assert [testSet["test_set"] for testSet in testSets[2:]] == [group["labels"] for group in groups[1:]]
+
+
+def testDocumentationSelectsNoTests():
+    impact = build_and_test_parall.changeImpact(["Documentation/Changelog.md", "README.md"])
+    assert impact == build_and_test_parall.TestImpact(False, set(), set())
+
+
+def testModulesSelectTheirLabels():
+    impact = build_and_test_parall.changeImpact(["server/modules/filter/cache/cache.cc",
+                                                 "server/modules/routing/readwritesplit/rwsplit.cc",
+                                                 "system-test/mxs1507_trx_replay.cpp", "maxctrl/lib/cmd.js"])
+    assert impact == build_and_test_parall.TestImpact(False, {"cache", "readwritesplit", "maxctrl"},
+                                                      {"mxs1507_trx_replay"})
+
+
+@pytest.mark.parametrize("files", [
+    [],
+    ["server/modules/protocol/MariaDB/protocol.cc"],
+    ["server/core/config.cc", "Documentation/Changelog.md"],
+])
+def testUnknownAndCoreChangesRunAllTests(files):
+    assert build_and_test_parall.changeImpact(files).full
+
+
+HOUR = 60 * 60
+NOW = 100 * 24 * HOUR
+
+
+@pytest.mark.parametrize("history, due", [
+    ([], True),
+    ([("impact", NOW - HOUR), ("full", NOW - 2 * HOUR)], False),
+    ([("full", NOW - 25 * HOUR)], True),
+    ([("impact", NOW - minutes * 60) for minutes in range(10)] + [("full", NOW - 2 * HOUR)], True),
+    ([("impact", NOW - minutes * 60) for minutes in range(9)] + [("full", NOW - 2 * HOUR)], False),
+    ([("impact", NOW - HOUR)] * 20, True),
+])
+def testFullRunIsDueAfterIntervalOrAge(history, due):
+    assert build_and_test_parall.isFullRunDue(history, NOW, interval=10, maxAge=24 * HOUR) == due
@@ -0,0 +1,46 @@
+import random
+import re
+
+import pytest
+
+pytest.importorskip("buildbot")
+
+from maxscale.change_source import maxscale  # noqa: E402
+from maxscale.config.branches_list_file import MAXSCALE_BRANCHES_LIST, MAXSCALE_PERF_BRANCHES_LIST  # noqa: E402
+
+
+def searchRules(rules, branch):
+    """First rule of the list that matches the branch, the way the rules were searched before BranchRules"""
+    for rule in rules:
+        if re.search(rule["branch"], branch):
+            return rule
+    return None
+
+
+def branchNames():
+    generator = random.Random(1)
+    names = ["develop", "develop2", "MXS-1234", "MXS-", "2.3", "2.4", "2.5", "2.5.1", "x2.4", "feature", "", "2.4\n"]
+    names.extend("".join(generator.choice("MXS-2.345develop\n") for _ in range(generator.randint(0, 12)))
+                 for _ in range(2000))
+    return names
+
+
+@pytest.mark.parametrize("rules", [
+    MAXSCALE_BRANCHES_LIST,
+    MAXSCALE_PERF_BRANCHES_LIST,
+    [{"branch": r"(?P<version>\d+)\.x$"}, {"branch": r"^(\w+)-(\w+)$"}, {"branch": "^$"}],
+    # Patterns that reuse a group name can not be combined and are searched one by one
+    [{"branch": r"(?P<name>MXS)-\d+"}, {"branch": r"(?P<name>develop)"}],
+])
+def testFirstMatchingRuleIsFound(rules):
+    branchRules = maxscale.BranchRules(rules)
+    for branch in branchNames():
+        assert branchRules.find(branch) is searchRules(rules, branch), branch
+
+
+def testTestSetOfTheBranch():
+    assert maxscale.get_test_set_by_branch("develop") == "-LE HEAVY"
+    assert maxscale.get_test_set_by_branch("2.5") == "-LE UNSTABLE"
+    assert maxscale.get_test_set_by_branch("feature") is None
+    assert maxscale.check_branch_fn("refs/heads/MXS-1234")
+    assert not maxscale.check_branch_fn("refs/heads/feature")
@@ -0,0 +1,89 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import FIXTURES_DIRECTORY, SCRIPTS_DIRECTORY
+
+PARSER = os.path.join(SCRIPTS_DIRECTORY, "parse_ctest_log.py")
+CTEST_LOGS_DIRECTORY = os.path.join(FIXTURES_DIRECTORY, "ctest_logs")
+# Keys of the JSON results that the parser added after the expected results were recorded
+ADDED_RESULT_KEYS = ["flaky_tests", "failure_classes"]
+
+
+def runParser(logDirectory, outputDirectory, *arguments):
+    """
+    Run the parser with the arguments of the run_test builder on the build log of the fixture.
+    The directory of the fixture is the home directory, the valgrind logs are found there.
+    """
+    environment = {"PATH": os.environ["PATH"], "HOME": logDirectory}
+    subprocess.run([sys.executable, PARSER, os.path.join(logDirectory, "build_log"),
+                    "--output-log-file", os.path.join(outputDirectory, "results"),
+                    "--human-readable", "--only-failed",
+                    "--output-log-json-file", os.path.join(outputDirectory, "results.json"),
+                    "--ctest-sublogs-path", os.path.join(outputDirectory, "ctest_sublogs"),
+                    "--store-directory", os.path.join(outputDirectory, "store"), *arguments],
+                   env=environment, cwd=outputDirectory, stdout=subprocess.DEVNULL, check=True)
+
+
+def readHumanReadableResults(fileName):
+    """Lines of the results, leak summaries of the tests come in the order of the directory listing"""
+    with open(fileName) as file:
+        lines = file.read().split("\n")
+    leakSummaries = sorted(line for line in lines if line.startswith("\t"))
+    return [line for line in lines if not line.startswith("\t")] + leakSummaries
+
+
+def readJsonResults(fileName):
+    with open(fileName) as file:
+        results = json.load(file)
+    return {key: value for key, value in results.items() if key not in ADDED_RESULT_KEYS}
+
+
+@pytest.mark.parametrize("logName", ["passing", "failing", "retried", "valgrind_leak"])
+def testResultsMatchPreviousParser(logName, tmp_path):
+    logDirectory = os.path.join(CTEST_LOGS_DIRECTORY, logName)
+    expectedDirectory = os.path.join(logDirectory, "expected")
+    runParser(logDirectory, str(tmp_path))
+    assert readHumanReadableResults(tmp_path / "results") == \
+        readHumanReadableResults(os.path.join(expectedDirectory, "results"))
+    assert readJsonResults(tmp_path / "results.json") == \
+        readJsonResults(os.path.join(expectedDirectory, "results.json"))
+
+
+def testSublogsOfTests(tmp_path):
+    runParser(os.path.join(CTEST_LOGS_DIRECTORY, "failing"), str(tmp_path))
+    sublogs = sorted(os.listdir(tmp_path / "ctest_sublogs"))
+    assert sublogs == ["connect_test", "mxs_json", "mxs_long_query", "readwritesplit_hang"]
+    assert sorted(os.listdir(tmp_path / "store")) == sublogs
+    sublog = (tmp_path / "store" / "mxs_long_query" / "ctest_sublog").read_text()
+    assert sublog.startswith("test 3\n")
+    assert sublog.rstrip("\n").endswith("***Timeout   3600.01 sec")
+
+
+def testLeakSummaryOfTheFirstRun(tmp_path):
+    runParser(os.path.join(CTEST_LOGS_DIRECTORY, "valgrind_leak"), str(tmp_path))
+    with open(tmp_path / "results.json") as file:
+        leakSummary = json.load(file)["leak_summary"]
+    # Only the first run of the test is checked for leaks, the fields without leaked bytes are left out
+    assert leakSummary["cache_basic"] == ["definitely lost: 64 bytes in 2 blocks",
+                                          "still reachable: 1,024 bytes in 8 blocks"]
+    assert leakSummary["mxs_json"] == ["possibly lost: 1200 bytes in 3 blocks",
+                                       "still reachable: 1,024 bytes in 8 blocks"]
+
+
+def testRerunMarksPassedTestsAsFlaky(tmp_path):
+    logDirectory = os.path.join(CTEST_LOGS_DIRECTORY, "rerun")
+    runParser(logDirectory, str(tmp_path), "--rerun-log", os.path.join(logDirectory, "rerun_log"))
+    with open(tmp_path / "results.json") as file:
+        results = json.load(file)
+    assert results["flaky_tests"] == ["kill_master"]
+    assert results["failure_classes"] == {"kill_master": "flaky", "readwritesplit_hang": "real"}
+    assert [(test["test_name"], test["test_success"]) for test in results["tests"]] == \
+        [("connect_test", "Passed"), ("kill_master", "Passed"), ("readwritesplit_hang", "Failed")]
+    # The summary counts the flaky test as passed
+    summary = readHumanReadableResults(tmp_path / "results")[1:4]
+    assert summary == ["67% tests passed, 1 tests failed out of 3 \\n\\", "3 - readwritesplit_hang (Failed) \\n\\",
+                       " \\n\\"]
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("buildbot")
+
+from maxscale import workers  # noqa: E402
+
+CAPACITIES = {"big-host": {"vms": 10, "cpus": 20, "memory": 40960}}
+FOOTPRINTS = {"run_test": {"vms": 4, "cpus": 8, "memory": 16384}, "build": {"vms": 1, "cpus": 2, "memory": 4096},
+              "huge": {"vms": 20, "cpus": 40, "memory": 81920}, "trigger": {}}
+
+
+def createTracker():
+    registry = workers.WorkerRegistry(
+        [{"name": "big-{}".format(index), "password": "", "host": "big-host"} for index in range(4)]
+        + [{"name": "small-{}".format(index), "password": "", "host": "small-host"} for index in range(2)])
+    return workers.HostLoadTracker(registry, CAPACITIES, FOOTPRINTS)
+
+
+def testScoreIsTheHighestShareOfTheResources():
+    tracker = createTracker()
+    assert tracker.placementScore("big-host", "run_test") == pytest.approx(0.4)
+    tracker.buildStarted(1, "big-0", "run_test")
+    assert tracker.placementScore("big-host", "run_test") == pytest.approx(0.8)
+    assert tracker.placementScore("big-host", "build") == pytest.approx(0.5)
+
+
+def testHostWithoutCapacityForTheBuildIsSkipped():
+    tracker = createTracker()
+    tracker.buildStarted(1, "big-0", "run_test")
+    tracker.buildStarted(2, "big-1", "run_test")
+    assert tracker.placementScore("big-host", "run_test") is None
+    tracker.buildFinished(2)
+    assert tracker.placementScore("big-host", "run_test") == pytest.approx(0.8)
+
+
+def testBuildLargerThanTheHostRunsOnlyOnIdleHost():
+    tracker = createTracker()
+    assert tracker.placementScore("big-host", "huge") == pytest.approx(2)
+    tracker.buildStarted(1, "big-0", "trigger")
+    assert tracker.placementScore("big-host", "huge") == pytest.approx(2)
+    tracker.buildStarted(2, "big-1", "build")
+    assert tracker.placementScore("big-host", "huge") is None
+
+
+def testReservedAndReportedUsageCount():
+    tracker = createTracker()
+    tracker.reserve("big-0", "run_test")
+    assert tracker.placementScore("big-host", "build") == pytest.approx(0.5)
+    tracker.buildStarted(1, "big-0", "run_test")
+    assert tracker.placementScore("big-host", "build") == pytest.approx(0.5)
+    tracker.updateLiveUsage("big-host", {"vms": 2, "cpus": 18, "memory": 0})
+    assert tracker.placementScore("big-host", "build") == pytest.approx(1)
+    assert tracker.placementScore("big-host", "run_test") is None
+
+
+def testHostWithoutConfiguredCapacityIsLimitedByWorkers():
+    tracker = createTracker()
+    assert tracker.placementScore("small-host", "huge") == 0
+    tracker.buildStarted(1, "small-0", "run_test")
+    assert tracker.placementScore("small-host", "run_test") == pytest.approx(0.5)
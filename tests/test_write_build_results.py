@@ -0,0 +1,188 @@
+import pytest
+
+import write_build_results
+from benchmark_result_pipeline import SqliteConnection, createSqliteDatabase
+
+TABLES = ["target_builds", "test_run", "test_cases", "results", "test_flakiness"]
+
+
+def createResults(tests, failureClasses=None):
+    """Results of parse_ctest_log.py for the tests given as (name, status, time) tuples"""
+    results = {
+        "target": "develop-1", "box": "ubuntu_bionic_libvirt", "product": "mariadb", "version": "10.5",
+        "maxscale_system_test_commit": "abc", "maxscale_commit": "def", "cmake_flags": "-DBUILD_TESTS=Y",
+        "maxscale_source": "develop", "job_build_number": "1", "timestamp": "2020-01-01 00-00-00",
+        "job_name": "run_test", "logs_dir": "run_test-1",
+        "leak_summary": {"leaking_test": ["definitely lost: 64 bytes in 2 blocks"]},
+        "tests": [{"test_name": name, "test_success": status, "test_time": time} for name, status, time in tests],
+    }
+    if failureClasses is not None:
+        results["failure_classes"] = failureClasses
+    return results
+
+
+class RecordingConnection(SqliteConnection):
+    """Connection that records the queries run through it"""
+
+    def __init__(self, fileName):
+        super().__init__(fileName)
+        self.queries = []
+
+    def cursor(self, dictionary=False):
+        cursor = super().cursor(dictionary)
+        execute = cursor.execute
+
+        def recordingExecute(query, params=()):
+            self.queries.append(" ".join(query.split()))
+            execute(query, params)
+
+        cursor.execute = recordingExecute
+        return cursor
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    fileName = str(tmp_path / "results.sqlite")
+    createSqliteDatabase(fileName)
+    return fileName
+
+
+def writeResults(database, results, bulk, cache=None):
+    writer = write_build_results.BuildResultsWriter(1, bulk=bulk)
+    writer.client = RecordingConnection(database)
+    if cache is not None:
+        writer.testCaseCache = cache
+        cache.synchronize(writer.client)
+    writer.flakinessEnabled = write_build_results.createFlakinessTable(writer.client)
+    writer.writeBuildResultsToDb(results)
+    writer.client.close()
+    return writer
+
+
+def readTables(database):
+    connection = SqliteConnection(database)
+    cursor = connection.cursor()
+    tables = {}
+    for table in TABLES:
+        cursor.execute("SELECT * FROM {} ORDER BY 1, 2".format(table))
+        tables[table] = [tuple(row) for row in cursor.fetchall()]
+    connection.close()
+    return tables
+
+
+TESTS = [("connect_test", "Passed", "12.05"), ("leaking_test", "Failed", "30.00"),
+         ("kill_master", "Failed", "25.50"), ("kill_master", "Passed", "24.75")]
+FAILURE_CLASSES = {"leaking_test": "real", "kill_master": "flaky"}
+
+
+def testBulkWriteMatchesWriteByTest(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    databases = []
+    for bulk in (False, True):
+        fileName = str(tmp_path / "results_{}.sqlite".format(bulk))
+        createSqliteDatabase(fileName)
+        writeResults(fileName, createResults(TESTS, FAILURE_CLASSES), bulk)
+        databases.append(readTables(fileName))
+    assert databases[0] == databases[1]
+    assert len(databases[1]["results"]) == len(TESTS)
+    assert [row[1] for row in databases[1]["test_cases"]] == ["connect_test", "leaking_test", "kill_master"]
+
+
+def testBulkWriteBatchesQueries(database, monkeypatch):
+    monkeypatch.setattr(write_build_results, "QUERY_BATCH_SIZE", 2)
+    tests = [("test_{}".format(number), "Passed", "1.00") for number in range(5)]
+    writer = writeResults(database, createResults(tests), True)
+    tables = readTables(database)
+    assert len(tables["test_cases"]) == 5
+    assert len(tables["results"]) == 5
+    inserts = [query for query in writer.client.queries if query.startswith("INSERT INTO test_cases")]
+    assert len(inserts) == 3
+
+
+def testBulkWriteRollsBackOnFailure(database, monkeypatch):
+    def failingWrite(self, rows):
+        raise RuntimeError("lost connection")
+
+    monkeypatch.setattr(write_build_results.BuildResultsWriter, "writeResultsTableInBulk", failingWrite)
+    with pytest.raises(RuntimeError):
+        writeResults(database, createResults(TESTS, FAILURE_CLASSES), True)
+    tables = readTables(database)
+    assert tables["test_cases"] == []
+    assert tables["results"] == []
+
+
+def deleteTestCase(database, name):
+    connection = SqliteConnection(database)
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM test_cases WHERE name = %s", (name,))
+    connection.commit()
+    connection.close()
+
+
+def testCacheLoadsOnlyNewTestCases(database):
+    writeResults(database, createResults(TESTS), True)
+    cache = write_build_results.TestCaseCache()
+    connection = RecordingConnection(database)
+    cache.synchronize(connection)
+    assert set(cache.testCases) == {"connect_test", "leaking_test", "kill_master"}
+    writeResults(database, createResults([("new_test", "Passed", "1.00")]), True)
+    connection.queries = []
+    cache.synchronize(connection)
+    connection.close()
+    assert cache.get("new_test") is not None
+    assert "SELECT id, name FROM test_cases WHERE id > %s ORDER BY id" in connection.queries
+    assert "SELECT id, name FROM test_cases ORDER BY id" not in connection.queries
+
+
+@pytest.mark.parametrize("removedTest", ["leaking_test", "kill_master"])
+def testCacheIsReloadedWhenTestCasesAreRemoved(database, removedTest):
+    writeResults(database, createResults(TESTS), True)
+    cache = write_build_results.TestCaseCache()
+    connection = SqliteConnection(database)
+    cache.synchronize(connection)
+    deleteTestCase(database, removedTest)
+    cache.synchronize(connection)
+    connection.close()
+    assert cache.get(removedTest) is None
+    assert set(cache.testCases) == {"connect_test", "leaking_test", "kill_master"} - {removedTest}
+
+
+def testCachedTestCasesAreNotLookedUp(database, tmp_path):
+    cache = write_build_results.TestCaseCache(str(tmp_path / "cache" / "test_cases.json"))
+    writeResults(database, createResults(TESTS), True, cache)
+    cache.save()
+    restoredCache = write_build_results.TestCaseCache(cache.fileName)
+    restoredCache.load()
+    assert restoredCache.testCases == cache.testCases
+    writer = writeResults(database, createResults(TESTS), True, restoredCache)
+    assert not [query for query in writer.client.queries if "WHERE name IN" in query]
+    assert len(readTables(database)["test_cases"]) == 3
+
+
+def testDamagedCacheIsIgnored(tmp_path):
+    fileName = tmp_path / "test_cases.json"
+    fileName.write_text("{\"max_id\": 3")
+    cache = write_build_results.TestCaseCache(str(fileName))
+    cache.load()
+    assert (cache.testCases, cache.maxId, cache.count) == ({}, 0, 0)
+
+
+def testCacheFileIsNamedByTheDatabase():
+    cache = write_build_results.TestCaseCache.fromDirectory(
+        "/var/cache", '{"host": "db.example.com:3306", "database": "test_results"}')
+    assert cache.fileName == "/var/cache/test_cases_db.example.com_3306_test_results.json"
+    assert write_build_results.TestCaseCache.fromDirectory("", "{}").fileName is None
+
+
+def testFlakeScoresAreUpdatedByEachRun(database):
+    writeResults(database, createResults(TESTS, FAILURE_CLASSES), True)
+    writeResults(database, createResults(TESTS, {"leaking_test": "real", "kill_master": "real"}), True)
+    connection = SqliteConnection(database)
+    cursor = connection.cursor()
+    cursor.execute("SELECT name, flake_score, runs, flaky_runs FROM test_flakiness "
+                   "JOIN test_cases ON test_cases.id = test_case_id ORDER BY name")
+    scores = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    connection.close()
+    assert scores["connect_test"] == (0, 2, 0)
+    assert scores["kill_master"] == (pytest.approx(0.09), 2, 1)